@@ -0,0 +1,239 @@
+"""
+Несколько аккаунтов Яндекс Диска: выбор аккаунта для каждого видео
+"""
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import metrics
+from quota import QuotaCache, QuotaError
+from shared_file import read_json, shared_state, write_json
+from yandex_disk import YandexDiskClient, YandexWebDAVClient
+
+logger = logging.getLogger(__name__)
+
+
+class YandexAccount:
+    """
+    Аккаунт Яндекс Диска: свой клиент (пул соединений, повторы), кэш папок и квота
+
+    webdav — клиент выгрузки через WebDAV с тем же кэшем папок (если
+    хоть один чат выгружает через WebDAV).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: YandexDiskClient,
+        quota: QuotaCache,
+        webdav: Optional[YandexWebDAVClient] = None
+    ):
+        self.name = name
+        self.client = client
+        self.quota = quota
+        self.webdav = webdav
+
+        self.inflight = 0  # Байт, которые сейчас выгружаются на этот аккаунт
+        self.uploads = 0  # Выгрузок в работе
+
+    @property
+    def available(self) -> int:
+        """Свободное место с учетом выгрузок в работе"""
+        return self.quota.free - self.inflight
+
+    @property
+    def clients(self) -> List[YandexDiskClient]:
+        return [self.client] if self.webdav is None else [self.client, self.webdav]
+
+    def backend(self, kind: str) -> YandexDiskClient:
+        """Клиент для выгрузки через REST API (rest) или WebDAV (webdav)"""
+        if kind == "webdav" and self.webdav is not None:
+            return self.webdav
+        return self.client
+
+    def __repr__(self):
+        return f"YandexAccount({self.name})"
+
+
+class AccountRouter:
+    """
+    Распределяет видео по аккаунтам.
+
+    Папка даты закрепляется за аккаунтом, на который попало первое видео
+    этого дня, — так ссылка на день ведет в одно место. Новая папка
+    достается аккаунту с наибольшим свободным местом (за вычетом выгрузок
+    в работе), при равенстве — наименее загруженному. Если на закрепленном
+    аккаунте место кончилось, видео уходит на другой, и у дня появляется
+    вторая ссылка.
+
+    Закрепления сохраняются в JSON-файл и переживают перезапуск.
+    Несколько процессов с общим DATA_DIR закрепляют папки под
+    межпроцессной блокировкой (shared_lock): закрепление, сделанное
+    первым процессом, видят и соблюдают остальные.
+    """
+
+    def __init__(self, accounts: List[YandexAccount], path: Optional[Path] = None):
+        if not accounts:
+            raise ValueError("At least one Yandex Disk account is required")
+        self.accounts = accounts
+        self.path = path
+        self._by_name: Dict[str, YandexAccount] = {account.name: account for account in accounts}
+        self._placements: Dict[str, str] = {}  # папка даты -> имя аккаунта
+
+        for account in accounts:
+            metrics.DISK_INFLIGHT_BYTES.labels(account=account.name).set_function(
+                lambda account=account: account.inflight
+            )
+
+    @property
+    def primary(self) -> YandexAccount:
+        return self.accounts[0]
+
+    def get(self, name: Optional[str]) -> YandexAccount:
+        """Аккаунт по имени (неизвестное имя — основной аккаунт)"""
+        return self._by_name.get(name, self.primary) if name else self.primary
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            placements = read_json(self.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Folder placements {self.path} are unreadable, starting empty: {e}")
+            return
+        if placements is not None:
+            self._placements = {
+                folder: name for folder, name in placements.items() if name in self._by_name
+            }
+
+    async def save(self):
+        if self.path is None:
+            return
+        data = json.dumps(self._placements, ensure_ascii=False, indent=1)
+        try:
+            await asyncio.to_thread(write_json, self.path, data)
+        except OSError as e:
+            logger.error(f"Failed to save folder placements: {e}")
+
+    def _merge(self, placements: dict):
+        """Подхватывает закрепления, сохраненные другими процессами (они сделаны раньше)"""
+        self._placements.update(
+            (folder, name) for folder, name in placements.items() if name in self._by_name
+        )
+
+    @asynccontextmanager
+    async def shared_lock(self):
+        """
+        Межпроцессная блокировка для закрепления папок
+
+        После ее получения закрепления дополняются записями с диска, так что
+        папку, уже закрепленную другим процессом, второй раз не закрепляют.
+        """
+        if self.path is None:
+            yield
+            return
+        async with shared_state(self.path, self._merge):
+            yield
+
+    async def learn(self, account: YandexAccount, folders: Iterable[str]):
+        """Закрепляет за аккаунтом папки, которые на нем уже есть"""
+        async with self.shared_lock():
+            added = 0
+            for folder in folders:
+                if folder not in self._placements:
+                    self._placements[folder] = account.name
+                    added += 1
+            if added:
+                await self.save()
+
+    def placement(self, folder_name: str) -> Optional[YandexAccount]:
+        name = self._placements.get(folder_name)
+        return self._by_name.get(name) if name else None
+
+    async def pick(self, folder_name: str, size: int) -> YandexAccount:
+        """
+        Выбирает аккаунт для видео и учитывает его как выгружаемое
+
+        После выгрузки нужно вызвать release().
+
+        Raises:
+            QuotaError: видео не помещается ни на один аккаунт
+        """
+        # Квота еще не известна — считаем, что место есть
+        def fits(account: YandexAccount) -> bool:
+            return not account.quota.known or account.available >= size
+
+        def roomiest() -> YandexAccount:
+            candidates = [a for a in self.accounts if fits(a)]
+            if not candidates:
+                raise QuotaError(
+                    f"Not enough space on any Yandex Disk account: "
+                    f"need {size / (1024*1024):.0f} MB"
+                )
+            return max(candidates, key=lambda a: (a.available, -a.uploads))
+
+        account = self.placement(folder_name)
+        if account is None:
+            async with self.shared_lock():
+                # Папку мог закрепить другой процесс
+                account = self.placement(folder_name)
+                if account is None:
+                    account = roomiest()
+                    self._placements[folder_name] = account.name
+                    await self.save()
+
+        if not fits(account):
+            sticky = account
+            account = roomiest()
+            logger.warning(
+                f"Account {sticky.name} is full, folder {folder_name} "
+                f"continues on account {account.name}"
+            )
+
+        account.inflight += size
+        account.uploads += 1
+        return account
+
+    def release(self, account: YandexAccount, size: int):
+        account.inflight -= size
+        account.uploads -= 1
+
+    @asynccontextmanager
+    async def route(self, folder_name: str, size: int):
+        """pick() на время выгрузки: аккаунт освобождается при выходе из блока"""
+        account = await self.pick(folder_name, size)
+        try:
+            yield account
+        finally:
+            self.release(account, size)
+
+    def check(self, size: int, pending: int = 0):
+        """
+        Проверяет до постановки в очередь, что видео поместится хоть куда-то
+
+        Args:
+            size: Размер видео
+            pending: Байты задач в очереди и в работе (еще не распределены по аккаунтам)
+
+        Raises:
+            QuotaError: места не хватит
+        """
+        if len(self.accounts) == 1:
+            self.primary.quota.check(size, pending)
+            return
+
+        known = [a for a in self.accounts if a.quota.known]
+        if len(known) < len(self.accounts):
+            return  # Квота части аккаунтов еще не известна — не мешаем загрузке
+
+        largest = max(a.quota.free for a in known)
+        available = sum(a.quota.free for a in known) - pending
+        if size > largest or size > available:
+            raise QuotaError(
+                f"Not enough space on Yandex Disk: need {size / (1024*1024):.0f} MB, "
+                f"{max(min(largest, available), 0) / (1024*1024):.0f} MB free"
+            )
@@ -0,0 +1,147 @@
+"""
+Обработка альбомов (media group) одной пачкой
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class AlbumCollector:
+    """
+    Собирает сообщения одного альбома.
+
+    Telegram присылает альбом отдельными сообщениями с общим
+    media_group_id. Сообщения копятся, пока в течение window секунд
+    не перестанут приходить новые, после чего весь альбом передается
+    в on_album одним списком (в порядке сообщений).
+    """
+
+    def __init__(
+        self,
+        window: float,
+        on_album: Callable[[List[Message]], Awaitable[None]]
+    ):
+        self.window = window
+        self._on_album = on_album
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+        self._timers: Dict[Tuple[int, str], asyncio.Task] = {}
+
+    def add(self, message: Message):
+        key = (message.chat.id, message.media_group_id)
+        self._albums.setdefault(key, []).append(message)
+
+        # Каждое новое сообщение альбома продлевает окно ожидания
+        timer = self._timers.get(key)
+        if timer is not None:
+            timer.cancel()
+        self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: Tuple[int, str]):
+        await asyncio.sleep(self.window)
+
+        self._timers.pop(key, None)
+        messages = sorted(self._albums.pop(key, []), key=lambda m: m.id)
+        if not messages:
+            return
+
+        logger.info(f"Album {key[1]} collected: {len(messages)} videos")
+        try:
+            await self._on_album(messages)
+        except Exception as e:
+            logger.error(f"Failed to process album {key[1]}: {e}", exc_info=True)
+
+    async def stop(self):
+        timers = list(self._timers.values())
+        for timer in timers:
+            timer.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
+        self._timers.clear()
+        self._albums.clear()
+
+
+class AlbumBatch:
+    """Общее состояние задач одного альбома: один статус и один итог на всех"""
+
+    def __init__(self, status_msg: Message, total: int):
+        self.status_msg = status_msg
+        self.total = total
+        self.jobs = []
+
+        self.finished = 0
+        self.duplicates = 0
+        self.failed: List[Tuple[str, str]] = []  # (файл, ошибка)
+        # папка -> публичные ссылки (по одной на аккаунт, если день разошелся по нескольким)
+        self.folders: Dict[str, List[str]] = {}
+
+    @property
+    def complete(self) -> bool:
+        return self.finished >= self.total
+
+    def add_result(self, folder_name: Optional[str], public_url: Optional[str], duplicate: bool = False):
+        self.finished += 1
+        if duplicate:
+            self.duplicates += 1
+        if folder_name and public_url:
+            links = self.folders.setdefault(folder_name, [])
+            if public_url not in links:
+                links.append(public_url)
+
+    def add_failure(self, filename: str, error: str):
+        self.finished += 1
+        self.failed.append((filename, error))
+
+    def progress_text(self) -> str:
+        size = sum(job.file_size for job in self.jobs) or 1
+        downloaded = sum(job.bytes_downloaded for job in self.jobs)
+        uploaded = sum(job.bytes_uploaded for job in self.jobs)
+
+        lines = [
+            f"⏳ Загружаю альбом ({len(self.jobs)} видео, {size / (1024 * 1024):.1f} MB)...",
+            f"✔️ Готово: {self.finished} из {self.total}",
+        ]
+        if downloaded:
+            lines.append(f"📥 Скачано: {downloaded * 100 // size}%")
+        if uploaded:
+            lines.append(f"📤 Выгружено: {uploaded * 100 // size}%")
+        return "\n".join(lines)
+
+    def result_text(self) -> str:
+        saved = self.total - len(self.failed)
+        if self.failed:
+            lines = [f"⚠️ Альбом загружен частично: {saved} из {self.total}"]
+        else:
+            lines = [f"✅ Альбом успешно загружен ({self.total} видео)!"]
+
+        if self.duplicates:
+            lines.append(f"♻️ Уже были на диске: {self.duplicates}")
+
+        lines.append("")
+        for folder_name, links in sorted(self.folders.items()):
+            lines.append(f"📁 Папка: {folder_name}")
+            for public_url in links:
+                lines.append(f"Все видео за этот день: {public_url}")
+
+        if self.failed:
+            lines.append("")
+            lines.append("❌ Ошибки:")
+            for filename, error in self.failed:
+                lines.append(f"• {filename}: {error}")
+
+        return "\n".join(lines)
+
+    def failure_text(self) -> Optional[str]:
+        """Уведомление администраторам, если что-то не загрузилось"""
+        if not self.failed:
+            return None
+        errors = "\n".join(f"• {filename}: {error}" for filename, error in self.failed)
+        username = self.jobs[0].username if self.jobs else "unknown"
+        return (
+            f"⚠️ Ошибка загрузки альбома:\n\n"
+            f"Пользователь: {username}\n"
+            f"Не загружено {len(self.failed)} из {self.total}:\n{errors}"
+        )
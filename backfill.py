@@ -0,0 +1,158 @@
+"""
+Бэкфилл: загрузка видео, отправленных в чат, пока бот не работал
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+async def iter_history(
+    client: Client,
+    chat_id: int,
+    start_id: int,
+    end_id: int,
+    batch_size: int = 200
+) -> AsyncIterator[Tuple[int, List[Message]]]:
+    """
+    Сообщения чата с id от start_id до end_id включительно, пачками
+
+    Ботам недоступен messages.getHistory, поэтому история читается
+    через get_messages по диапазонам id (до 200 за запрос). Удаленные
+    и служебные сообщения приходят пустыми и пропускаются.
+
+    Yields:
+        (последний id пачки, непустые сообщения пачки)
+    """
+    next_id = start_id
+    while next_id <= end_id:
+        ids = list(range(next_id, min(next_id + batch_size, end_id + 1)))
+        try:
+            messages = await client.get_messages(chat_id, ids)
+        except FloodWait as e:
+            logger.warning(f"FloodWait {e.value}s while reading history of chat {chat_id}")
+            await asyncio.sleep(e.value)
+            continue
+
+        yield ids[-1], [m for m in messages if m is not None and not m.empty]
+        next_id = ids[-1] + 1
+
+
+class BackfillRun:
+    """
+    Состояние бэкфилла одного чата.
+
+    Работает как пачка задач (см. AlbumBatch): все найденные видео
+    отчитываются в одно статусное сообщение. Позиция просмотра истории
+    сохраняется в журнале (checkpoint), так что прерванный бэкфилл
+    продолжается с того же места.
+    """
+
+    def __init__(
+        self,
+        chat_id: int,
+        status_msg: Message,
+        next_id: int,
+        end_id: int,
+        status_message_id: Optional[int] = None
+    ):
+        self.chat_id = chat_id
+        self.status_msg = status_msg
+        # Задачи в журнале привязаны к исходному статусному сообщению
+        self.status_message_id = status_message_id or status_msg.id
+        self.start_id = next_id
+        self.next_id = next_id
+        self.end_id = end_id
+
+        self.scan_done = False
+        self.found = 0  # Видео, поставленные в очередь
+        self.skipped = 0  # Видео, которые уже есть на диске
+        self.finished = 0
+        self.duplicates = 0
+        self.failed: List[Tuple[str, str]] = []  # (файл, ошибка)
+        self.folders = set()
+
+        self.task: Optional[asyncio.Task] = None  # Просмотр истории
+        self.stopped = False  # Остановлен командой, а не перезапуском бота
+
+    @property
+    def total(self) -> int:
+        return self.found
+
+    @property
+    def complete(self) -> bool:
+        return self.scan_done and self.finished >= self.found
+
+    def checkpoint(self, status: Optional[str] = None) -> dict:
+        """Поля контрольной точки для журнала"""
+        return {
+            "status_message_id": self.status_message_id,
+            "next_message_id": self.next_id,
+            "end_message_id": self.end_id,
+            "found": self.found,
+            "skipped": self.skipped,
+            "status": status or ("done" if self.complete else "running"),
+        }
+
+    def add_result(self, folder_name: Optional[str], public_url: Optional[str], duplicate: bool = False):
+        self.finished += 1
+        if duplicate:
+            self.duplicates += 1
+        if folder_name:
+            self.folders.add(folder_name)
+
+    def add_failure(self, filename: str, error: str):
+        self.finished += 1
+        self.failed.append((filename, error))
+
+    def progress_text(self) -> str:
+        scanned = self.next_id - self.start_id
+        to_scan = self.end_id - self.start_id + 1
+        lines = [
+            "⏳ Бэкфилл истории чата...",
+            f"🔎 Просмотрено сообщений: {scanned} из {to_scan}",
+            f"🎥 Найдено новых видео: {self.found}",
+            f"✔️ Загружено: {self.finished - len(self.failed)} из {self.found}",
+        ]
+        if self.skipped:
+            lines.append(f"♻️ Уже были на диске: {self.skipped}")
+        if self.failed:
+            lines.append(f"❌ Ошибок: {len(self.failed)}")
+        return "\n".join(lines)
+
+    def result_text(self) -> str:
+        saved = self.found - len(self.failed)
+        if self.failed:
+            lines = [f"⚠️ Бэкфилл завершен с ошибками: загружено {saved} из {self.found}"]
+        else:
+            lines = [f"✅ Бэкфилл завершен: загружено {saved} видео"]
+
+        if self.skipped or self.duplicates:
+            lines.append(f"♻️ Уже были на диске: {self.skipped + self.duplicates}")
+        if self.folders:
+            lines.append(f"📁 Папок с датами: {len(self.folders)}")
+
+        if self.failed:
+            lines.append("")
+            lines.append("❌ Ошибки:")
+            for filename, error in self.failed[:20]:
+                lines.append(f"• {filename}: {error}")
+            if len(self.failed) > 20:
+                lines.append(f"... и еще {len(self.failed) - 20}")
+
+        return "\n".join(lines)
+
+    def failure_text(self) -> Optional[str]:
+        """Уведомление администраторам, если что-то не загрузилось"""
+        if not self.failed:
+            return None
+        return (
+            f"⚠️ Ошибки бэкфилла чата {self.chat_id}:\n\n"
+            f"Не загружено {len(self.failed)} из {self.found} видео"
+        )
@@ -0,0 +1,183 @@
+"""
+Поддельные сообщения и клиент Telegram для бенчмарков
+
+FakeClient отдает содержимое видео так же, как Client.stream_media в
+Pyrogram: чанками по 1 MiB с поддержкой offset/limit, с настраиваемыми
+задержкой запроса и скоростью одного соединения.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+
+# Общий случайный блок: содержимое чанка = заголовок (файл, номер) + блок,
+# так что у разных файлов разные хеши, а генерация ничего не стоит
+_BLOCK = os.urandom(CHUNK_SIZE)
+
+_message_ids = count(1)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, username: Optional[str] = None):
+        self.id = user_id
+        self.username = username or f"user{user_id}"
+        self.first_name = self.username
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class FakeVideo:
+    def __init__(
+        self,
+        file_unique_id: str,
+        file_size: int,
+        file_name: Optional[str] = None,
+        mime_type: str = "video/mp4"
+    ):
+        self.file_unique_id = file_unique_id
+        self.file_size = file_size
+        self.file_name = file_name or f"{file_unique_id}.mp4"
+        self.mime_type = mime_type
+
+
+class FakeMessage:
+    """
+    Сообщение чата; у статусных сообщений записываются все правки
+
+    kind — атрибут, в котором лежит видео: video, video_note, animation или document.
+    """
+
+    FINAL_MARKS = ("✅", "❌", "⚠️")
+
+    def __init__(
+        self,
+        chat: FakeChat,
+        from_user: Optional[FakeUser] = None,
+        video: Optional[FakeVideo] = None,
+        media_group_id: Optional[str] = None,
+        text: str = "",
+        date: Optional[datetime] = None,
+        kind: str = "video"
+    ):
+        self.id = next(_message_ids)
+        self.chat = chat
+        self.from_user = from_user
+        self.video = self.video_note = self.animation = self.document = None
+        setattr(self, kind, video)
+        self.media = video
+        self.media_group_id = media_group_id
+        self.text = text
+        self.date = date or datetime.now()
+        self.command = text[1:].split() if text.startswith("/") else None
+        self.empty = False
+
+        self.created_at = time.monotonic()
+        self.edits: List[str] = []
+        self.replies: List["FakeMessage"] = []
+        self.finished_at: Optional[float] = None
+        self.finished = asyncio.Event()
+
+    def _record(self, text: str):
+        self.text = text
+        if text.startswith(self.FINAL_MARKS) and self.finished_at is None:
+            self.finished_at = time.monotonic()
+            self.finished.set()
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        reply = FakeMessage(self.chat, text=text)
+        reply._record(text)
+        self.replies.append(reply)
+        return reply
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.edits.append(text)
+        self._record(text)
+        return self
+
+
+class FakeClient:
+    """
+    Замена pyrogram.Client для скачивания.
+
+    Args:
+        latency: Задержка перед первым чанком каждого запроса (секунды)
+        bandwidth: Скорость одного запроса stream_media (байт/с, 0 — без ограничения)
+    """
+
+    def __init__(self, latency: float = 0.0, bandwidth: float = 0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_sent = 0
+        self.sent_messages: List[str] = []
+        self.history: Dict[Tuple[int, int], FakeMessage] = {}  # (chat_id, id) -> сообщение
+        self.history_requests = 0
+
+    def add_history(self, message: FakeMessage):
+        """Сообщение, доступное через get_messages (история чата)"""
+        self.history[(message.chat.id, message.id)] = message
+
+    @staticmethod
+    def chunk(video: FakeVideo, index: int) -> bytes:
+        """Детерминированное содержимое чанка с номером index"""
+        size = min(CHUNK_SIZE, video.file_size - index * CHUNK_SIZE)
+        header = f"{video.file_unique_id}:{index}:".encode()
+        return (header + _BLOCK)[:size]
+
+    async def stream_media(self, message: FakeMessage, limit: int = 0, offset: int = 0):
+        video = message.media
+        total_chunks = -(-video.file_size // CHUNK_SIZE)
+        end = total_chunks if not limit else min(total_chunks, offset + limit)
+
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        started = time.monotonic()
+        sent = 0
+        for index in range(offset, end):
+            data = self.chunk(video, index)
+            sent += len(data)
+            self.bytes_sent += len(data)
+            if self.bandwidth:
+                ahead = sent / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+            else:
+                await asyncio.sleep(0)
+            yield data
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        self.sent_messages.append(text)
+        return FakeMessage(FakeChat(chat_id), text=text)
+
+    async def get_messages(self, chat_id: int, message_ids):
+        self.history_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        def lookup(message_id: int) -> FakeMessage:
+            message = self.history.get((chat_id, message_id))
+            if message is None:
+                # Ответы бота (статусные сообщения) тоже есть в истории чата
+                message = next(
+                    (reply for known in self.history.values() for reply in known.replies
+                     if reply.chat.id == chat_id and reply.id == message_id),
+                    None
+                )
+            if message is None:
+                message = FakeMessage(FakeChat(chat_id))
+                message.empty = True
+            return message
+
+        if isinstance(message_ids, list):
+            return [lookup(message_id) for message_id in message_ids]
+        return lookup(message_ids)
@@ -0,0 +1,254 @@
+"""
+Локальная замена Яндекс Диска для бенчмарков
+
+Эмулирует те эндпоинты REST API, которыми пользуется YandexDiskClient,
+и PUT/MKCOL WebDAV (YandexWebDAVClient) с настраиваемыми задержкой, пропускной способностью и долей ошибок.
+Содержимое файлов не хранится — только размер и хеши.
+"""
+
+import asyncio
+import hashlib
+import random
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakeYandexDisk:
+    """
+    Эмулятор Яндекс Диска на aiohttp.
+
+    Args:
+        latency: Задержка ответа каждого вызова API (секунды)
+        bandwidth: Скорость приема тела PUT (байт/с, 0 — без ограничения)
+        error_rate: Доля запросов, на которые отвечаем 503
+        corrupt_rate: Доля загрузок, сохраняемых с неверным хешем (порча при передаче)
+        total_space: Размер диска в байтах
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: float = 0,
+        error_rate: float = 0.0,
+        corrupt_rate: float = 0.0,
+        total_space: int = 1024 ** 4,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.corrupt_rate = corrupt_rate
+        self.total_space = total_space
+        self._random = random.Random(seed)
+
+        self.folders: Dict[str, Optional[str]] = {}  # путь -> public_url
+        self.files: Dict[str, dict] = {}  # путь -> {size, md5, sha256}
+        self.uploads: Dict[str, str] = {}  # токен -> путь файла
+
+        self.calls = Counter()  # (метод, эндпоинт) -> количество
+        self.errors = Counter()
+
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1/disk"
+
+    @property
+    def webdav_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/webdav"
+
+    @property
+    def api_calls(self) -> int:
+        """Вызовы REST API (без PUT тела файла)"""
+        return sum(n for (method, endpoint), n in self.calls.items() if endpoint != "upload-href")
+
+    async def start(self):
+        app = web.Application(client_max_size=1024 ** 4)
+        app.router.add_get("/v1/disk/", self._disk)
+        app.router.add_route("*", "/v1/disk/resources", self._resources)
+        app.router.add_get("/v1/disk/resources/files", self._files)
+        app.router.add_get("/v1/disk/resources/upload", self._upload_link)
+        app.router.add_put("/v1/disk/resources/publish", self._publish)
+        app.router.add_put("/upload/{token}", self._upload)
+        app.router.add_route("MKCOL", "/webdav/{path:.*}", self._webdav_mkcol)
+        app.router.add_put("/webdav/{path:.*}", self._webdav_put)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _api(self, request: web.Request, endpoint: str) -> Optional[web.Response]:
+        """Общая часть всех вызовов: учет, задержка, случайные ошибки"""
+        self.calls[(request.method, endpoint)] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors[(request.method, endpoint)] += 1
+            return self._error(503, "ServiceUnavailableError", "Injected failure")
+        return None
+
+    @staticmethod
+    def _error(status: int, error: str, description: str) -> web.Response:
+        return web.json_response({"error": error, "description": description}, status=status)
+
+    @staticmethod
+    def _path(request: web.Request) -> str:
+        path = request.query.get("path", "").strip("/")
+        return path[len("disk:/"):] if path.startswith("disk:/") else path
+
+    def _parent_exists(self, path: str) -> bool:
+        parent = path.rsplit("/", 1)[0] if "/" in path else ""
+        return parent == "" or parent in self.folders
+
+    async def _disk(self, request: web.Request) -> web.Response:
+        error = await self._api(request, "disk")
+        if error:
+            return error
+        used = sum(f["size"] for f in self.files.values())
+        return web.json_response({"total_space": self.total_space, "used_space": used})
+
+    async def _resources(self, request: web.Request) -> web.Response:
+        error = await self._api(request, "resources")
+        if error:
+            return error
+        path = self._path(request)
+
+        if request.method == "DELETE":
+            if self.files.pop(path, None) is None and self.folders.pop(path, 0) == 0:
+                return self._error(404, "DiskNotFoundError", "not found")
+            return web.Response(status=204)
+
+        if request.method == "PUT":
+            if path in self.folders:
+                return self._error(409, "DiskPathPointsToExistentDirectoryError", "exists")
+            if not self._parent_exists(path):
+                return self._error(409, "DiskPathDoesntExistsError", "no parent")
+            self.folders[path] = None
+            return web.json_response({"href": f"{self.base_url}/resources?path={path}"}, status=201)
+
+        if path in self.files:
+            return web.json_response({"path": f"disk:/{path}", "type": "file", **self.files[path]})
+
+        if path not in self.folders:
+            return self._error(404, "DiskNotFoundError", "not found")
+
+        result = {"path": f"disk:/{path}", "type": "dir"}
+        if self.folders[path]:
+            result["public_url"] = self.folders[path]
+
+        if "limit" in request.query:
+            limit = int(request.query["limit"])
+            offset = int(request.query.get("offset", 0))
+            children = sorted(
+                p for p in self.folders if p.rsplit("/", 1)[0] == path and "/" in p
+            )
+            items = [
+                {"name": p.rsplit("/", 1)[1], "type": "dir", "public_url": self.folders[p]}
+                for p in children[offset:offset + limit]
+            ]
+            result["_embedded"] = {"items": items, "total": len(children)}
+
+        return web.json_response(result)
+
+    async def _files(self, request: web.Request) -> web.Response:
+        error = await self._api(request, "files")
+        if error:
+            return error
+        limit = int(request.query.get("limit", 20))
+        offset = int(request.query.get("offset", 0))
+        items = [
+            {"path": f"disk:/{path}", **meta}
+            for path, meta in sorted(self.files.items())[offset:offset + limit]
+        ]
+        return web.json_response({"items": items})
+
+    async def _upload_link(self, request: web.Request) -> web.Response:
+        error = await self._api(request, "upload")
+        if error:
+            return error
+        path = self._path(request)
+        if path in self.files and request.query.get("overwrite") != "true":
+            return self._error(409, "DiskResourceAlreadyExistsError", "exists")
+        if not self._parent_exists(path):
+            return self._error(409, "DiskPathDoesntExistsError", "no parent")
+
+        token = uuid.uuid4().hex
+        self.uploads[token] = path
+        href = f"http://127.0.0.1:{self.port}/upload/{token}"
+        return web.json_response({"href": href, "method": "PUT", "templated": False})
+
+    async def _publish(self, request: web.Request) -> web.Response:
+        error = await self._api(request, "publish")
+        if error:
+            return error
+        path = self._path(request)
+        if path not in self.folders:
+            return self._error(404, "DiskNotFoundError", "not found")
+        if not self.folders[path]:
+            self.folders[path] = f"https://disk.yandex.ru/d/{uuid.uuid4().hex[:14]}"
+        return web.json_response({"href": f"{self.base_url}/resources?path={path}"})
+
+    async def _upload(self, request: web.Request) -> web.Response:
+        self.calls[("PUT", "upload-href")] += 1
+        path = self.uploads.pop(request.match_info["token"], None)
+        if path is None:
+            return self._error(404, "NotFound", "upload href expired")
+        return await self._receive(request, path)
+
+    async def _webdav_mkcol(self, request: web.Request) -> web.Response:
+        error = await self._api(request, "webdav")
+        if error:
+            return error
+        path = request.match_info["path"].strip("/")
+        if path in self.folders:
+            return web.Response(status=405)
+        if not self._parent_exists(path):
+            return web.Response(status=409)
+        self.folders[path] = None
+        return web.Response(status=201)
+
+    async def _webdav_put(self, request: web.Request) -> web.Response:
+        # Тело файла учитывается вместе с PUT по URL загрузки REST API
+        self.calls[("PUT", "upload-href")] += 1
+        path = request.match_info["path"].strip("/")
+        if not request.headers.get("Authorization", "").startswith("OAuth "):
+            return web.Response(status=401)
+        if not self._parent_exists(path):
+            return web.Response(status=409)
+        return await self._receive(request, path)
+
+    async def _receive(self, request: web.Request, path: str) -> web.Response:
+        """Принимает тело файла, считает хеши и сохраняет метаданные"""
+        md5, sha256, size = hashlib.md5(), hashlib.sha256(), 0
+        started = asyncio.get_running_loop().time()
+        async for chunk in request.content.iter_any():
+            md5.update(chunk)
+            sha256.update(chunk)
+            size += len(chunk)
+            if self.bandwidth:
+                # Держим среднюю скорость приема не выше bandwidth
+                ahead = size / self.bandwidth - (asyncio.get_running_loop().time() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors[("PUT", "upload-href")] += 1
+            return self._error(503, "ServiceUnavailableError", "Injected failure")
+
+        self.files[path] = {"size": size, "md5": md5.hexdigest(), "sha256": sha256.hexdigest()}
+        if self.corrupt_rate and self._random.random() < self.corrupt_rate:
+            self.errors[("PUT", "corrupted")] += 1
+            self.files[path] = {"size": size, "md5": "0" * 32, "sha256": "0" * 64}
+        return web.Response(status=201)
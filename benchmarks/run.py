@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк бота: VideoBackupBot целиком против локальных
+заглушек Telegram и Яндекс Диска
+
+Запуск:
+    python -m benchmarks.run --scenario burst --videos 20 --size-mb 50
+    python -m benchmarks.run --scenario all --yd-latency 0.05 --error-rate 0.02
+    python -m benchmarks.run --scenario single --env STREAM_UPLOADS=false --json
+    python -m benchmarks.run --scenario backfill --videos 50 --env BACKFILL_WORKERS=8
+    python -m benchmarks.run --scenario burst --workers 3
+    python -m benchmarks.run --scenario burst --env STORAGE_BACKEND=webdav
+
+Отчет: пропускная способность, перцентили задержки на видео (от
+получения сообщения до итогового статуса в чате), вызовы API на видео
+и пиковый RSS процесса.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from benchmarks.fake_telegram import FakeChat, FakeClient, FakeMessage, FakeUser, FakeVideo
+from benchmarks.fake_yandex import FakeYandexDisk
+
+MB = 1024 * 1024
+
+SCENARIOS = ("single", "burst", "album", "duplicates", "backfill", "clips", "client")
+
+# Короткие ролики сценария clips (меньше MEMORY_UPLOAD_MB — выгружаются из памяти)
+CLIP_SIZE = 2 * MB
+CLIP_KINDS = ("video_note", "animation", "document", "video")
+
+# Значения по умолчанию, при которых бенчмарк не ждет реальных таймаутов
+BENCH_ENV = {
+    "TELEGRAM_BOT_TOKEN": "0:benchmark",
+    "TELEGRAM_API_ID": "1",
+    "TELEGRAM_API_HASH": "0" * 32,
+    "YANDEX_OAUTH_TOKEN": "benchmark",
+    "DEDUP_SEED_ON_START": "false",
+    "UPLOAD_RETRY_BASE_DELAY": "0.05",
+    "UPLOAD_RETRY_MAX_DELAY": "1",
+    "STATUS_CHAT_INTERVAL": "0.2",
+    "STATUS_GLOBAL_RATE": "100",
+    "ALBUM_WINDOW": "0.2",
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss на Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Workload:
+    """Входящие сообщения сценария и статусы, которых нужно дождаться"""
+
+    def __init__(self):
+        self.messages: List[Tuple[FakeMessage, bool]] = []  # (сообщение, ждать ли его статус)
+        self.warmup: List[FakeMessage] = []  # Обрабатываются до начала замера
+        self.history: List[FakeMessage] = []  # Пришли, пока бот не работал
+        self.command: Optional[FakeMessage] = None  # /backfill вместо входящих видео
+        self.videos = 0
+        self.bytes = 0
+
+    def add(self, message: FakeMessage, track: bool = True):
+        self.messages.append((message, track))
+        self.videos += 1
+        self.bytes += message.media.file_size
+
+    def add_history(self, message: FakeMessage):
+        self.history.append(message)
+        self.videos += 1
+        self.bytes += message.media.file_size
+
+
+def build_workload(args, scenario: str, users: List[FakeUser]) -> Workload:
+    workload = Workload()
+    chat = FakeChat(-100)
+    size = int(args.size_mb * MB)
+
+    def video(index: int, prefix: str = scenario) -> FakeVideo:
+        return FakeVideo(f"{prefix}{index}", size)
+
+    if scenario == "single":
+        workload.add(FakeMessage(chat, users[0], video(0)))
+    elif scenario == "burst":
+        for index in range(args.videos):
+            workload.add(FakeMessage(chat, users[index % len(users)], video(index)))
+    elif scenario == "album":
+        # Статус альбома — ответ на первое сообщение
+        for index in range(args.videos):
+            message = FakeMessage(chat, users[0], video(index), media_group_id="album")
+            workload.add(message, track=index == 0)
+    elif scenario == "duplicates":
+        # Видео уже загружены, замеряется их повторная пересылка
+        for index in range(args.videos):
+            workload.warmup.append(FakeMessage(chat, users[index % len(users)], video(index)))
+            workload.add(FakeMessage(chat, users[index % len(users)], video(index)))
+    elif scenario == "backfill":
+        # Видео уже в истории чата, замеряется одна команда /backfill
+        for index in range(args.videos):
+            workload.add_history(FakeMessage(chat, users[index % len(users)], video(index)))
+        workload.command = FakeMessage(chat, users[0], text="/backfill")
+    elif scenario == "clips":
+        # Кружки, GIF, видео файлом и обычные видео по 2 MB от нескольких пользователей
+        for index in range(args.videos):
+            kind = CLIP_KINDS[index % len(CLIP_KINDS)]
+            clip = FakeVideo(f"{scenario}{index}", CLIP_SIZE)
+            workload.add(FakeMessage(chat, users[index % len(users)], clip, kind=kind))
+    return workload
+
+
+async def run_bot_scenario(args, scenario: str, workdir: Path, yandex: FakeYandexDisk) -> dict:
+    """Прогоняет сценарий через VideoBackupBot"""
+    from bot import VideoBackupBot
+
+    users = [FakeUser(1000 + index) for index in range(args.users)]
+    os.environ["ALLOWED_USER_IDS"] = ",".join(str(user.id) for user in users)
+    os.environ["DATA_DIR"] = str(workdir / scenario / "data")
+    os.environ["LOCAL_STORAGE_DIR"] = str(workdir / scenario / "storage")
+
+    telegram = FakeClient(latency=args.tg_latency, bandwidth=args.tg_bandwidth * MB)
+
+    def make_bot(role: str, worker_id: str) -> "VideoBackupBot":
+        os.environ["BOT_ROLE"] = role
+        os.environ["WORKER_ID"] = worker_id
+        os.environ["TEMP_DIR"] = str(workdir / scenario / "videos" / worker_id)
+        instance = VideoBackupBot()
+        instance.app = telegram
+        instance.downloader.client = telegram
+        # У фейкового клиента нет MTProto-сессий — части идут через stream_media
+        instance.downloader.sessions = None
+        # Все аккаунты (YANDEX_OAUTH_TOKEN=a,b) ходят в один фейковый диск
+        for account in instance.accounts.accounts:
+            for client in account.clients:
+                client.BASE_URL = yandex.base_url
+                client.WEBDAV_URL = yandex.webdav_url
+        return instance
+
+    # --workers N: сообщения принимает ingest, выгружают N воркеров с общим журналом
+    bot = make_bot("ingest" if args.workers else "all", "ingest" if args.workers else "bench")
+    workers = [make_bot("worker", f"worker{index}") for index in range(args.workers)]
+    worker_tasks = []
+
+    workload = build_workload(args, scenario, users)
+    for message in workload.history:
+        telegram.add_history(message)
+
+    # Ответ на сообщение появляется не сразу (альбомы ждут окно сборки)
+    async def finished(message: FakeMessage) -> float:
+        while not message.replies:
+            await asyncio.sleep(0.01)
+        status = message.replies[0]
+        await status.finished.wait()
+        return status.finished_at - message.created_at
+
+    await bot.startup()
+    for worker in workers:
+        await worker.startup()
+        worker_tasks.append(asyncio.create_task(worker._worker_loop()))
+    try:
+        for message in workload.warmup:
+            telegram.add_history(message)
+            await bot.handle_video(telegram, message)
+        await asyncio.wait_for(
+            asyncio.gather(*(finished(message) for message in workload.warmup)),
+            args.timeout
+        )
+
+        calls_before = yandex.api_calls
+        puts_before = yandex.calls[("PUT", "upload-href")]
+        requests_before, bytes_before = telegram.requests, telegram.bytes_sent
+
+        started = time.monotonic()
+        # --perf: профиль /perf снимается, пока идет сценарий
+        perf_command, perf_task = None, None
+        if args.perf:
+            perf_command = FakeMessage(FakeChat(users[0].id), users[0], text=f"/perf {args.perf}")
+            perf_task = asyncio.create_task(bot.perf(telegram, perf_command))
+        for message, _ in workload.messages:
+            message.created_at = time.monotonic()
+            telegram.add_history(message)
+            await bot.handle_video(telegram, message)
+            if args.interval:
+                await asyncio.sleep(args.interval)
+
+        tracked = [message for message, track in workload.messages if track]
+        if workload.command is not None:
+            workload.command.created_at = time.monotonic()
+            await bot.backfill(telegram, workload.command)
+            tracked.append(workload.command)
+        latencies = await asyncio.wait_for(
+            asyncio.gather(*(finished(message) for message in tracked)),
+            args.timeout
+        )
+        elapsed = time.monotonic() - started
+        if perf_task is not None:
+            await perf_task
+    finally:
+        for task in worker_tasks:
+            task.cancel()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        for worker in workers:
+            await worker.shutdown()
+        await bot.shutdown()
+
+    failed = sum(
+        1 for message in tracked
+        if not message.replies[0].text.startswith("✅")
+    )
+    return {
+        "videos": workload.videos,
+        "failed": failed,
+        "elapsed": elapsed,
+        "bytes": workload.bytes,
+        "latencies": latencies,
+        "api_calls": yandex.api_calls - calls_before,
+        "upload_puts": yandex.calls[("PUT", "upload-href")] - puts_before,
+        "injected_errors": sum(yandex.errors.values()),
+        "telegram_requests": telegram.requests - requests_before,
+        "telegram_bytes": telegram.bytes_sent - bytes_before,
+        "perf": perf_command.replies[0].text if perf_command is not None else None,
+    }
+
+
+async def run_client_scenario(args, workdir: Path, yandex: FakeYandexDisk) -> dict:
+    """Только YandexDiskClient: выгрузка готовых файлов без Telegram"""
+    from yandex_disk import YandexDiskClient
+
+    size = int(args.size_mb * MB)
+    source_dir = workdir / "client"
+    source_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(args.videos):
+        path = source_dir / f"client{index}.mp4"
+        with open(path, "wb") as f:
+            for chunk_index in range(-(-size // MB)):
+                f.write(FakeClient.chunk(FakeVideo(path.stem, size), chunk_index))
+        paths.append(path)
+
+    client = YandexDiskClient(
+        "benchmark",
+        retry_base_delay=float(BENCH_ENV["UPLOAD_RETRY_BASE_DELAY"]),
+        retry_max_delay=float(BENCH_ENV["UPLOAD_RETRY_MAX_DELAY"]),
+    )
+    client.BASE_URL = yandex.base_url
+    semaphore = asyncio.Semaphore(args.users)
+    calls_before = yandex.api_calls
+    puts_before = yandex.calls[("PUT", "upload-href")]
+
+    async def upload(path: Path) -> Tuple[float, bool]:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await client.upload_video(path, "2024-01-01", path.name)
+                return time.monotonic() - started, True
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Upload of {path.name} failed: {e}")
+                return time.monotonic() - started, False
+
+    await client.start()
+    started = time.monotonic()
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(upload(path) for path in paths)), args.timeout
+        )
+        elapsed = time.monotonic() - started
+    finally:
+        await client.close()
+
+    return {
+        "videos": len(paths),
+        "failed": sum(1 for _, ok in results if not ok),
+        "elapsed": elapsed,
+        "bytes": size * len(paths),
+        "latencies": [latency for latency, _ in results],
+        "api_calls": yandex.api_calls - calls_before,
+        "upload_puts": yandex.calls[("PUT", "upload-href")] - puts_before,
+        "injected_errors": sum(yandex.errors.values()),
+        "telegram_requests": 0,
+        "telegram_bytes": 0,
+    }
+
+
+def summarize(scenario: str, result: dict) -> dict:
+    videos = result["videos"] or 1
+    latencies = result.pop("latencies")
+    return {
+        "scenario": scenario,
+        **result,
+        "throughput_mb_s": result["bytes"] / MB / result["elapsed"] if result["elapsed"] else 0.0,
+        "videos_per_s": result["videos"] / result["elapsed"] if result["elapsed"] else 0.0,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p90": percentile(latencies, 0.9),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies, default=0.0),
+        "api_calls_per_video": result["api_calls"] / videos,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_report(report: dict):
+    print(
+        f"\n== {report['scenario']}: {report['videos']} videos, "
+        f"{report['bytes'] / MB:.0f} MB in {report['elapsed']:.2f}s"
+        + (f", {report['failed']} FAILED" if report["failed"] else "")
+    )
+    print(f"  throughput:     {report['throughput_mb_s']:.1f} MB/s, {report['videos_per_s']:.2f} videos/s")
+    print(
+        f"  latency:        p50 {report['latency_p50']:.2f}s, p90 {report['latency_p90']:.2f}s, "
+        f"p99 {report['latency_p99']:.2f}s, max {report['latency_max']:.2f}s"
+    )
+    print(
+        f"  yandex api:     {report['api_calls']} calls ({report['api_calls_per_video']:.2f}/video), "
+        f"{report['upload_puts']} upload PUTs, {report['injected_errors']} injected errors"
+    )
+    if report["telegram_requests"]:
+        print(
+            f"  telegram:       {report['telegram_requests']} stream_media requests, "
+            f"{report['telegram_bytes'] / MB:.0f} MB"
+        )
+    print(f"  peak RSS:       {report['peak_rss_mb']:.0f} MB")
+    if report.get("perf"):
+        print("\n" + report["perf"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the video backup bot")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="burst")
+    parser.add_argument("--videos", type=int, default=10, help="videos per scenario")
+    parser.add_argument("--size-mb", type=float, default=20, help="size of each video")
+    parser.add_argument("--users", type=int, default=3, help="distinct senders (client: parallel uploads)")
+    parser.add_argument("--interval", type=float, default=0.0, help="pause between incoming messages")
+    parser.add_argument("--yd-latency", type=float, default=0.0, help="Yandex API call latency, seconds")
+    parser.add_argument("--yd-bandwidth", type=float, default=0, help="upload PUT bandwidth, MB/s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Yandex requests failing with 503")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="share of uploads stored with a wrong hash")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="Telegram request latency, seconds")
+    parser.add_argument("--tg-bandwidth", type=float, default=0, help="Telegram bandwidth per connection, MB/s")
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="run as ingest + N worker bots sharing one job journal (0 = single process)"
+    )
+    parser.add_argument(
+        "--perf", type=float, default=0, metavar="SECONDS",
+        help="run /perf for SECONDS while the scenario runs and print its reply"
+    )
+    parser.add_argument("--timeout", type=float, default=600, help="scenario timeout, seconds")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE",
+        help="bot configuration override (repeatable), e.g. STREAM_UPLOADS=false"
+    )
+    parser.add_argument("--json", action="store_true", help="print reports as JSON lines")
+    parser.add_argument("--verbose", action="store_true", help="show bot logs")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    for override in args.env:
+        key, _, value = override.partition("=")
+        os.environ[key] = value
+
+    # bot настраивает логирование при импорте — уровень меняем после него
+    importlib.import_module("bot")
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as tmp:
+        for scenario in scenarios:
+            # Каждый сценарий начинает с пустого диска
+            yandex = FakeYandexDisk(
+                latency=args.yd_latency,
+                bandwidth=args.yd_bandwidth * MB,
+                error_rate=args.error_rate,
+                corrupt_rate=args.corrupt_rate,
+            )
+            await yandex.start()
+            try:
+                if scenario == "client":
+                    result = await run_client_scenario(args, Path(tmp), yandex)
+                else:
+                    result = await run_bot_scenario(args, scenario, Path(tmp), yandex)
+            finally:
+                await yandex.stop()
+
+            report = summarize(scenario, result)
+            reports.append(report)
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print_report(report)
+
+    return 1 if any(report["failed"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -6,16 +6,39 @@ Telegram Video Backup Bot
 
 import os
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
+from pyrogram.enums import ParseMode
 from pyrogram.types import Message
 from pyrogram.handlers import MessageHandler
 
 from config import Config
-from yandex_disk import YandexDiskClient
+from yandex_disk import YandexDiskClient, YandexWebDAVClient, is_retryable
+from storage import LocalStorage, StorageBackend
+from streaming import StreamBuffer
+from scheduler import BackupJob, JobScheduler
+from journal import JobJournal
+from dedup import ContentHasher, DedupIndex
+from downloader import MediaSessions, ParallelDownloader
+from folder_cache import FolderCache
+from status_updates import StatusUpdater
+from albums import AlbumBatch, AlbumCollector
+from backfill import BackfillRun, iter_history
+from temp_storage import TempStorage, TempStorageError, temp_file_name
+from quota import QuotaCache, QuotaError
+from accounts import AccountRouter, YandexAccount
+from media import video_filename, video_filter, video_media
+from transcode import Transcoder
+from limiter import AdaptiveLimits
+from perf import LoopMonitor, Profile
+import metrics
+from metrics import MetricsServer
 
 # Настройка логирования
 logging.basicConfig(
@@ -28,22 +51,176 @@ logger = logging.getLogger(__name__)
 class VideoBackupBot:
     def __init__(self):
         self.config = Config()
-        self.yd_client = YandexDiskClient(self.config.yandex_token)
-        self.temp_dir = Path("/tmp/telegram_videos")
-        self.temp_dir.mkdir(exist_ok=True)
 
+        # Адаптивные лимиты параллельных запросов к Яндекс Диску и Telegram
+        self.limits = None
+        if self.config.adaptive_limits:
+            self.limits = AdaptiveLimits(
+                minimum=self.config.adaptive_limit_min,
+                tolerance=self.config.adaptive_latency_tolerance,
+            )
+
+        # Аккаунты Яндекс Диска: у каждого свой пул соединений, кэш папок и квота
+        accounts = []
+        for index, token in enumerate(self.config.yandex_tokens, start=1):
+            folder_cache = FolderCache(
+                self.config.data_dir / ("folders.json" if index == 1 else f"folders-{index}.json"),
+                ttl=self.config.folder_cache_ttl,
+            )
+            folder_cache.load()
+            client_options = dict(
+                pool_limit=self.config.yandex_pool_limit,
+                pool_limit_per_host=self.config.yandex_pool_limit_per_host,
+                dns_cache_ttl=self.config.yandex_dns_cache_ttl,
+                keepalive_timeout=self.config.yandex_keepalive_timeout,
+                max_retries=self.config.upload_retries,
+                retry_base_delay=self.config.upload_retry_base_delay,
+                retry_max_delay=self.config.upload_retry_max_delay,
+                verify_timeout=self.config.verify_timeout,
+                verify_retries=self.config.verify_retries,
+                folder_cache=folder_cache,
+                upload_chunk_size=self.config.upload_chunk_bytes,
+                # REST- и WebDAV-клиенты аккаунта делят лимит API
+                limits=self.limits,
+                limits_prefix=f"yandex{index}",
+            )
+            client = YandexDiskClient(token, **client_options)
+            # WebDAV-клиент делит с REST-клиентом кэш папок: это один и тот же диск
+            webdav = None
+            if "webdav" in self.config.storage_backends:
+                webdav = YandexWebDAVClient(token, **client_options)
+            quota = QuotaCache(client, ttl=self.config.quota_ttl, account=str(index))
+            accounts.append(YandexAccount(str(index), client, quota, webdav))
+
+        self.accounts = AccountRouter(accounts, self.config.data_dir / "placements.json")
+        self.accounts.load()
+
+        # Локальное хранилище (папка, NAS или S3, смонтированный через s3fs)
+        self.local_storage = None
+        if "local" in self.config.storage_backends:
+            self.local_storage = LocalStorage(
+                self.config.local_storage_dir, public_url=self.config.local_storage_url
+            )
+
+        self.temp_dir = self.config.temp_dir
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.temp_storage = TempStorage(
+            self.temp_dir,
+            budget=self.config.temp_budget_bytes,
+            min_free=self.config.temp_min_free_bytes,
+            orphan_age=self.config.temp_orphan_age,
+        )
+
+        self.transcoder = Transcoder(
+            workers=self.config.transcode_workers,
+            min_saving=self.config.transcode_min_saving,
+            crf=self.config.transcode_crf,
+            max_height=self.config.transcode_max_height,
+            thumbnails=self.config.transcode_thumbnails,
+            timeout=self.config.transcode_timeout,
+        )
+
+        self.status = StatusUpdater(
+            chat_interval=self.config.status_chat_interval,
+            global_rate=self.config.status_global_rate,
+        )
+
+        self.albums = AlbumCollector(self.config.album_window, self.handle_album)
+
+        self.journal = JobJournal(
+            self.config.data_dir / "jobs.db",
+            flush_interval=self.config.journal_flush_interval,
+            usage_days=self.config.usage_history_days,
+        )
+
+        self.dedup = DedupIndex(self.config.data_dir / "dedup.db")
+
+        self.scheduler = JobScheduler(
+            download=self._download_job,
+            upload=self._upload_job,
+            transfer=self._transfer_job,
+            on_error=self._job_failed,
+            on_state=self._journal_state,
+            process=self._process_job,
+            download_workers=self.config.download_workers,
+            upload_workers=self.config.upload_workers,
+            max_queued=self.config.max_queued_jobs,
+        )
+
+        # Бэкфилл истории идет своим пулом, чтобы не задерживать новые видео
+        self.backfill_scheduler = JobScheduler(
+            download=self._download_job,
+            upload=self._upload_job,
+            transfer=self._transfer_job,
+            on_error=self._job_failed,
+            on_state=self._journal_state,
+            process=self._process_job,
+            download_workers=self.config.backfill_workers,
+            upload_workers=self.config.backfill_workers,
+            max_queued=self.config.backfill_workers * 4,
+        )
+        self.backfills: Dict[int, BackfillRun] = {}  # chat_id -> бэкфилл
+
+        # Воркер не принимает сообщения (их принимает ingest), а только
+        # скачивает видео своей сессией — поэтому no_updates
+        worker = self.config.role == "worker"
+        transmissions = (
+            (self.config.download_workers + self.config.backfill_workers)
+            * self.config.download_connections
+        )
         self.app = Client(
-            "video_backup_bot",
+            f"video_backup_worker_{self.config.worker_id}" if worker else "video_backup_bot",
             api_id=self.config.telegram_api_id,
             api_hash=self.config.telegram_api_hash,
             bot_token=self.config.telegram_token,
             workdir="/app/sessions",
+            no_updates=worker,
+            # Каждая часть параллельного скачивания (живых видео и бэкфилла) —
+            # отдельная передача; адаптивный лимит упирается в тот же потолок
+            max_concurrent_transmissions=transmissions,
+        )
+
+        self.downloader = ParallelDownloader(
+            self.app,
+            connections=self.config.download_connections,
+            part_chunks=self.config.download_part_mb,
+            limiter=self.limits.get(
+                "telegram:download", transmissions
+            ) if self.limits is not None else None,
+            # Части скачиваются по переиспользуемым media-сессиям
+            sessions=MediaSessions(self.app),
         )
 
+        schedulers = (self.scheduler, self.backfill_scheduler)
+        metrics.QUEUE_DEPTH.set_function(lambda: sum(s.queued for s in schedulers))
+        metrics.ACTIVE_JOBS.set_function(lambda: sum(s.active for s in schedulers))
+        metrics.INFLIGHT_BYTES.set_function(lambda: sum(s.inflight_bytes for s in schedulers))
+        metrics.TEMP_RESERVED_BYTES.set_function(lambda: self.temp_storage.reserved)
+        self.metrics_server = None
+        if self.config.metrics_port:
+            self.metrics_server = MetricsServer(
+                self.config.metrics_port,
+                host=self.config.metrics_host,
+                collectors=[self._collect_metrics],
+            )
+
+        # Задержка event loop и блокировки со стеком; профиль для /perf
+        self.monitor = LoopMonitor(
+            interval=self.config.loop_monitor_interval,
+            stall_threshold=self.config.loop_stall_threshold,
+        )
+
+        # Объем задач в общем журнале (в роли ingest — для проверки квоты)
+        self._shared_pending_bytes = 0
+
         # Регистрируем обработчики
-        self.app.on_message(filters.command("start"))(self.start)
-        self.app.on_message(filters.command("stats"))(self.stats)
-        self.app.on_message(filters.video & filters.group)(self.handle_video)
+        if not worker:
+            self.app.on_message(filters.command("start"))(self.start)
+            self.app.on_message(filters.command("stats"))(self.stats)
+            self.app.on_message(filters.command("perf"))(self.perf)
+            self.app.on_message(filters.command("backfill") & filters.group)(self.backfill)
+            # Видео, кружки, GIF-анимации и видео, отправленные файлом
+            self.app.on_message(video_filter & filters.group)(self.handle_video)
 
     async def start(self, client: Client, message: Message):
         """Команда /start"""
@@ -54,7 +231,7 @@ class VideoBackupBot:
         )
 
     async def handle_video(self, client: Client, message: Message):
-        """Обработка входящих видео"""
+        """Обработка входящих видео: ставит задачу бэкапа в очередь"""
         user_id = message.from_user.id
         username = message.from_user.username or message.from_user.first_name
 
@@ -65,96 +242,791 @@ class VideoBackupBot:
 
         logger.info(f"Video received from {username} (ID: {user_id})")
 
-        video = message.video
+        # Видео из альбома обрабатываются пачкой, когда придет весь альбом
+        if message.media_group_id and self.config.album_window > 0:
+            self.albums.add(message)
+            return
+
+        # Сообщение уже в журнале (например, Telegram доставил его повторно)
+        if await self.journal.find(message.chat.id, message.id):
+            logger.info(f"Message {message.chat.id}/{message.id} already journaled, skipping")
+            return
+
+        video = video_media(message)
         file_size_mb = video.file_size / (1024 * 1024)
 
+        # Это же видео уже пересылали — отвечаем ссылкой без скачивания
+        duplicate = await self._find_duplicate(self.dedup.find_by_file_id, video.file_unique_id)
+        if duplicate:
+            logger.info(f"Duplicate of {duplicate['remote_path']} (file_unique_id match)")
+            await message.reply_text(await self._duplicate_text(duplicate))
+            return
+
+        # Видео, которое не поместится на диск, не скачиваем зря
+        try:
+            await self._admit(message.chat.id, video.file_size)
+        except (QuotaError, TempStorageError) as e:
+            logger.warning(f"Rejecting video {video.file_unique_id}: {e}")
+            await message.reply_text(f"❌ Видео не может быть загружено:\n\n{e}")
+            return
+
         status_msg = await message.reply_text(
             f"⏳ Загружаю видео ({file_size_mb:.1f} MB)..."
         )
 
+        job = await self._create_job(message, username, status_msg)
+        if self.config.role == "ingest":
+            await self._hand_off([job])
+            return
+
+        # Ждет, если очередь заполнена (backpressure)
+        position = await self.scheduler.submit(job)
+        if position > 0 and job.state == "queued":
+            logger.info(f"Job queued at position {position}: {job}")
+            self.status.set(
+                status_msg,
+                f"⏳ Видео ({file_size_mb:.1f} MB) в очереди\n"
+                f"🕐 Позиция: {position}"
+            )
+
+    def _pending_bytes(self) -> int:
+        local = self.scheduler.pending_bytes + self.backfill_scheduler.pending_bytes
+        if self.config.role == "ingest":
+            # Новые видео выгружают воркеры — их очередь видна только в журнале
+            return max(local, self._shared_pending_bytes)
+        return local
+
+    def _use_stream(self, chat_id: int) -> bool:
+        """
+        Потоковая выгрузка невозможна, если видео обрабатывается перед выгрузкой
+        или копируется во второе хранилище (поток не перечитать)
+        """
+        return (
+            self.config.stream_uploads
+            and self.config.transcode_mode(chat_id) == "off"
+            and not self.config.storage_mirror
+        )
+
+    def _use_memory(self, chat_id: int, size: int) -> bool:
+        """Небольшое видео выгружается из памяти, если его не нужно обрабатывать ffmpeg"""
+        return size <= self.config.memory_upload_bytes and self.config.transcode_mode(chat_id) == "off"
+
+    def _uses_yandex(self, chat_id: int) -> bool:
+        """Попадает ли видео чата на Яндекс Диск (основное хранилище или зеркало)"""
+        return any(
+            backend in ("rest", "webdav")
+            for backend in (self.config.storage_backend(chat_id), self.config.storage_mirror)
+        )
+
+    @asynccontextmanager
+    async def _storage(self, backend: str, folder_name: str, size: int):
+        """
+        Хранилище для выгрузки видео: (аккаунт Яндекс Диска, клиент)
+
+        Для Яндекс Диска аккаунт выбирается по свободному месту и занят до
+        выхода из блока; у локального хранилища аккаунта нет (None).
+        """
+        if backend == "local":
+            yield None, self.local_storage
+            return
+        async with self.accounts.route(folder_name, size) as account:
+            yield account, account.backend(backend)
+
+    async def _admit(self, chat_id: int, size: int, admitted: int = 0):
+        """
+        Проверяет до постановки в очередь, что видео вообще можно загрузить
+
+        Args:
+            chat_id: Чат видео (от него и размера зависит, нужен ли временный файл)
+            size: Размер видео
+            admitted: Байты видео, уже принятых, но еще не поставленных в очередь
+
+        Raises:
+            QuotaError: не хватит места на Яндекс Диске (с учетом очереди)
+            TempStorageError: видео не поместится во временную папку
+        """
+        if self._uses_yandex(chat_id):
+            self.accounts.check(size, self._pending_bytes() + admitted)
+        # Временные файлы живых видео в роли ingest пишут воркеры, а не этот процесс
+        needs_temp = not self._use_stream(chat_id) and not self._use_memory(chat_id, size)
+        if needs_temp and self.config.role != "ingest":
+            await self.temp_storage.refresh()
+            self.temp_storage.check(size)
+
+    async def _create_job(
+        self,
+        message: Message,
+        username: str,
+        status_msg: Message,
+        status_message_id: Optional[int] = None,
+        queue: str = "live"
+    ) -> BackupJob:
+        """Создает задачу бэкапа и записывает ее в журнал (в аренду этому процессу)"""
+        video = video_media(message)
+        in_memory = self._use_memory(message.chat.id, video.file_size)
+        job = BackupJob(
+            user_id=message.from_user.id,
+            username=username,
+            message=message,
+            status_msg=status_msg,
+            filename=video_filename(message),
+            file_size=video.file_size,
+            stream=self._use_stream(message.chat.id) and not in_memory,
+            in_memory=in_memory,
+        )
+        job.job_id = await self.journal.add(
+            chat_id=message.chat.id,
+            message_id=message.id,
+            status_message_id=status_message_id or status_msg.id,
+            file_unique_id=video.file_unique_id,
+            user_id=job.user_id,
+            username=username,
+            filename=job.filename,
+            file_size=job.file_size,
+            queue=queue,
+            owner=self.config.worker_id,
+            lease_ttl=self.config.job_lease_ttl,
+        )
+        return job
+
+    async def _hand_off(self, jobs: List[BackupJob]):
+        """
+        Отдает задачи воркерам (роль ingest): снимает с них аренду этого процесса
+
+        Видео альбома отпускаются одним вызовом, чтобы воркер взял их вместе.
+        """
+        await self.journal.release(
+            self.config.worker_id, [job.job_id for job in jobs if job.job_id is not None]
+        )
+        logger.info(f"Handed off {len(jobs)} job(s) to workers")
+
+    async def handle_album(self, messages: List[Message]):
+        """Обработка альбома: одно статусное сообщение и один итог на все видео"""
+        first = messages[0]
+        username = first.from_user.username or first.from_user.first_name
+
+        fresh, duplicates, rejected = [], [], []
+        admitted = 0
+        for message in messages:
+            if await self.journal.find(message.chat.id, message.id):
+                continue
+            video = video_media(message)
+            duplicate = await self._find_duplicate(self.dedup.find_by_file_id, video.file_unique_id)
+            if duplicate:
+                duplicates.append(duplicate)
+                continue
+            try:
+                await self._admit(message.chat.id, video.file_size, admitted)
+            except (QuotaError, TempStorageError) as e:
+                logger.warning(f"Rejecting album video {video.file_unique_id}: {e}")
+                rejected.append((video_filename(message), str(e)))
+                continue
+            admitted += video.file_size
+            fresh.append(message)
+
+        if not fresh and not duplicates and not rejected:
+            return
+
+        size_mb = sum(video_media(m).file_size for m in fresh) / (1024 * 1024)
+        status_msg = await first.reply_text(
+            f"⏳ Загружаю альбом ({len(fresh)} видео, {size_mb:.1f} MB)..."
+        )
+
+        batch = AlbumBatch(status_msg, total=len(fresh) + len(duplicates) + len(rejected))
+        for filename, error in rejected:
+            batch.add_failure(filename, error)
+        for duplicate in duplicates:
+            folder_path = duplicate["remote_path"].rsplit("/", 1)[0]
+            batch.add_result(
+                folder_path.rsplit("/", 1)[-1], await self._folder_link(duplicate), duplicate=True
+            )
+
+        if batch.complete:
+            await self._final_batch_status(batch)
+            return
+
+        for message in fresh:
+            job = await self._create_job(message, username, status_msg)
+            job.batch = batch
+            batch.jobs.append(job)
+
+        if self.config.role == "ingest":
+            await self._hand_off(batch.jobs)
+            return
+
+        # Видео альбома ставятся в очередь вместе и выгружаются параллельно
+        for job in batch.jobs:
+            await self.scheduler.submit(job)
+
+    def _show_progress(self, job: BackupJob):
+        """Обновляет статус задачи (частоту правок ограничивает StatusUpdater)"""
+        if job.batch is not None:
+            self.status.set(job.batch.status_msg, job.batch.progress_text())
+            return
+
+        lines = [f"⏳ Загружаю видео ({job.file_size_mb:.1f} MB)..."]
+        if job.bytes_downloaded:
+            lines.append(f"📥 Скачано: {job.bytes_downloaded * 100 // job.file_size}%")
+        if job.bytes_uploaded:
+            lines.append(f"📤 Выгружено: {job.bytes_uploaded * 100 // job.file_size}%")
+        self.status.set(job.status_msg, "\n".join(lines))
+
+    def _download_progress(self, job: BackupJob):
+        async def progress(current, total):
+            job.bytes_downloaded = current
+            if job.job_id is not None:
+                self.journal.update(job.job_id, bytes_done=current)
+            self._show_progress(job)
+
+        return progress
+
+    def _upload_progress(self, job: BackupJob):
+        async def progress(current, total):
+            job.bytes_uploaded = current
+            self._show_progress(job)
+
+        return progress
+
+    def _current_folder_name(self) -> str:
+        """Папка по текущей дате"""
+        return self._folder_name_for(datetime.now(self.config.get_timezone()))
+
+    def _folder_name_for(self, date: datetime) -> str:
+        """Папка по дате (в таймзоне бота)"""
+        return date.astimezone(self.config.get_timezone()).strftime("%Y-%m-%d")
+
+    def _journal_state(self, job: BackupJob):
+        """Отражает смену стадии задачи в журнале"""
+        if job.job_id is not None:
+            self.journal.update(job.job_id, stage=job.state)
+
+    def _journal_remote_path(self, job: BackupJob):
+        if job.job_id is not None:
+            self.journal.update(job.job_id, remote_path=job.remote_path)
+
+    async def _folder_link(self, entry: dict) -> str:
+        """Публичная ссылка на папку, в которой лежит файл из индекса"""
+        if entry.get("public_url"):
+            return entry["public_url"]
+        folder_path = entry["remote_path"].rsplit("/", 1)[0]
+        if entry.get("account") == LocalStorage.name and self.local_storage is not None:
+            return self.local_storage.folder_link(folder_path.rsplit("/", 1)[-1])
+        # Папка публикуется на том аккаунте, где лежит файл
+        return await self.accounts.get(entry.get("account")).client.publish_folder(folder_path)
+
+    async def _duplicate_exists(self, entry: dict) -> bool:
+        """Файл из индекса еще в хранилище (запись об удаленном файле убирается из индекса)"""
+        remote_path = entry["remote_path"]
+        try:
+            if entry.get("account") == LocalStorage.name:
+                if self.local_storage is None:
+                    return True
+                folder_name, filename = remote_path.split("/")[-2:]
+                exists = await asyncio.to_thread(
+                    (self.local_storage.root / folder_name / filename).exists
+                )
+            else:
+                client = self.accounts.get(entry.get("account")).client
+                exists = await client.get_resource(remote_path) is not None
+        except Exception as e:
+            # Проверить не удалось — считаем, что файл на месте
+            logger.warning(f"Cannot check that {remote_path} still exists: {e}")
+            return True
+
+        if not exists:
+            logger.info(f"{remote_path} was deleted from storage, dropping it from the dedup index")
+            await self.dedup.remove(remote_path)
+        return exists
+
+    async def _find_duplicate(self, find, *args) -> Optional[dict]:
+        """Ищет в индексе дубликат, который еще лежит в хранилище"""
+        while True:
+            entry = await find(*args)
+            if entry is None or await self._duplicate_exists(entry):
+                return entry
+
+    async def _duplicate_text(self, entry: dict) -> str:
+        """Ответ на видео, которое уже есть на Яндекс Диске"""
+        folder_path = entry["remote_path"].rsplit("/", 1)[0]
+        public_url = await self._folder_link(entry)
+        return (
+            f"✅ Это видео уже сохранено на Яндекс Диске\n\n"
+            f"📁 Папка: {folder_path.rsplit('/', 1)[-1]}\n"
+            f"Ссылка: {public_url}"
+        )
+
+    async def _remember_upload(self, job: BackupJob):
+        """Добавляет загруженное видео в индекс дубликатов"""
         try:
-            # Определяем имя файла
-            original_filename = video.file_name or f"video_{video.file_unique_id}.mp4"
-            temp_file_path = self.temp_dir / original_filename
+            await self.dedup.add(
+                remote_path=job.remote_path,
+                size=job.file_size,
+                file_unique_id=job.file_unique_id,
+                md5=job.hasher.md5 if job.hasher else None,
+                sha256=job.hasher.sha256 if job.hasher else None,
+                public_url=job.public_url,
+                verified=bool(job.hasher and job.hasher.verified),
+                account=job.account.name if job.account is not None else LocalStorage.name,
+            )
+        except Exception as e:
+            logger.error(f"Failed to update dedup index: {e}")
 
-            logger.info(f"Downloading to {temp_file_path}")
+        # Квота и статистика /stats обновляются локально, без вызовов API
+        if job.account is not None:
+            job.account.quota.add_used(job.file_size)
+        try:
+            await self.journal.record_upload(
+                self._current_folder_name(), job.user_id, job.username,
+                job.file_size, job.transfer_seconds
+            )
+        except Exception as e:
+            logger.error(f"Failed to record upload statistics: {e}")
 
-            last_progress_update = [0]
+    async def _download_job(self, job: BackupJob):
+        """Стадия скачивания: Telegram → временный файл (с подсчетом хешей)"""
+        job.hasher = ContentHasher()
+        path = self.temp_dir / job.temp_name
 
-            async def progress(current, total):
-                percent = current * 100 / total
-                # Обновляем не чаще чем каждые 10%
-                if percent - last_progress_update[0] >= 10:
-                    last_progress_update[0] = percent
-                    try:
-                        await status_msg.edit_text(
-                            f"⏳ Загружаю видео ({file_size_mb:.1f} MB)...\n"
-                            f"📥 Скачано: {percent:.0f}%"
-                        )
-                    except Exception:
-                        pass
+        if job.in_memory:
+            await self._download_to_memory(job)
+        # После перезапуска файл мог остаться скачанным целиком
+        elif await asyncio.to_thread(self._file_size, path) == job.file_size:
+            job.reservation = await self.temp_storage.reserve(job.temp_name, job.file_size, on_disk=True)
+            job.temp_path = job.reservation.path
+            logger.info(f"Reusing already downloaded file {job.temp_path}")
+            await asyncio.to_thread(self._hash_file, job.temp_path, job.hasher)
+        else:
+            # Ждет, пока во временной папке хватит места под весь файл
+            job.reservation = await self.temp_storage.reserve(job.temp_name, job.file_size)
+            job.temp_path = job.reservation.path
+            logger.info(f"Downloading to {job.temp_path}")
+            progress = self._download_progress(job)
+            part_path = job.temp_path.with_name(job.temp_path.name + ".part")
 
             # Скачиваем через MTProto — без лимита 20 MB
-            await message.download(
-                file_name=str(temp_file_path),
-                progress=progress,
+            try:
+                await self.temp_storage.allocate(job.reservation, part_path)
+                await self._download_to_file(job, part_path, progress)
+            except BaseException:
+                await asyncio.to_thread(part_path.unlink, missing_ok=True)
+                raise
+
+            # get_file в Pyrogram глотает ошибки сети — проверяем размер сами
+            if job.hasher.size != job.file_size:
+                await asyncio.to_thread(part_path.unlink, missing_ok=True)
+                raise Exception(
+                    f"Telegram download interrupted: got {job.hasher.size} "
+                    f"of {job.file_size} bytes"
+                )
+            await asyncio.to_thread(part_path.replace, job.temp_path)
+
+        # Такое же содержимое уже на диске (например, видео загрузили заново)
+        job.duplicate = await self._find_duplicate(
+            self.dedup.find_by_hash, job.hasher.sha256, job.hasher.md5, job.file_size
+        )
+
+    async def _download_to_file(self, job: BackupJob, part_path: Path, progress):
+        """
+        Пишет скачиваемые чанки в файл (с подсчетом хешей)
+
+        Запись и хеши считаются в пуле потоков: медленная SD карта не
+        останавливает event loop, а следующий чанк скачивается, пока
+        пишется предыдущий.
+        """
+        f = await asyncio.to_thread(open, part_path, "r+b")
+        pending = None
+        received = 0
+        try:
+            async for chunk in self.downloader.stream(job.message, job.file_size):
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(
+                    asyncio.to_thread(self._write_chunk, f, job.hasher, chunk)
+                )
+                received += len(chunk)
+                await progress(received, job.file_size)
+            if pending is not None:
+                await pending
+            await asyncio.to_thread(f.truncate)
+        finally:
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
+            await asyncio.to_thread(f.close)
+
+    async def _download_to_memory(self, job: BackupJob):
+        """Скачивает небольшое видео в память: без временного файла и записи на SD карту"""
+        logger.info(f"Downloading {job.filename} ({job.file_size_mb:.1f} MB) into memory")
+        progress = self._download_progress(job)
+        data = bytearray()
+        async for chunk in self.downloader.stream(job.message, job.file_size):
+            data += chunk
+            job.hasher.update(chunk)
+            await progress(len(data), job.file_size)
+
+        # get_file в Pyrogram глотает ошибки сети — проверяем размер сами
+        if len(data) != job.file_size:
+            raise Exception(
+                f"Telegram download interrupted: got {len(data)} of {job.file_size} bytes"
             )
+        job.data = bytes(data)
 
-            # Определяем папку по текущей дате
-            now = datetime.now(self.config.get_timezone())
-            folder_name = now.strftime("%Y-%m-%d")
+    async def _process_job(self, job: BackupJob):
+        """Стадия обработки: ремукс или пережатие скачанного файла (по политике чата)"""
+        mode = self.config.transcode_mode(job.chat_id)
+        if mode == "off" or job.duplicate or not self.transcoder.running:
+            return
+
+        if job.batch is None:
+            self.status.set(job.status_msg, f"⚙️ Обрабатываю видео ({job.file_size_mb:.1f} MB)...")
 
-            await status_msg.edit_text(
-                f"⏳ Видео загружено ({file_size_mb:.1f} MB)\n"
-                f"📤 Загружаю на Яндекс Диск в папку {folder_name}..."
+        # Результат не больше исходника (иначе он отбрасывается). Резерв
+        # исходника задача держит, пока ждет, — нужно место под оба файла
+        try:
+            reservation = await self.temp_storage.reserve(
+                f"{job.temp_name}.processed.mp4", job.file_size, held=job.file_size
             )
+        except TempStorageError as e:
+            logger.warning(f"Skipping {mode} for {job.filename}: {e}")
+            return
+        target = reservation.path
+        thumbnail = target.with_name(f"{job.temp_name}.jpg")
+        try:
+            result = await self.transcoder.process(job.temp_path, target, mode, thumbnail)
+            if result["thumbnail"]:
+                job.thumbnail_path = thumbnail
+            if result["kept"]:
+                await asyncio.to_thread(target.replace, job.temp_path)
+                job.file_size = result["size"]
+                if Path(job.filename).suffix.lower() != ".mp4":
+                    job.filename = f"{Path(job.filename).stem}.mp4"
+                # Выгружается другой файл — хеши для сверки считаются заново
+                job.hasher = ContentHasher()
+                await asyncio.to_thread(self._hash_file, job.temp_path, job.hasher)
+        finally:
+            await asyncio.to_thread(target.unlink, missing_ok=True)
+            await self.temp_storage.release(reservation)
 
-            # Загружаем на Яндекс Диск
-            logger.info(f"Uploading to Yandex Disk: {folder_name}/{original_filename}")
-            public_url = await self.yd_client.upload_video(
-                temp_file_path,
-                folder_name,
-                original_filename
+    async def _upload_thumbnail(self, job: BackupJob, storage: StorageBackend):
+        """Выгружает превью видео (ошибка не мешает основной загрузке)"""
+        try:
+            await storage.upload_thumbnail(
+                job.thumbnail_path, job.folder_name, f"{Path(job.filename).stem}.jpg"
             )
+        except Exception as e:
+            logger.warning(f"Failed to upload thumbnail for {job.filename}: {e}")
 
-            # Удаляем временный файл
-            temp_file_path.unlink()
-            logger.info(f"Temporary file deleted: {temp_file_path}")
+    async def _remove_temp(self, job: BackupJob):
+        """Удаляет временный файл задачи (или видео из памяти) и освобождает место под него"""
+        job.data = None
+        if job.temp_path is not None and await asyncio.to_thread(self._remove_file, job.temp_path):
+            logger.info(f"Temporary file deleted: {job.temp_path}")
+        if job.thumbnail_path is not None:
+            await asyncio.to_thread(job.thumbnail_path.unlink, missing_ok=True)
+        await self.temp_storage.release(job.reservation)
+        job.reservation = None
 
-            await status_msg.edit_text(
-                f"✅ Видео успешно загружено!\n\n"
-                f"📁 Папка: {folder_name}\n"
-                f"Все видео за сегодня: {public_url}"
-            )
+    @staticmethod
+    def _file_size(path: Path) -> Optional[int]:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove_file(path: Path) -> bool:
+        """Удаляет файл (False — его уже нет)"""
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _write_chunk(f, hasher: ContentHasher, chunk: bytes):
+        f.write(chunk)
+        hasher.update(chunk)
 
-            logger.info(f"Video uploaded successfully: {public_url}")
+    @staticmethod
+    def _hash_file(path: Path, hasher: ContentHasher):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
 
+    async def _finish_duplicate(self, job: BackupJob):
+        logger.info(f"Duplicate of {job.duplicate['remote_path']} (content hash match)")
+
+        await self._remove_temp(job)
+
+        # Запоминаем file_unique_id, чтобы следующая пересылка не скачивалась
+        try:
+            await self.dedup.add(
+                remote_path=job.duplicate["remote_path"],
+                size=job.file_size,
+                file_unique_id=job.file_unique_id,
+            )
         except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Error uploading video: {error_msg}", exc_info=True)
+            logger.error(f"Failed to update dedup index: {e}")
 
-            await status_msg.edit_text(
-                f"❌ Ошибка при загрузке видео:\n\n"
-                f"{error_msg}\n\n"
-                f"Попробуйте еще раз или свяжитесь с администратором."
+        if job.batch is not None:
+            folder_path = job.duplicate["remote_path"].rsplit("/", 1)[0]
+            job.batch.add_result(
+                folder_path.rsplit("/", 1)[-1], await self._folder_link(job.duplicate), duplicate=True
             )
+            await self._batch_item_finished(job)
+            return
 
-            # Уведомляем всех разрешенных пользователей
-            for admin_id in self.config.allowed_user_ids:
-                try:
-                    await client.send_message(
-                        chat_id=admin_id,
-                        text=f"⚠️ Ошибка загрузки видео:\n\n"
-                             f"Пользователь: {username}\n"
-                             f"Файл: {original_filename if 'original_filename' in locals() else 'unknown'}\n"
-                             f"Ошибка: {error_msg}"
+        await self._final_status(job, await self._duplicate_text(job.duplicate))
+
+    async def _upload_job(self, job: BackupJob):
+        """Стадия выгрузки: временный файл → Яндекс Диск"""
+        if job.duplicate:
+            await self._finish_duplicate(job)
+            return
+
+        job.folder_name = job.folder_name or self._current_folder_name()
+
+        self.status.set(
+            job.status_msg,
+            f"⏳ Видео загружено ({job.file_size_mb:.1f} MB)\n"
+            f"📤 Загружаю на Яндекс Диск в папку {job.folder_name}..."
+        )
+
+        # Загружаем в хранилище чата
+        backend = self.config.storage_backend(job.chat_id)
+        logger.info(f"Uploading to {backend} storage: {job.folder_name}/{job.filename}")
+        self._journal_remote_path(job)
+        async with self._storage(backend, job.folder_name, job.file_size) as (account, storage):
+            job.account = account
+            job.public_url = await storage.upload_video(
+                job.source,
+                job.folder_name,
+                job.filename,
+                progress=self._upload_progress(job),
+                hasher=job.hasher if self.config.verify_uploads else None,
+            )
+            metrics.STORAGE_UPLOADS.labels(backend=backend, role="primary", result="ok").inc()
+            if job.thumbnail_path is not None:
+                await self._upload_thumbnail(job, storage)
+
+        await self._mirror_upload(job, backend)
+
+        # Удаляем временный файл
+        await self._remove_temp(job)
+
+        await self._remember_upload(job)
+        await self._finish_job(job)
+
+    async def _transfer_job(self, job: BackupJob):
+        """Потоковая стадия: скачивание и выгрузка одновременно"""
+        job.folder_name = job.folder_name or self._current_folder_name()
+
+        backend = self.config.storage_backend(job.chat_id)
+        logger.info(f"Streaming to {backend} storage: {job.folder_name}/{job.filename}")
+        self._journal_remote_path(job)
+        job.hasher = ContentHasher()
+        try:
+            async with self._storage(backend, job.folder_name, job.file_size) as (account, storage):
+                job.account = account
+                job.public_url = await self._stream_video(
+                    self.app,
+                    storage,
+                    job.message,
+                    job.folder_name,
+                    job.filename,
+                    self._download_progress(job),
+                    self._upload_progress(job),
+                    job.hasher
+                )
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            # Поток уже не перечитать: один раз скачиваем во временный файл,
+            # а дальше повторяем выгрузку из него сколько потребуется
+            logger.warning(f"Streaming upload failed ({e!r}), falling back to disk upload")
+            await self._download_job(job)
+            await self._upload_job(job)
+            return
+
+        metrics.STORAGE_UPLOADS.labels(backend=backend, role="primary", result="ok").inc()
+        await self._remember_upload(job)
+        await self._finish_job(job)
+
+    async def _mirror_upload(self, job: BackupJob, primary: str):
+        """
+        Копирует выгруженное видео во второе хранилище (STORAGE_MIRROR)
+
+        Ошибка зеркала не отменяет успешную основную выгрузку: она
+        логируется и видна в метрике backup_storage_uploads_total.
+        """
+        mirror = self.config.storage_mirror
+        # rest и webdav пишут на один и тот же Яндекс Диск
+        if not mirror or mirror == primary or {mirror, primary} == {"rest", "webdav"}:
+            return
+        try:
+            async with self._storage(mirror, job.folder_name, job.file_size) as (account, storage):
+                await storage.upload_video(
+                    job.source,
+                    job.folder_name,
+                    job.filename,
+                    hasher=job.hasher if self.config.verify_uploads else None,
+                )
+                if job.thumbnail_path is not None:
+                    await self._upload_thumbnail(job, storage)
+            if account is not None:
+                account.quota.add_used(job.file_size)
+            metrics.STORAGE_UPLOADS.labels(backend=mirror, role="mirror", result="ok").inc()
+            logger.info(f"Mirrored {job.folder_name}/{job.filename} to {mirror} storage")
+        except Exception as e:
+            metrics.STORAGE_UPLOADS.labels(backend=mirror, role="mirror", result="failed").inc()
+            logger.error(f"Failed to mirror {job.folder_name}/{job.filename} to {mirror} storage: {e!r}")
+
+    async def _final_status(self, job: BackupJob, text: str):
+        """Ставит итоговый статус задачи в очередь (слот задачи не ждет доставки)"""
+        self.status.set(job.status_msg, text, final=True)
+
+    async def _final_batch_status(self, batch):
+        """Итог по альбому или бэкфиллу: одно сообщение в чат и одно уведомление администраторам"""
+        self.status.set(batch.status_msg, batch.result_text(), final=True)
+
+        if isinstance(batch, BackfillRun):
+            await self.journal.save_backfill(batch.chat_id, **batch.checkpoint())
+
+        failure_text = batch.failure_text()
+        if failure_text:
+            await self._notify_admins(failure_text)
+
+    async def _batch_item_finished(self, job: BackupJob):
+        batch = job.batch
+        if batch.complete:
+            await self._final_batch_status(batch)
+        else:
+            self.status.set(batch.status_msg, batch.progress_text())
+
+    async def _finish_job(self, job: BackupJob):
+        if job.batch is not None:
+            job.batch.add_result(job.folder_name, job.public_url)
+            await self._batch_item_finished(job)
+            logger.info(f"Album video uploaded successfully: {job.public_url}")
+            return
+
+        await self._final_status(
+            job,
+            f"✅ Видео успешно загружено!\n\n"
+            f"📁 Папка: {job.folder_name}\n"
+            f"Все видео за сегодня: {job.public_url}"
+        )
+
+        logger.info(f"Video uploaded successfully: {job.public_url}")
+
+    async def _job_failed(self, job: BackupJob, e: Exception):
+        """Сообщает об ошибке задачи в чат и администраторам"""
+        error_msg = str(e)
+        logger.error(f"Error uploading video: {error_msg}", exc_info=e)
+
+        if job.job_id is not None:
+            self.journal.update(job.job_id, error=error_msg)
+
+        # Очищаем временный файл если он существует
+        await self._remove_temp(job)
+
+        if job.batch is not None:
+            job.batch.add_failure(job.filename, error_msg)
+            await self._batch_item_finished(job)
+            return
+
+        await self._final_status(
+            job,
+            f"❌ Ошибка при загрузке видео:\n\n"
+            f"{error_msg}\n\n"
+            f"Попробуйте еще раз или свяжитесь с администратором."
+        )
+
+        await self._notify_admins(
+            f"⚠️ Ошибка загрузки видео:\n\n"
+            f"Пользователь: {job.username}\n"
+            f"Файл: {job.filename}\n"
+            f"Ошибка: {error_msg}"
+        )
+
+    async def _notify_admins(self, text: str):
+        """Уведомляем всех разрешенных пользователей"""
+        for admin_id in self.config.allowed_user_ids:
+            try:
+                await self.app.send_message(chat_id=admin_id, text=text)
+            except Exception as notify_error:
+                logger.error(f"Failed to notify user {admin_id}: {notify_error}")
+
+    async def _stream_video(
+        self,
+        client: Client,
+        storage: StorageBackend,
+        message: Message,
+        folder_name: str,
+        filename: str,
+        download_progress,
+        upload_progress,
+        hasher: Optional[ContentHasher] = None
+    ) -> str:
+        """
+        Скачивает видео из Telegram и одновременно выгружает его в хранилище
+
+        Чанки идут через StreamBuffer с ограничением по памяти; на диск
+        поток попадает, только если выгрузка перестала забирать данные.
+        """
+        video = video_media(message)
+        buffer = StreamBuffer(
+            memory_limit=self.config.stream_buffer_bytes,
+            spill_path=self.temp_storage.unique_path(
+                temp_file_name(message.chat.id, message.id, f"{filename}.spill")
+            ),
+            stall_timeout=self.config.stream_stall_timeout,
+            temp_storage=self.temp_storage,
+            size=video.file_size,
+        )
+
+        async def produce():
+            try:
+                async for chunk in self.downloader.stream(message, video.file_size):
+                    await buffer.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await download_progress(buffer.bytes_written, video.file_size)
+
+                # get_file в Pyrogram глотает ошибки сети — проверяем размер сами
+                if buffer.bytes_written != video.file_size:
+                    raise Exception(
+                        f"Telegram download interrupted: got {buffer.bytes_written} "
+                        f"of {video.file_size} bytes"
                     )
-                except Exception as notify_error:
-                    logger.error(f"Failed to notify user {admin_id}: {notify_error}")
+                await buffer.close()
+            except Exception as e:
+                await buffer.abort(e)
+                raise
+
+        producer = asyncio.create_task(produce())
+        try:
+            public_url = await storage.upload_video(
+                buffer, folder_name, filename,
+                size=video.file_size, progress=upload_progress,
+                # Хеши считаются по тем же чанкам, что уходят в PUT
+                hasher=hasher if self.config.verify_uploads else None,
+            )
+            await producer
+        except Exception:
+            # Если упало скачивание — показываем его ошибку, а не ошибку PUT
+            if producer.done() and not producer.cancelled() and producer.exception():
+                raise producer.exception() from None
+            raise
+        finally:
+            if not producer.done():
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+            await buffer.cleanup()
+
+        if buffer.spilled:
+            logger.info(f"Stream for {filename} was partially spilled to disk")
 
-            # Очищаем временный файл если он существует
-            if 'temp_file_path' in locals() and temp_file_path.exists():
-                temp_file_path.unlink()
+        return public_url
 
     async def stats(self, client: Client, message: Message):
         """Команда /stats — показывает статистику"""
@@ -164,21 +1036,601 @@ class VideoBackupBot:
             return
 
         try:
-            stats = await self.yd_client.get_stats()
-            await message.reply_text(
-                f"📊 Статистика Яндекс Диска:\n\n"
-                f"💾 Использовано: {stats['used_gb']:.2f} GB\n"
-                f"📦 Доступно: {stats['total_gb']:.2f} GB\n"
-                f"📈 Занято: {stats['used_percent']:.1f}%"
+            # Снимки квоты из кэша — API вызывается, только если они устарели
+            quotas = await asyncio.gather(
+                *(account.quota.get() for account in self.accounts.accounts)
             )
+            gb = 1024 ** 3
+            total = sum(quota["total_space"] for quota in quotas)
+            used = sum(quota["used_space"] for quota in quotas)
+            free = sum(quota["free_space"] for quota in quotas)
+            lines = [
+                "📊 Статистика Яндекс Диска:",
+                "",
+                f"💾 Использовано: {used / gb:.2f} GB",
+                f"📦 Доступно: {total / gb:.2f} GB",
+                f"🆓 Свободно: {free / gb:.2f} GB",
+                f"📈 Занято: {used / total * 100 if total else 0:.1f}%",
+            ]
+            if len(quotas) > 1:
+                lines.append("")
+                lines.append("🗄 По аккаунтам:")
+                for account, quota in zip(self.accounts.accounts, quotas):
+                    lines.append(
+                        f"• Аккаунт {account.name}: {quota['used_space'] / gb:.2f} из "
+                        f"{quota['total_space'] / gb:.2f} GB, свободно {quota['free_space'] / gb:.2f} GB"
+                    )
+            lines.extend(await self._usage_lines())
+            lines.extend(self._limit_lines())
+            await message.reply_text("\n".join(lines))
         except Exception as e:
             logger.error(f"Error getting stats: {e}")
             await message.reply_text(f"❌ Ошибка получения статистики: {e}")
 
+    @staticmethod
+    def _usage_line(title: str, files: int, size: int, seconds: float) -> str:
+        speed = f", {size / seconds / (1024 * 1024):.1f} MB/s" if seconds > 0 else ""
+        return f"• {title}: {size / (1024 ** 3):.2f} GB, {files} видео{speed}"
+
+    def _limit_lines(self) -> List[str]:
+        """Текущие адаптивные лимиты параллельных запросов"""
+        if self.limits is None or not self.limits.limiters:
+            return []
+        lines = ["", "⚙️ Лимиты параллельности:"]
+        for limiter in self.limits.limiters:
+            lines.append(f"• {limiter.describe()}")
+        return lines
+
+    async def _usage_lines(self) -> List[str]:
+        """Загрузки за последние stats_days дней: по дням и по пользователям"""
+        days = self.config.stats_days
+        today = datetime.now(self.config.get_timezone()).date()
+        rows = await self.journal.usage((today - timedelta(days=days - 1)).isoformat())
+        if not rows:
+            return ["", f"📅 За {days} дн. ничего не загружено"]
+
+        by_day, by_user = {}, {}
+        for row in rows:
+            for key, totals in ((row["day"], by_day), (row["username"] or str(row["user_id"]), by_user)):
+                files, size, seconds = totals.get(key, (0, 0, 0.0))
+                totals[key] = (files + row["files"], size + row["bytes"], seconds + row["seconds"])
+
+        lines = ["", f"📅 Загружено за {days} дн.:"]
+        for day in sorted(by_day, reverse=True):
+            lines.append(self._usage_line(day, *by_day[day]))
+        lines.extend(["", "👥 По пользователям:"])
+        for username, totals in sorted(by_user.items(), key=lambda item: -item[1][1]):
+            lines.append(self._usage_line(username, *totals))
+        return lines
+
+    async def perf(self, client: Client, message: Message):
+        """
+        Команда /perf — профиль живого процесса (только администраторы)
+
+        /perf — профиль за PERF_PROFILE_SECONDS секунд
+        /perf <секунды> — профиль за указанное время (не больше PERF_PROFILE_MAX_SECONDS)
+        """
+        if message.from_user is None or message.from_user.id not in self.config.admin_user_ids:
+            return
+
+        seconds = self.config.perf_profile_seconds
+        args = message.command[1:]
+        if args:
+            try:
+                seconds = float(args[0])
+            except ValueError:
+                await message.reply_text("Использование: /perf [секунды]")
+                return
+        seconds = min(max(seconds, 1.0), self.config.perf_profile_max_seconds)
+
+        if self.monitor.profiling:
+            await message.reply_text("⏳ Профиль уже снимается")
+            return
+
+        status_msg = await message.reply_text(f"🩺 Снимаю профиль за {seconds:.0f} с...")
+        try:
+            profile = await self.monitor.profile(seconds)
+            text = "\n".join(self._perf_lines(profile))
+            # Telegram ограничивает сообщение 4096 символами
+            if len(text) > 4096:
+                text = text[:4095] + "…"
+            # Без разметки: в именах функций есть __ и <>
+            await status_msg.edit_text(text, parse_mode=ParseMode.DISABLED)
+        except Exception as e:
+            logger.error(f"Error collecting profile: {e}", exc_info=e)
+            await status_msg.edit_text(f"❌ Ошибка профилирования: {e}")
+
+    def _perf_lines(self, profile: Profile) -> List[str]:
+        """Текст ответа /perf: задержка loop, блокировки, горячие кадры и стадии задач"""
+        monitor = self.monitor
+        lines = [f"🩺 Профиль за {profile.seconds:.0f} с ({profile.samples} сэмплов)", ""]
+
+        if monitor.running:
+            lines.append(
+                f"⏱ Задержка event loop: сейчас {monitor.lag * 1000:.0f} ms, "
+                f"в среднем {monitor.average_lag * 1000:.0f} ms, максимум {monitor.max_lag * 1000:.0f} ms"
+            )
+            lines.append(
+                f"🐢 Блокировок loop дольше {monitor.stall_threshold * 1000:.0f} ms: {monitor.stall_count}"
+            )
+            timezone = self.config.get_timezone()
+            for stall in list(monitor.stalls)[-3:]:
+                when = datetime.fromtimestamp(stall.started, timezone).strftime("%H:%M:%S")
+                lines.append(f"• {when}, {stall.seconds:.2f} с: {stall.stack[-1] if stall.stack else '?'}")
+                lines.extend(f"    ← {frame}" for frame in reversed(stall.stack[-4:-1]))
+        else:
+            lines.append("⏱ Монитор event loop выключен (LOOP_MONITOR)")
+
+        busy = profile.loop_busy / profile.samples if profile.samples else 0
+        lines.extend(["", f"🔥 Event loop занят {busy:.0%} времени, горячие кадры:"])
+        for name, share in profile.top(profile.loop_frames, profile.samples, 10):
+            lines.append(f"• {share:.0%} {name}")
+        lines.extend(["", "📚 Функции loop с вложенными вызовами:"])
+        for name, share in profile.top(profile.loop_functions, profile.samples, 8):
+            lines.append(f"• {share:.0%} {name}")
+        if profile.thread_busy:
+            lines.extend(["", "🧵 Пул потоков (файлы, обработка):"])
+            for name, share in profile.top(profile.thread_frames, profile.samples, 5):
+                lines.append(f"• {share:.0%} {name}")
+
+        schedulers = (self.scheduler, self.backfill_scheduler)
+        active = [job for scheduler in schedulers for job in scheduler.active_jobs]
+        recent = sorted(
+            (job for scheduler in schedulers for job in scheduler.recent),
+            key=lambda job: job.state_since,
+        )[-5:]
+        for title, jobs in (("📋 Задачи в работе:", active), ("✅ Последние завершенные:", recent)):
+            if jobs:
+                lines.extend(["", title])
+                lines.extend(
+                    f"• {job.filename} ({job.file_size_mb:.1f} MB): {job.timeline}" for job in jobs
+                )
+        return lines
+
+    async def backfill(self, client: Client, message: Message):
+        """
+        Команда /backfill — загружает видео из истории чата
+
+        /backfill — продолжить с контрольной точки (или начать с первого сообщения)
+        /backfill <id> — начать с сообщения с указанным id
+        /backfill stop — остановить просмотр истории
+        """
+        if message.from_user is None or message.from_user.id not in self.config.allowed_user_ids:
+            return
+
+        chat_id = message.chat.id
+        args = message.command[1:]
+        run = self.backfills.get(chat_id)
+        scanning = run is not None and run.task is not None and not run.task.done()
+
+        if args and args[0] == "stop":
+            if not scanning:
+                await message.reply_text("Бэкфилл в этом чате не запущен")
+                return
+            run.stopped = True
+            run.task.cancel()
+            await asyncio.gather(run.task, return_exceptions=True)
+            await message.reply_text(
+                f"⏹ Бэкфилл остановлен на сообщении {run.next_id}.\n"
+                f"Уже найденные видео догрузятся; /backfill продолжит с этого места."
+            )
+            return
+
+        if scanning:
+            await message.reply_text("⏳ Бэкфилл в этом чате уже идет")
+            return
+
+        checkpoint = await self.journal.get_backfill(chat_id)
+        if args:
+            if not args[0].isdigit():
+                await message.reply_text("Использование: /backfill [id сообщения | stop]")
+                return
+            start_id = int(args[0])
+        elif checkpoint is None:
+            start_id = 1
+        elif checkpoint["status"] == "done":
+            start_id = checkpoint["end_message_id"] + 1
+        else:
+            start_id = checkpoint["next_message_id"]
+
+        # Все, что новее команды, бот увидит сам
+        end_id = message.id - 1
+        if start_id > end_id:
+            await message.reply_text("✅ Новых сообщений для бэкфилла нет")
+            return
+
+        logger.info(f"Backfill of chat {chat_id} requested: messages {start_id}..{end_id}")
+        status_msg = await message.reply_text("⏳ Начинаю бэкфилл истории чата...")
+        self._start_backfill(BackfillRun(chat_id, status_msg, start_id, end_id))
+
+    def _start_backfill(self, run: BackfillRun):
+        self.backfills[run.chat_id] = run
+        run.task = asyncio.create_task(self._run_backfill(run))
+
+    async def _existing_files(self) -> Dict[str, int]:
+        """Файлы, которые уже есть на Яндекс Диске (на всех аккаунтах): путь -> размер"""
+        existing = {}
+        for account in self.accounts.accounts:
+            # Видео, выгруженные во время листинга, в него не попадут — их не удаляем
+            listed_at = time.time()
+            try:
+                files = await account.client.list_files(account.client.ROOT_FOLDER)
+            except Exception as e:
+                logger.error(f"Cannot list Yandex Disk files of account {account.name} for backfill: {e}")
+                continue
+            # Хеши пригодятся, чтобы узнать видео после скачивания
+            await self.dedup.seed(
+                files, account.name,
+                root=account.client.ROOT_FOLDER, primary=account is self.accounts.primary,
+                listed_at=listed_at,
+            )
+            existing.update((f["path"], f["size"]) for f in files)
+        return existing
+
+    async def _run_backfill(self, run: BackfillRun):
+        """Просматривает историю чата и ставит найденные видео в очередь бэкфилла"""
+        try:
+            existing = await self._existing_files()
+            await self.journal.save_backfill(run.chat_id, **run.checkpoint())
+
+            async for last_id, messages in iter_history(self.app, run.chat_id, run.next_id, run.end_id):
+                for message in messages:
+                    await self._backfill_message(run, message, existing)
+
+                # Найденные видео уже в журнале задач — контрольная точка их не теряет
+                run.next_id = last_id + 1
+                await self.journal.save_backfill(run.chat_id, **run.checkpoint())
+                self.status.set(run.status_msg, run.progress_text())
+
+            run.scan_done = True
+            logger.info(
+                f"Backfill scan of chat {run.chat_id} finished: {run.found} videos queued, "
+                f"{run.skipped} already on disk"
+            )
+            if run.complete:
+                await self._final_batch_status(run)
+            else:
+                await self.journal.save_backfill(run.chat_id, **run.checkpoint())
+                self.status.set(run.status_msg, run.progress_text())
+
+        except asyncio.CancelledError:
+            # При остановке бота бэкфилл остается running и продолжится после запуска
+            if run.stopped:
+                await self.journal.save_backfill(run.chat_id, **run.checkpoint("stopped"))
+            raise
+        except Exception as e:
+            logger.error(f"Backfill of chat {run.chat_id} failed: {e}", exc_info=True)
+            await self.journal.save_backfill(run.chat_id, **run.checkpoint("stopped"))
+            self.status.set(
+                run.status_msg,
+                f"❌ Бэкфилл прерван на сообщении {run.next_id}:\n\n{e}\n\n"
+                f"/backfill продолжит с этого места.",
+                final=True
+            )
+
+    async def _backfill_message(self, run: BackfillRun, message: Message, existing: Dict[str, int]):
+        """Ставит видео из истории в очередь, если его еще нет на диске"""
+        video = video_media(message)
+        if video is None or message.from_user is None:
+            return
+        if message.from_user.id not in self.config.allowed_user_ids:
+            return
+
+        # Видео уже обработано (бот видел его живьем или в прошлом бэкфилле)
+        if await self.journal.find(message.chat.id, message.id):
+            return
+
+        filename = video_filename(message)
+        folder_name = self._folder_name_for(message.date)
+        remote_path = f"{YandexDiskClient.ROOT_FOLDER}/{folder_name}/{filename}"
+        if existing.get(remote_path) == video.file_size or await self.dedup.find_by_file_id(video.file_unique_id):
+            run.skipped += 1
+            return
+
+        # Диск заполнен — бэкфилл останавливается (QuotaError), продолжить можно позже
+        try:
+            await self._admit(message.chat.id, video.file_size)
+        except TempStorageError as e:
+            run.found += 1
+            run.add_failure(filename, str(e))
+            return
+
+        username = message.from_user.username or message.from_user.first_name
+        job = await self._create_job(
+            message, username, run.status_msg, run.status_message_id, queue="backfill"
+        )
+        if job.job_id is None:
+            return
+        # Видео ложится в папку по дате исходного сообщения, а не по сегодняшней
+        job.folder_name = folder_name
+        job.batch = run
+        self._journal_remote_path(job)
+
+        run.found += 1
+        # Ждет, если очередь бэкфилла заполнена — история читается не быстрее загрузки
+        await self.backfill_scheduler.submit(job)
+
+    async def _resume_backfills(self):
+        """Продолжает бэкфиллы, прерванные перезапуском"""
+        for row in await self.journal.running_backfills():
+            chat_id = row["chat_id"]
+            try:
+                status_msg = await self.app.get_messages(chat_id, row["status_message_id"])
+                if status_msg.empty:
+                    status_msg = await self.app.send_message(
+                        chat_id, "⏳ Продолжаю бэкфилл после перезапуска..."
+                    )
+
+                run = BackfillRun(
+                    chat_id, status_msg, row["next_message_id"], row["end_message_id"],
+                    status_message_id=row["status_message_id"],
+                )
+                run.found, run.skipped = row["found"], row["skipped"]
+                for job in await self.journal.batch_jobs(chat_id, row["status_message_id"]):
+                    if job["stage"] == "done":
+                        run.finished += 1
+                    elif job["stage"] == "failed":
+                        run.add_failure(job["filename"], job["error"] or "unknown error")
+
+                logger.info(f"Resuming backfill of chat {chat_id} from message {run.next_id}")
+                self._start_backfill(run)
+
+            except Exception as e:
+                logger.error(f"Cannot resume backfill of chat {chat_id}: {e}")
+
+    def _queues(self):
+        """Очереди журнала, задачи которых выполняет этот процесс"""
+        return {"all": ("live", "backfill"), "ingest": ("backfill",), "worker": ("live",)}[self.config.role]
+
+    async def _resume_jobs(self):
+        """Возвращает в очередь задачи, прерванные перезапуском"""
+        # Сначала бэкфиллы: их задачи продолжают отчитываться в общий статус
+        await self._resume_backfills()
+        rows = await self.journal.claim(
+            self.config.worker_id, self._queues(), self.config.job_lease_ttl, reclaim=True
+        )
+        await self._restore_jobs(rows, "⏳ Продолжаю загрузку видео после перезапуска...")
+
+    async def _restore_jobs(self, rows: List[dict], notice: str):
+        """
+        Ставит в очередь задачи из журнала (после перезапуска или взятые воркером)
+
+        Видео одного статусного сообщения снова собираются в пачку: в бэкфилл,
+        если он идет, или в альбом.
+        """
+        runs = {(run.chat_id, run.status_message_id): run for run in self.backfills.values()}
+        groups: Dict[tuple, List[dict]] = {}
+        for row in rows:
+            groups.setdefault((row["chat_id"], row["status_message_id"]), []).append(row)
+
+        for (chat_id, status_message_id), group in groups.items():
+            run = runs.get((chat_id, status_message_id))
+            batch = run
+            try:
+                # Сообщения группы и статус — одним запросом
+                ids = [row["message_id"] for row in group]
+                if run is None:
+                    ids.append(status_message_id)
+                fetched = await self.app.get_messages(chat_id, ids)
+                messages = fetched[:len(group)]
+                status_msg = run.status_msg if run is not None else fetched[-1]
+                if status_msg.empty:
+                    first = next((m for m in messages if not m.empty), None)
+                    if first is None:
+                        raise Exception("messages with video are no longer available")
+                    status_msg = await first.reply_text(notice)
+                if batch is None and len(group) > 1:
+                    batch = AlbumBatch(status_msg, total=len(group))
+            except Exception as e:
+                messages, status_msg = [None] * len(group), None
+                error = e
+            else:
+                error = None
+
+            for row, message in zip(group, messages):
+                try:
+                    if error is not None:
+                        raise error
+                    if message.empty or video_media(message) is None:
+                        raise Exception("message with video is no longer available")
+
+                    in_memory = self._use_memory(row["chat_id"], row["file_size"])
+                    job = BackupJob(
+                        user_id=row["user_id"],
+                        username=row["username"],
+                        message=message,
+                        status_msg=status_msg,
+                        filename=row["filename"],
+                        file_size=row["file_size"],
+                        stream=self._use_stream(row["chat_id"]) and not in_memory,
+                        job_id=row["id"],
+                        in_memory=in_memory,
+                    )
+                    if row["remote_path"]:
+                        # Папка выбрана до перезапуска (у бэкфилла — по дате сообщения)
+                        job.folder_name = row["remote_path"].split("/")[-2]
+                    job.batch = batch
+                    if isinstance(batch, AlbumBatch):
+                        batch.jobs.append(job)
+
+                    logger.info(f"Resuming job {row['id']} from stage {row['stage']}: {job}")
+                    scheduler = self.backfill_scheduler if run is not None else self.scheduler
+                    await scheduler.submit(job)
+
+                except Exception as e:
+                    logger.error(f"Cannot resume job {row['id']}: {e}")
+                    self.journal.update(row["id"], stage="failed", error=f"resume failed: {e}")
+                    if batch is not None:
+                        batch.add_failure(row["filename"], f"resume failed: {e}")
+                        if batch.complete:
+                            await self._final_batch_status(batch)
+
+    async def _worker_loop(self):
+        """Роль worker: забирает задачи из общего журнала, пока есть свободные слоты"""
+        # Первый запрос забирает и задачи, которые воркер держал до перезапуска
+        reclaim = True
+        while True:
+            free = self.scheduler.download_workers - self.scheduler.queued
+            rows = []
+            if free > 0:
+                try:
+                    rows = await self.journal.claim(
+                        self.config.worker_id, self._queues(), self.config.job_lease_ttl,
+                        limit=free, reclaim=reclaim
+                    )
+                    reclaim = False
+                    if rows:
+                        logger.info(f"Claimed {len(rows)} job(s) from the shared journal")
+                        await self._restore_jobs(rows, "⏳ Загружаю видео...")
+                except Exception as e:
+                    logger.error(f"Failed to claim jobs: {e}")
+            if not rows:
+                await asyncio.sleep(self.config.worker_poll_interval)
+
+    async def _heartbeat_loop(self):
+        """Продлевает аренду задач этого процесса, пока он жив"""
+        while True:
+            await asyncio.sleep(self.config.job_lease_ttl / 3)
+            try:
+                await self.journal.renew(self.config.worker_id, self.config.job_lease_ttl)
+                if self.config.role == "ingest":
+                    self._shared_pending_bytes = await self.journal.pending_bytes()
+            except Exception as e:
+                logger.error(f"Failed to renew job leases: {e}")
+
+    async def _warm_folder_cache(self):
+        """
+        Загружает состояние папок дат одним листингом при старте
+
+        Папки, которые уже есть на аккаунте, закрепляются за ним (аккаунты
+        обходятся по порядку, так что прежние папки остаются на основном).
+        """
+        for account in self.accounts.accounts:
+            try:
+                folders = await account.client.warm_folder_cache()
+                await self.accounts.learn(account, folders)
+            except Exception as e:
+                logger.error(f"Failed to warm folder cache of account {account.name}: {e}")
+
+    async def _seed_dedup(self):
+        """Заполняет индекс дубликатов хешами файлов, уже лежащих на диске"""
+        for account in self.accounts.accounts:
+            listed_at = time.time()
+            try:
+                files = await account.client.list_files(account.client.ROOT_FOLDER)
+                count = await self.dedup.seed(
+                    files, account.name,
+                    root=account.client.ROOT_FOLDER, primary=account is self.accounts.primary,
+                    listed_at=listed_at,
+                )
+                logger.info(f"Dedup index seeded with {count} files from Yandex Disk account {account.name}")
+            except Exception as e:
+                logger.error(f"Failed to seed dedup index from account {account.name}: {e}")
+
+    @staticmethod
+    def _dir_size(path: Path) -> int:
+        total = 0
+        for entry in path.iterdir():
+            try:
+                if entry.is_file():
+                    total += entry.stat().st_size
+            except OSError:
+                pass  # Файл удалили во время обхода
+        return total
+
+    async def _collect_metrics(self):
+        """Обновляет метрики, которые считаются только при запросе /metrics"""
+        metrics.TEMP_DIR_BYTES.set(await asyncio.to_thread(self._dir_size, self.temp_dir))
+
+    async def _sweep_temp(self):
+        """Удаляет забытые временные файлы, кроме файлов незавершенных задач"""
+        keep = set()
+        for row in await self.journal.unfinished():
+            name = temp_file_name(row["chat_id"], row["message_id"], row["filename"])
+            keep.add(name)
+        try:
+            await self.temp_storage.sweep_orphans(keep)
+        except OSError as e:
+            logger.error(f"Failed to sweep temp dir: {e}")
+
+    async def startup(self):
+        """Открывает общие ресурсы (без подключения к Telegram)"""
+        await self.journal.start()
+        await self._sweep_temp()
+        await self.dedup.start()
+        for account in self.accounts.accounts:
+            for client in account.clients:
+                await client.start()
+            account.quota.start()
+        if self.local_storage is not None:
+            await self.local_storage.start()
+        if self.config.transcode_enabled:
+            self.transcoder.start()
+        self.status.start()
+        self.scheduler.start()
+        self.backfill_scheduler.start()
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        if self.config.loop_monitor:
+            self.monitor.start()
+
+    async def shutdown(self):
+        """Останавливает задачи и закрывает общие ресурсы"""
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await self.albums.stop()
+        backfills = [run.task for run in self.backfills.values() if run.task is not None]
+        for task in backfills:
+            task.cancel()
+        await asyncio.gather(*backfills, return_exceptions=True)
+        await self.scheduler.stop()
+        await self.backfill_scheduler.stop()
+        await self.transcoder.close()
+        await self.status.stop()
+        for account in self.accounts.accounts:
+            await account.quota.stop()
+            for client in account.clients:
+                await client.close()
+        if self.local_storage is not None:
+            await self.local_storage.close()
+        await self.dedup.close()
+        await self.monitor.stop()
+        # Незавершенные задачи сразу достаются другим процессам (или этому после перезапуска)
+        try:
+            await self.journal.release(self.config.worker_id)
+        except Exception as e:
+            logger.error(f"Failed to release job leases: {e}")
+        await self.journal.close()
+
+    async def main(self):
+        """Жизненный цикл бота: общие ресурсы открываются один раз на весь запуск"""
+        await self.startup()
+        try:
+            await self.app.start()
+            logger.info(f"Bot started (role {self.config.role}, id {self.config.worker_id})")
+            background = [
+                asyncio.create_task(self._warm_folder_cache()),
+                asyncio.create_task(self._heartbeat_loop()),
+            ]
+            if self.config.role == "worker":
+                # Свои задачи до перезапуска воркер заберет первым же запросом
+                background.append(asyncio.create_task(self._worker_loop()))
+            else:
+                background.append(asyncio.create_task(self._resume_jobs()))
+                if self.config.dedup_seed_on_start:
+                    background.append(asyncio.create_task(self._seed_dedup()))
+            await idle()
+            for task in background:
+                task.cancel()
+            await self.downloader.close()
+            await self.app.stop()
+        finally:
+            await self.shutdown()
+
     def run(self):
         """Запуск бота"""
         logger.info("Starting bot...")
-        self.app.run()
+        self.app.run(self.main())
 
 
 if __name__ == '__main__':
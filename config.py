@@ -3,6 +3,7 @@
 """
 
 import os
+import socket
 from pathlib import Path
 from typing import List
 import pytz
@@ -12,6 +13,25 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _env_bool(name: str, default: bool) -> bool:
+    """Читает булеву переменную окружения (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_number(name: str, default, cast=int):
+    """Читает числовую переменную окружения"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return cast(value.strip())
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got: {value}")
+
+
 class Config:
     """Конфигурация приложения"""
     
@@ -31,10 +51,16 @@ class Config:
         if not self.telegram_api_hash:
             raise ValueError("TELEGRAM_API_HASH not set in environment")
         
-        # Yandex Disk OAuth Token
-        self.yandex_token = os.getenv("YANDEX_OAUTH_TOKEN")
-        if not self.yandex_token:
+        # Yandex Disk OAuth Token (несколько аккаунтов — токены через запятую;
+        # порядок не менять: по нему видео привязаны к аккаунтам)
+        self.yandex_tokens = [
+            token.strip()
+            for token in os.getenv("YANDEX_OAUTH_TOKEN", "").split(",")
+            if token.strip()
+        ]
+        if not self.yandex_tokens:
             raise ValueError("YANDEX_OAUTH_TOKEN not set in environment")
+        self.yandex_token = self.yandex_tokens[0]
         
         # Разрешенные пользователи (ID через запятую)
         allowed_users_str = os.getenv("ALLOWED_USER_IDS", "")
@@ -45,6 +71,13 @@ class Config:
             int(user_id.strip()) 
             for user_id in allowed_users_str.split(",")
         ]
+
+        # Администраторы (команда /perf); по умолчанию — все разрешенные пользователи
+        self.admin_user_ids = [
+            int(user_id.strip())
+            for user_id in os.getenv("ADMIN_USER_IDS", "").split(",")
+            if user_id.strip()
+        ] or list(self.allowed_user_ids)
         
         # Временная зона
         self.timezone = os.getenv("TIMEZONE", "Europe/Moscow")
@@ -52,7 +85,190 @@ class Config:
             pytz.timezone(self.timezone)
         except pytz.exceptions.UnknownTimeZoneError:
             raise ValueError(f"Unknown timezone: {self.timezone}")
+
+        # Каталог для постоянных данных бота (журнал задач и т.п.)
+        self.data_dir = Path(os.getenv("DATA_DIR", "/app/data"))
+        # Как часто изменения журнала задач сбрасываются в SQLite (секунды)
+        self.journal_flush_interval = _env_number("JOURNAL_FLUSH_INTERVAL", 2.0, float)
+
+        # Сколько секунд доверять кэшу папок и публичных ссылок
+        self.folder_cache_ttl = _env_number("FOLDER_CACHE_TTL", 86400.0, float)
+
+        # Заполнять индекс дубликатов хешами файлов с Яндекс Диска при старте
+        self.dedup_seed_on_start = _env_bool("DEDUP_SEED_ON_START", True)
+
+        # Потоковая загрузка: Telegram → память → Яндекс Диск без временного файла
+        self.stream_uploads = _env_bool("STREAM_UPLOADS", True)
+        self.stream_buffer_bytes = _env_number("STREAM_BUFFER_MB", 32) * 1024 * 1024
+        # Через сколько секунд простоя выгрузки поток начинает писаться на диск
+        self.stream_stall_timeout = _env_number("STREAM_STALL_TIMEOUT", 10.0, float)
+        # Видео до MEMORY_UPLOAD_MB скачиваются в память и выгружаются из нее
+        # без временного файла (0 — выключено). В памяти одновременно не больше
+        # DOWNLOAD_WORKERS + UPLOAD_WORKERS таких видео
+        self.memory_upload_bytes = _env_number("MEMORY_UPLOAD_MB", 10.0, float) * 1024 * 1024
+
+        # Пул HTTP соединений к Яндекс Диску
+        self.yandex_pool_limit = _env_number("YANDEX_POOL_LIMIT", 20)
+        self.yandex_pool_limit_per_host = _env_number("YANDEX_POOL_LIMIT_PER_HOST", 8)
+        self.yandex_dns_cache_ttl = _env_number("YANDEX_DNS_CACHE_TTL", 300)
+        self.yandex_keepalive_timeout = _env_number("YANDEX_KEEPALIVE_TIMEOUT", 60.0, float)
+        # Размер чанка при выгрузке файла (читается в пуле потоков, а не в event loop)
+        self.upload_chunk_bytes = int(_env_number("UPLOAD_CHUNK_MB", 4.0, float) * 1024 * 1024)
+        if self.upload_chunk_bytes < 64 * 1024:
+            raise ValueError("UPLOAD_CHUNK_MB must be at least 0.0625 (64 KB)")
+
+        # Адаптивные лимиты параллельных запросов (AIMD): 429/5xx и FloodWait
+        # уменьшают лимит вдвое, пока задержка не выросла больше чем в
+        # ADAPTIVE_LATENCY_TOLERANCE раз — лимит растет до потолка
+        # (YANDEX_POOL_LIMIT_PER_HOST и DOWNLOAD_CONNECTIONS на воркер)
+        self.adaptive_limits = _env_bool("ADAPTIVE_LIMITS", True)
+        self.adaptive_limit_min = _env_number("ADAPTIVE_LIMIT_MIN", 1)
+        self.adaptive_latency_tolerance = _env_number("ADAPTIVE_LATENCY_TOLERANCE", 2.0, float)
+        if self.adaptive_limit_min < 1 or self.adaptive_latency_tolerance < 1:
+            raise ValueError("ADAPTIVE_LIMIT_MIN and ADAPTIVE_LATENCY_TOLERANCE must be >= 1")
+
+        # Параллельное скачивание из Telegram: соединений на одно видео и размер части
+        self.download_connections = _env_number("DOWNLOAD_CONNECTIONS", 4)
+        self.download_part_mb = _env_number("DOWNLOAD_PART_MB", 8)
+        if self.download_connections < 1 or self.download_part_mb < 1:
+            raise ValueError("DOWNLOAD_CONNECTIONS and DOWNLOAD_PART_MB must be >= 1")
+
+        # Повторы загрузки на Яндекс Диск
+        self.upload_retries = _env_number("UPLOAD_RETRIES", 5)
+        self.upload_retry_base_delay = _env_number("UPLOAD_RETRY_BASE_DELAY", 2.0, float)
+        self.upload_retry_max_delay = _env_number("UPLOAD_RETRY_MAX_DELAY", 120.0, float)
+
+        # Обработка видео перед выгрузкой (нужен ffmpeg): off, remux или compress.
+        # TRANSCODE_MODE — для всех чатов, TRANSCODE_CHATS — исключения "chat_id:режим,..."
+        self.transcode_mode_default = os.getenv("TRANSCODE_MODE", "off").strip().lower()
+        self.transcode_chats = {}
+        for item in os.getenv("TRANSCODE_CHATS", "").split(","):
+            if item.strip():
+                chat_id, _, mode = item.strip().rpartition(":")
+                self.transcode_chats[int(chat_id)] = mode.strip().lower()
+        for mode in (self.transcode_mode_default, *self.transcode_chats.values()):
+            if mode not in ("off", "remux", "compress"):
+                raise ValueError(f"Unknown transcode mode: {mode} (expected off, remux or compress)")
+        # Параллельных обработок (0 — по лимиту CPU контейнера), минимальная
+        # экономия, при которой пережатый файл заменяет исходный, и параметры x264
+        self.transcode_workers = _env_number("TRANSCODE_WORKERS", 1)
+        self.transcode_min_saving = _env_number("TRANSCODE_MIN_SAVING", 10.0, float) / 100
+        self.transcode_crf = _env_number("TRANSCODE_CRF", 26)
+        self.transcode_max_height = _env_number("TRANSCODE_MAX_HEIGHT", 0)
+        self.transcode_thumbnails = _env_bool("TRANSCODE_THUMBNAILS", True)
+        self.transcode_timeout = _env_number("TRANSCODE_TIMEOUT", 3600.0, float)
+
+        # Хранилище видео: rest (REST API Яндекс Диска), webdav (WebDAV Яндекс
+        # Диска — без запроса URL загрузки на каждое видео) или local (папка
+        # LOCAL_STORAGE_DIR, например смонтированный NAS или S3 через s3fs).
+        # STORAGE_BACKEND — для всех чатов, STORAGE_CHATS — исключения "chat_id:хранилище,...";
+        # STORAGE_MIRROR — второе хранилище, куда дополнительно копируется каждое видео
+        self.storage_backend_default = os.getenv("STORAGE_BACKEND", "rest").strip().lower()
+        self.storage_chats = {}
+        for item in os.getenv("STORAGE_CHATS", "").split(","):
+            if item.strip():
+                chat_id, _, backend = item.strip().rpartition(":")
+                self.storage_chats[int(chat_id)] = backend.strip().lower()
+        self.storage_mirror = os.getenv("STORAGE_MIRROR", "").strip().lower() or None
+        for backend in (self.storage_backend_default, *self.storage_chats.values(), self.storage_mirror):
+            if backend is not None and backend not in ("rest", "webdav", "local"):
+                raise ValueError(f"Unknown storage backend: {backend} (expected rest, webdav or local)")
+        # Папка хранилища local и адрес, по которому она раздается (для ссылок)
+        self.local_storage_dir = Path(os.getenv("LOCAL_STORAGE_DIR", "/app/storage"))
+        self.local_storage_url = os.getenv("LOCAL_STORAGE_URL", "").strip()
+
+        # Квота Яндекс Диска: как часто запрашивать у API (между запросами
+        # учитывается локально); видео больше свободного места отклоняются сразу
+        self.quota_ttl = _env_number("QUOTA_TTL", 300.0, float)
+
+        # Статистика /stats: за сколько дней показывать и сколько дней хранить
+        self.stats_days = _env_number("STATS_DAYS", 7)
+        self.usage_history_days = _env_number("USAGE_HISTORY_DAYS", 30)
+        if self.stats_days < 1 or self.usage_history_days < self.stats_days:
+            raise ValueError("STATS_DAYS must be >= 1 and USAGE_HISTORY_DAYS must be >= STATS_DAYS")
+
+        # Сверка md5/sha256 загруженного файла с метаданными Яндекс Диска:
+        # сколько секунд ждать хеши и сколько раз перезагружать при несовпадении
+        self.verify_uploads = _env_bool("VERIFY_UPLOADS", True)
+        self.verify_timeout = _env_number("VERIFY_TIMEOUT", 30.0, float)
+        self.verify_retries = _env_number("VERIFY_RETRIES", 2)
+
+        # Ограничение частоты правок статусных сообщений
+        self.status_chat_interval = _env_number("STATUS_CHAT_INTERVAL", 3.0, float)
+        self.status_global_rate = _env_number("STATUS_GLOBAL_RATE", 20.0, float)
+
+        # Сколько секунд ждать остальные видео альбома (0 — обрабатывать по одному)
+        self.album_window = _env_number("ALBUM_WINDOW", 2.0, float)
+
+        # Планировщик задач: размеры пулов и длина очереди
+        self.download_workers = _env_number("DOWNLOAD_WORKERS", 2)
+        self.upload_workers = _env_number("UPLOAD_WORKERS", 2)
+        self.max_queued_jobs = _env_number("MAX_QUEUED_JOBS", 50)
+        if min(self.download_workers, self.upload_workers, self.max_queued_jobs) < 1:
+            raise ValueError("DOWNLOAD_WORKERS, UPLOAD_WORKERS and MAX_QUEUED_JOBS must be >= 1")
+
+        # Роль процесса: all — все в одном процессе; ingest — принимает видео
+        # из Telegram и кладет задачи в общий журнал; worker — забирает задачи
+        # из журнала, скачивает и выгружает (воркеров может быть несколько)
+        self.role = os.getenv("BOT_ROLE", "all").strip().lower()
+        if self.role not in ("all", "ingest", "worker"):
+            raise ValueError(f"Unknown BOT_ROLE: {self.role} (expected all, ingest or worker)")
+        # Имя процесса в журнале (у каждого воркера свое; по умолчанию — имя хоста)
+        self.worker_id = os.getenv("WORKER_ID", "").strip() or socket.gethostname()
+        # Аренда задачи: сколько секунд без продления, чтобы ее забрал другой
+        # процесс, и как часто воркер проверяет очередь
+        self.job_lease_ttl = _env_number("JOB_LEASE_TTL", 120.0, float)
+        self.worker_poll_interval = _env_number("WORKER_POLL_INTERVAL", 2.0, float)
+
+        # Бэкфилл истории чата: параллельных скачиваний и выгрузок (отдельно от живых видео)
+        self.backfill_workers = _env_number("BACKFILL_WORKERS", 4)
+        if self.backfill_workers < 1:
+            raise ValueError("BACKFILL_WORKERS must be >= 1")
+
+        # Временные файлы: папка, лимит суммарного объема (0 — без лимита),
+        # сколько места оставлять свободным на диске и возраст «забытых» файлов
+        self.temp_dir = Path(os.getenv("TEMP_DIR", "/tmp/telegram_videos"))
+        self.temp_budget_bytes = _env_number("TEMP_BUDGET_MB", 0) * 1024 * 1024
+        self.temp_min_free_bytes = _env_number("TEMP_MIN_FREE_MB", 1024) * 1024 * 1024
+        self.temp_orphan_age = _env_number("TEMP_ORPHAN_MINUTES", 60.0, float) * 60
+
+        # HTTP эндпоинт /metrics для Prometheus (0 — выключен)
+        self.metrics_port = _env_number("METRICS_PORT", 0)
+        self.metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
+
+        # Задержка event loop: замер раз в LOOP_MONITOR_INTERVAL секунд,
+        # блокировки loop дольше LOOP_STALL_THRESHOLD секунд пишутся в лог со стеком
+        self.loop_monitor = _env_bool("LOOP_MONITOR", True)
+        self.loop_monitor_interval = _env_number("LOOP_MONITOR_INTERVAL", 0.1, float)
+        self.loop_stall_threshold = _env_number("LOOP_STALL_THRESHOLD", 0.25, float)
+        if self.loop_monitor_interval <= 0 or self.loop_stall_threshold <= 0:
+            raise ValueError("LOOP_MONITOR_INTERVAL and LOOP_STALL_THRESHOLD must be positive")
+
+        # Сэмплирующий профиль /perf: длительность по умолчанию и максимум (секунды)
+        self.perf_profile_seconds = _env_number("PERF_PROFILE_SECONDS", 5.0, float)
+        self.perf_profile_max_seconds = _env_number("PERF_PROFILE_MAX_SECONDS", 30.0, float)
     
+    @property
+    def transcode_enabled(self) -> bool:
+        """Обрабатывается ли видео хотя бы одного чата"""
+        return any(mode != "off" for mode in (self.transcode_mode_default, *self.transcode_chats.values()))
+
+    def transcode_mode(self, chat_id: int) -> str:
+        """Режим обработки видео для чата"""
+        return self.transcode_chats.get(chat_id, self.transcode_mode_default)
+
+    @property
+    def storage_backends(self) -> set:
+        """Хранилища, которые используются хотя бы для одного чата"""
+        backends = {self.storage_backend_default, *self.storage_chats.values()}
+        if self.storage_mirror:
+            backends.add(self.storage_mirror)
+        return backends
+
+    def storage_backend(self, chat_id: int) -> str:
+        """Основное хранилище видео чата"""
+        return self.storage_chats.get(chat_id, self.storage_backend_default)
+
     def get_timezone(self):
         """Возвращает объект timezone"""
         return pytz.timezone(self.timezone)
@@ -0,0 +1,2 @@
+# test_token.py — ручная проверка OAuth токена (python test_token.py), а не тест pytest
+collect_ignore = ["test_token.py"]
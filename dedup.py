@@ -0,0 +1,227 @@
+"""
+Индекс уже сохраненных видео: повторные пересылки не загружаются заново
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ContentHasher:
+    """Считает md5 и sha256 по мере прохождения чанков (без повторного чтения файла)"""
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.verified: Optional[bool] = None  # Результат сверки с Яндекс Диском после загрузки
+
+    def update(self, chunk: bytes):
+        self._md5.update(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+
+class DedupIndex:
+    """
+    Индекс видео на Яндекс Диске по file_unique_id и хешу содержимого.
+
+    Telegram сохраняет file_unique_id при пересылке, поэтому большинство
+    дубликатов находятся еще до скачивания. Видео, загруженное заново другим
+    человеком, совпадет по sha256/md5 — их Яндекс Диск отдает в метаданных,
+    так что индекс заполняется и файлами, загруженными до появления индекса.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dedup")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS videos (
+                    remote_path TEXT PRIMARY KEY,
+                    file_unique_id TEXT,
+                    md5 TEXT,
+                    sha256 TEXT,
+                    size INTEGER,
+                    public_url TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            # Когда хеши загруженного файла сверены с Яндекс Диском (для аудита)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(videos)")}
+            if "verified_at" not in columns:
+                self._conn.execute("ALTER TABLE videos ADD COLUMN verified_at REAL")
+            # Аккаунт Яндекс Диска, на котором лежит файл (NULL — основной)
+            if "account" not in columns:
+                self._conn.execute("ALTER TABLE videos ADD COLUMN account TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS videos_file_unique_id ON videos (file_unique_id)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS videos_sha256 ON videos (sha256)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS videos_md5 ON videos (md5)")
+
+    async def start(self):
+        await self._run(self._open)
+        logger.info(f"Dedup index opened: {self.path}")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def _select_one(self, where: str, *args) -> Optional[dict]:
+        row = self._conn.execute(
+            f"SELECT * FROM videos WHERE {where} ORDER BY updated_at LIMIT 1", args
+        ).fetchone()
+        return dict(row) if row else None
+
+    async def find_by_file_id(self, file_unique_id: str) -> Optional[dict]:
+        """Ищет видео по file_unique_id из Telegram"""
+        return await self._run(self._select_one, "file_unique_id = ?", file_unique_id)
+
+    async def find_by_hash(self, sha256: str, md5: str, size: int) -> Optional[dict]:
+        """Ищет видео по хешу содержимого"""
+        return await self._run(
+            self._select_one,
+            "size = ? AND (sha256 = ? OR md5 = ?)",
+            size, sha256, md5
+        )
+
+    async def add(
+        self,
+        remote_path: str,
+        size: int,
+        file_unique_id: Optional[str] = None,
+        md5: Optional[str] = None,
+        sha256: Optional[str] = None,
+        public_url: Optional[str] = None,
+        verified: bool = False,
+        account: Optional[str] = None
+    ):
+        """Добавляет или дополняет запись о файле на Яндекс Диске"""
+        def upsert():
+            now = time.time()
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO videos (
+                        remote_path, file_unique_id, md5, sha256, size, public_url,
+                        verified_at, account, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (remote_path) DO UPDATE SET
+                        file_unique_id = COALESCE(excluded.file_unique_id, file_unique_id),
+                        md5 = COALESCE(excluded.md5, md5),
+                        sha256 = COALESCE(excluded.sha256, sha256),
+                        size = excluded.size,
+                        public_url = COALESCE(excluded.public_url, public_url),
+                        verified_at = COALESCE(excluded.verified_at, verified_at),
+                        account = COALESCE(excluded.account, account),
+                        updated_at = excluded.updated_at
+                    """,
+                    (remote_path, file_unique_id, md5, sha256, size, public_url,
+                     now if verified else None, account, now)
+                )
+
+        await self._run(upsert)
+
+    async def remove(self, remote_path: str):
+        """Удаляет запись о файле (например, его удалили с Яндекс Диска)"""
+        def delete():
+            with self._conn:
+                self._conn.execute("DELETE FROM videos WHERE remote_path = ?", (remote_path,))
+
+        await self._run(delete)
+
+    async def seed(
+        self,
+        files: Iterable[dict],
+        account: Optional[str] = None,
+        root: Optional[str] = None,
+        primary: bool = False,
+        listed_at: Optional[float] = None
+    ) -> int:
+        """
+        Заполняет индекс метаданными файлов с Яндекс Диска
+
+        Args:
+            files: Записи с ключами path, size, md5, sha256
+            account: Аккаунт, с которого получен список
+            root: Папка, листинг которой полный, — записи аккаунта под ней,
+                которых нет в files (файлы удалили с диска), удаляются
+            primary: Аккаунт основной — ему принадлежат и записи без аккаунта
+            listed_at: Время начала листинга (time.time()) — записи, добавленные
+                после него, в files попасть не могли и не удаляются
+
+        Returns:
+            Количество записей
+        """
+        files = list(files)
+
+        def prune():
+            owner = "account = ? OR account IS NULL" if primary else "account = ?"
+            rows = self._conn.execute(
+                f"SELECT remote_path FROM videos WHERE ({owner}) AND updated_at < ?",
+                (account, listed_at if listed_at is not None else float("inf"))
+            ).fetchall()
+            prefix = f"{root.strip('/')}/"
+            listed = {f["path"] for f in files}
+            stale = [
+                (row["remote_path"],) for row in rows
+                if row["remote_path"].startswith(prefix) and row["remote_path"] not in listed
+            ]
+            self._conn.executemany("DELETE FROM videos WHERE remote_path = ?", stale)
+            if stale:
+                logger.info(f"Dropped {len(stale)} dedup entries of files deleted from account {account}")
+
+        def insert():
+            now = time.time()
+            with self._conn:
+                if root is not None:
+                    prune()
+                self._conn.executemany(
+                    """
+                    INSERT INTO videos (remote_path, md5, sha256, size, account, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (remote_path) DO UPDATE SET
+                        md5 = excluded.md5,
+                        sha256 = excluded.sha256,
+                        size = excluded.size,
+                        account = COALESCE(excluded.account, account)
+                    """,
+                    [
+                        (f["path"], f.get("md5"), f.get("sha256"), f.get("size", 0), account, now)
+                        for f in files
+                    ]
+                )
+            return len(files)
+
+        return await self._run(insert)
@@ -0,0 +1,376 @@
+"""
+Параллельное скачивание больших видео из Telegram по нескольким соединениям
+"""
+
+import asyncio
+import logging
+import math
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from pyrogram import Client, raw
+from pyrogram.errors import AuthBytesInvalid, FloodWait, Unauthorized
+from pyrogram.file_id import FileId
+from pyrogram.session import Auth, Session
+from pyrogram.types import Message
+
+from limiter import AdaptiveLimiter
+from media import video_media
+
+logger = logging.getLogger(__name__)
+
+
+class CdnRedirect(Exception):
+    """Telegram отдает файл через CDN — его скачивает stream_media"""
+
+
+class MediaSessions:
+    """
+    Пул media-сессий Pyrogram к DC, где лежат файлы.
+
+    Client.stream_media открывает новую сессию на каждый вызов, а для файла
+    из чужого DC еще и создает ключ авторизации и делает
+    ExportAuthorization. Здесь сессия после части возвращается в пул и
+    достается следующим частям и файлам. Ключ чужого DC создается и
+    авторизуется один раз, следующие сессии к DC открываются с ним же.
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+        self._idle: Dict[int, List[Session]] = {}
+        self._auth_keys: Dict[int, bytes] = {}  # DC -> авторизованный ключ (кроме своего DC)
+        self._lock = asyncio.Lock()
+        self._stopping: Set[asyncio.Task] = set()
+
+    async def _authorize(self, dc_id: int, test_mode: bool) -> Session:
+        auth_key = await Auth(self.client, dc_id, test_mode).create()
+        session = Session(self.client, dc_id, auth_key, test_mode, is_media=True)
+        await session.start()
+        for _ in range(3):
+            exported = await self.client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+            try:
+                await session.invoke(
+                    raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes)
+                )
+                return session
+            except AuthBytesInvalid:
+                continue
+        await session.stop()
+        raise AuthBytesInvalid
+
+    async def _open(self, dc_id: int) -> Session:
+        storage = self.client.storage
+        test_mode = await storage.test_mode()
+        if dc_id == await storage.dc_id():
+            auth_key = await storage.auth_key()
+        else:
+            async with self._lock:
+                auth_key = self._auth_keys.get(dc_id)
+                if auth_key is None:
+                    session = await self._authorize(dc_id, test_mode)
+                    self._auth_keys[dc_id] = session.auth_key
+                    logger.info(f"Authorized media sessions for DC {dc_id}")
+                    return session
+
+        session = Session(self.client, dc_id, auth_key, test_mode, is_media=True)
+        await session.start()
+        return session
+
+    async def acquire(self, dc_id: int) -> Session:
+        """Свободная сессия к DC (новая, если в пуле пусто)"""
+        idle = self._idle.get(dc_id)
+        if idle:
+            return idle.pop()
+        return await self._open(dc_id)
+
+    def release(self, session: Session):
+        """Возвращает исправную сессию в пул"""
+        self._idle.setdefault(session.dc_id, []).append(session)
+
+    def discard(self, session: Session, error: Optional[BaseException] = None):
+        """Закрывает сессию после ошибки (ключ без авторизации больше не используется)"""
+        if isinstance(error, Unauthorized):
+            self._auth_keys.pop(session.dc_id, None)
+        task = asyncio.ensure_future(session.stop())
+        self._stopping.add(task)
+        task.add_done_callback(self._stopping.discard)
+
+    async def close(self):
+        sessions = [session for idle in self._idle.values() for session in idle]
+        self._idle.clear()
+        await asyncio.gather(
+            *(session.stop() for session in sessions), *self._stopping, return_exceptions=True
+        )
+
+
+class ParallelDownloader:
+    """
+    Скачивает файл частями по нескольким MTProto соединениям одновременно.
+
+    Файл делится на части по part_chunks чанков (чанк Telegram — 1 MiB).
+    Части одновременно скачиваются по разным media-сессиям к DC. С sessions
+    сессии берутся из пула и запросы upload.GetFile идут напрямую; без
+    него каждая часть — отдельный вызов stream_media со своей сессией.
+
+    Наружу чанки отдаются строго по порядку: скачанные наперед части ждут
+    в памяти, но не больше window частей — это ограничивает расход памяти.
+
+    Если задан limiter, запросы всех скачиваний идут через общий
+    адаптивный лимит: слот берется на каждый запрос чанка, так что в
+    задержку не попадает время, пока чанк ждет выгрузку. FloodWait и
+    недокачанные части уменьшают лимит.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        client: Client,
+        connections: int = 4,
+        part_chunks: int = 8,
+        max_part_retries: int = 5,
+        limiter: Optional[AdaptiveLimiter] = None,
+        sessions: Optional[MediaSessions] = None
+    ):
+        self.client = client
+        self.sessions = sessions
+        self.connections = connections
+        self.part_chunks = part_chunks
+        self.max_part_retries = max_part_retries
+        self.limiter = limiter
+        self.window = connections * 2
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self.limiter is None:
+            yield
+            return
+        async with self.limiter.slot():
+            yield
+
+    async def close(self):
+        if self.sessions is not None:
+            await self.sessions.close()
+
+    async def _session_chunks(self, message: Message, offset: int, limit: int) -> AsyncIterator[bytes]:
+        """Чанки через сессию из пула: один запрос upload.GetFile на чанк"""
+        file_id = FileId.decode(video_media(message).file_id)
+        location = raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size,
+        )
+        session = await self.sessions.acquire(file_id.dc_id)
+        healthy = True
+        try:
+            index = offset
+            while not limit or index < offset + limit:
+                async with self._slot():
+                    started = time.monotonic()
+                    # FloodWait не пережидается внутри Pyrogram — о нем узнает лимит
+                    result = await session.invoke(
+                        raw.functions.upload.GetFile(
+                            location=location,
+                            offset=index * self.CHUNK_SIZE,
+                            limit=self.CHUNK_SIZE,
+                        ),
+                        sleep_threshold=0,
+                    )
+                    if self.limiter is not None:
+                        self.limiter.success(time.monotonic() - started)
+                if not isinstance(result, raw.types.upload.File):
+                    raise CdnRedirect()
+                if result.bytes:
+                    yield result.bytes
+                index += 1
+                if len(result.bytes) < self.CHUNK_SIZE:
+                    return
+        except (GeneratorExit, FloodWait, CdnRedirect):
+            raise
+        except BaseException as e:
+            healthy = False
+            self.sessions.discard(session, e)
+            raise
+        finally:
+            if healthy:
+                self.sessions.release(session)
+
+    async def _chunks(self, message: Message, offset: int = 0, limit: int = 0) -> AsyncIterator[bytes]:
+        """Чанки файла (или части), слот лимита — только на время запроса чанка"""
+        if self.sessions is not None:
+            received = 0
+            try:
+                async with aclosing(self._session_chunks(message, offset, limit)) as source:
+                    async for chunk in source:
+                        received += 1
+                        yield chunk
+                return
+            except CdnRedirect:
+                logger.info(f"File is served from a CDN, downloading from chunk {offset + received} via stream_media")
+                offset += received
+                limit = limit - received if limit else 0
+
+        source = self.client.stream_media(message, limit=limit, offset=offset)
+        async with aclosing(source):
+            while True:
+                async with self._slot():
+                    started = time.monotonic()
+                    try:
+                        chunk = await source.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    if self.limiter is not None:
+                        self.limiter.success(time.monotonic() - started)
+                yield chunk
+
+    async def stream(self, message: Message, file_size: int) -> AsyncIterator[bytes]:
+        """Чанки файла по порядку"""
+        total_chunks = math.ceil(file_size / self.CHUNK_SIZE)
+
+        # Небольшой файл быстрее скачать одним запросом
+        if self.connections <= 1 or total_chunks <= self.part_chunks:
+            async with aclosing(self._stream_single(message, file_size)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            return
+
+        parts = [
+            (offset, min(self.part_chunks, total_chunks - offset))
+            for offset in range(0, total_chunks, self.part_chunks)
+        ]
+        loop = asyncio.get_running_loop()
+        results = [loop.create_future() for _ in parts]
+        window = asyncio.Semaphore(self.window)
+        next_part = iter(range(len(parts)))
+
+        async def worker():
+            while True:
+                await window.acquire()
+                index = next(next_part, None)
+                if index is None:
+                    window.release()
+                    return
+
+                offset, count = parts[index]
+                expected = min(count * self.CHUNK_SIZE, file_size - offset * self.CHUNK_SIZE)
+                try:
+                    results[index].set_result(
+                        await self._fetch_part(message, offset, count, expected)
+                    )
+                except Exception as e:
+                    results[index].set_exception(e)
+                    return
+
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(min(self.connections, len(parts)))
+        ]
+        logger.info(
+            f"Downloading {file_size / (1024*1024):.1f} MB in {len(parts)} parts "
+            f"over {len(workers)} connections"
+        )
+
+        try:
+            for result in results:
+                chunks = await result
+                window.release()
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for result in results:
+                # Забираем исключения недочитанных частей, чтобы не было warning
+                if result.done() and not result.cancelled():
+                    result.exception()
+
+    async def _stream_single(self, message: Message, file_size: int) -> AsyncIterator[bytes]:
+        """
+        Файл одним запросом; при обрыве или FloodWait докачивает с последнего чанка
+
+        Уже отданные чанки не повторяются, поэтому поток можно писать
+        сразу в загрузку.
+        """
+        offset = 0
+        received = 0
+        attempt = 0
+        while True:
+            progressed = False
+            try:
+                async with aclosing(self._chunks(message, offset)) as source:
+                    async for chunk in source:
+                        offset += 1
+                        received += len(chunk)
+                        progressed = True
+                        yield chunk
+            except FloodWait as e:
+                logger.warning(f"FloodWait {e.value}s while downloading at chunk {offset}")
+                if self.limiter is not None:
+                    self.limiter.throttle(e.value, reason="FloodWait")
+                await asyncio.sleep(e.value)
+                continue
+            except Exception as e:
+                # Сессия из пула не глотает ошибки, как get_file, — докачиваем
+                logger.warning(f"Download failed at chunk {offset}: {e}")
+            else:
+                if received >= file_size:
+                    return
+
+            # Без прогресса попытки копятся, иначе счет начинается заново
+            attempt = 1 if progressed else attempt + 1
+            if attempt >= self.max_part_retries:
+                raise Exception(
+                    f"Failed to download at chunk {offset} after {self.max_part_retries} attempts"
+                )
+            delay = min(60, 2 ** attempt)
+            if self.limiter is not None:
+                self.limiter.throttle(reason="incomplete download")
+            logger.warning(
+                f"Download stopped at {received} of {file_size} bytes, resuming in {delay}s "
+                f"(attempt {attempt}/{self.max_part_retries})"
+            )
+            await asyncio.sleep(delay)
+
+    async def _fetch_part(
+        self,
+        message: Message,
+        offset: int,
+        count: int,
+        expected: int
+    ) -> List[bytes]:
+        """Скачивает одну часть, повторяя ее при обрыве или FloodWait"""
+        for attempt in range(1, self.max_part_retries + 1):
+            chunks = []
+            try:
+                async with aclosing(self._chunks(message, offset, count)) as source:
+                    async for chunk in source:
+                        chunks.append(chunk)
+            except FloodWait as e:
+                logger.warning(f"FloodWait {e.value}s while downloading part at chunk {offset}")
+                if self.limiter is not None:
+                    self.limiter.throttle(e.value, reason="FloodWait")
+                await asyncio.sleep(e.value)
+                continue
+            except Exception as e:
+                # Сессия из пула не глотает ошибки, как get_file, — повторяем часть
+                logger.warning(f"Request for part at chunk {offset} failed: {e}")
+
+            received = sum(len(chunk) for chunk in chunks)
+            if received == expected:
+                return chunks
+
+            # Pyrogram логирует и глотает ошибки get_file (в том числе долгий
+            # FloodWait), поэтому о сбое можно узнать только по длине части
+            delay = min(60, 2 ** attempt)
+            if self.limiter is not None:
+                self.limiter.throttle(reason="incomplete part")
+            logger.warning(
+                f"Part at chunk {offset} is incomplete ({received} of {expected} bytes), "
+                f"retrying in {delay}s (attempt {attempt}/{self.max_part_retries})"
+            )
+            await asyncio.sleep(delay)
+
+        raise Exception(f"Failed to download part at chunk {offset} after {self.max_part_retries} attempts")
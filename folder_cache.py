@@ -0,0 +1,145 @@
+"""
+Постоянный кэш папок Яндекс Диска: существование и публичные ссылки
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+from shared_file import read_json, shared_state, write_json
+
+logger = logging.getLogger(__name__)
+
+
+class FolderCache:
+    """
+    Кэш состояния папок на Яндекс Диске.
+
+    Для каждой папки хранится, что она существует, и ее публичная ссылка
+    (если папка опубликована). Записи старше ttl секунд считаются
+    устаревшими и проверяются заново. Кэш сохраняется в JSON-файл,
+    поэтому после перезапуска бот не создает и не публикует папки повторно.
+
+    Несколько процессов с общим DATA_DIR создают и публикуют папки под
+    межпроцессной блокировкой (shared_lock) и видят изменения друг друга.
+    Забытая папка (ее удалили с диска) хранится как запись missing, более
+    новая, чем прежняя, — так чужой или старый файл кэша ее не вернет.
+    """
+
+    def __init__(self, path: Optional[Path] = None, ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        # путь папки -> {"public_url": str | None, "checked_at": float, "missing": bool}
+        self._entries = {}
+
+    def load(self):
+        """Читает кэш с диска (устаревшие записи отбрасываются)"""
+        if self.path is None:
+            return
+        try:
+            entries = read_json(self.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Folder cache {self.path} is unreadable, starting empty: {e}")
+            return
+        if entries is None:
+            return
+
+        self._entries = {
+            folder: entry for folder, entry in entries.items()
+            if self._is_fresh(entry)
+        }
+        logger.info(f"Folder cache loaded: {len(self)} folders")
+
+    async def save(self):
+        """Атомарно сохраняет кэш на диск"""
+        if self.path is None:
+            return
+        data = json.dumps(self._entries, ensure_ascii=False, indent=1)
+        try:
+            await asyncio.to_thread(write_json, self.path, data)
+        except OSError as e:
+            logger.error(f"Failed to save folder cache: {e}")
+
+    def _merge(self, entries: dict):
+        """Подхватывает записи, сохраненные другими процессами (более новые)"""
+        for folder, entry in entries.items():
+            current = self._entries.get(folder)
+            if self._is_fresh(entry) and (
+                current is None or entry.get("checked_at", 0) > current.get("checked_at", 0)
+            ):
+                self._entries[folder] = entry
+
+    @asynccontextmanager
+    async def shared_lock(self):
+        """
+        Межпроцессная блокировка для создания и публикации папок
+
+        Пока блокировка взята, другие процессы ждут; после ее получения
+        кэш дополняется записями с диска, так что папку, созданную другим
+        процессом, повторно не создают.
+        """
+        if self.path is None:
+            yield
+            return
+        async with shared_state(self.path, self._merge):
+            yield
+
+    def _is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry.get("checked_at", 0) < self.ttl
+
+    def _fresh_entry(self, folder_path: str) -> Optional[dict]:
+        entry = self._entries.get(folder_path)
+        if entry is None:
+            return None
+        if not self._is_fresh(entry):
+            del self._entries[folder_path]
+            return None
+        return None if entry.get("missing") else entry
+
+    def exists(self, folder_path: str) -> bool:
+        """Известно ли, что папка существует"""
+        return self._fresh_entry(folder_path) is not None
+
+    def public_url(self, folder_path: str) -> Optional[str]:
+        """Публичная ссылка на папку, если она известна"""
+        entry = self._fresh_entry(folder_path)
+        return entry.get("public_url") if entry else None
+
+    def mark_exists(self, folder_path: str, public_url: Optional[str] = None):
+        entry = self._entries.get(folder_path)
+        if entry is None or entry.get("missing"):
+            entry = {"public_url": None}
+        if public_url is not None:
+            entry["public_url"] = public_url
+        entry["checked_at"] = time.time()
+        self._entries[folder_path] = entry
+
+    async def invalidate(self, folder_path: str):
+        """
+        Забывает папку и все вложенные в нее (их удалили с диска)
+
+        Папки сохраняются на диск как missing сразу, под shared_lock:
+        иначе следующий shared_lock подхватил бы их из файла снова.
+        """
+        async with self.shared_lock():
+            now = time.time()
+            prefix = f"{folder_path}/"
+            for folder in [folder_path, *self._entries]:
+                if folder == folder_path or folder.startswith(prefix):
+                    self._entries[folder] = {"public_url": None, "checked_at": now, "missing": True}
+            await self.save()
+
+    def warm(self, folders: Iterable[dict]):
+        """Заполняет кэш по листингу (записи с ключами path и public_url)"""
+        count = 0
+        for folder in folders:
+            self.mark_exists(folder["path"], folder.get("public_url"))
+            count += 1
+        logger.info(f"Folder cache warmed with {count} folders")
+
+    def __len__(self):
+        return sum(1 for entry in self._entries.values() if not entry.get("missing"))
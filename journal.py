@@ -0,0 +1,433 @@
+"""
+Журнал задач бэкапа в SQLite: переживает перезапуск контейнера
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+# Стадии, после которых задача не требует продолжения
+FINISHED_STAGES = ("done", "failed")
+
+
+class JobJournal:
+    """
+    Журнал задач бэкапа.
+
+    Новая задача записывается сразу (чтобы пережить падение), а изменения
+    стадии и прогресса копятся в памяти и сбрасываются одной транзакцией
+    раз в flush_interval секунд. Все обращения к SQLite идут в отдельном
+    потоке, поэтому журнал не тормозит event loop и обработку чанков.
+
+    Журнал же служит общей очередью для нескольких процессов бота: задачу
+    выполняет тот, кто держит ее аренду (owner, lease_until). Аренда
+    продлевается, пока процесс жив; задачи упавшего процесса забирают
+    другие, когда аренда истечет.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 2.0, usage_days: int = 30):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.usage_days = usage_days  # Сколько дней хранить статистику загрузок
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending = {}  # job_id -> {поле: значение}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # timeout — сколько ждать, пока базу держит транзакция другого процесса
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                file_unique_id TEXT,
+                user_id INTEGER,
+                username TEXT,
+                filename TEXT,
+                file_size INTEGER,
+                stage TEXT NOT NULL,
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                remote_path TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (chat_id, message_id)
+            )
+            """
+        )
+        # Очередь задачи (live — новые видео, backfill — история чата)
+        # и аренда: какой процесс выполняет задачу и до какого времени
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "queue" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN queue TEXT NOT NULL DEFAULT 'live'")
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        if "lease_until" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage)")
+        # Контрольные точки бэкфилла истории чата (см. backfill.py)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backfill (
+                chat_id INTEGER PRIMARY KEY,
+                status_message_id INTEGER,
+                next_message_id INTEGER NOT NULL,
+                end_message_id INTEGER NOT NULL,
+                found INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        # Загруженные байты по дням и пользователям (для /stats без вызовов API)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS usage (
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                files INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    async def start(self):
+        """Открывает базу и запускает периодический сброс изменений"""
+        await self._run(self._open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"Job journal opened: {self.path}")
+
+    async def close(self):
+        """Сбрасывает накопленные изменения и закрывает базу"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+        logger.info("Job journal closed")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush job journal: {e}")
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        await self._run(self._write_updates, pending)
+
+    def _write_updates(self, pending: dict):
+        with self._conn:
+            for job_id, fields in pending.items():
+                columns = ", ".join(f"{name} = ?" for name in fields)
+                self._conn.execute(
+                    f"UPDATE jobs SET {columns} WHERE id = ?",
+                    (*fields.values(), job_id)
+                )
+
+    async def add(
+        self,
+        chat_id: int,
+        message_id: int,
+        status_message_id: int,
+        file_unique_id: str,
+        user_id: int,
+        username: str,
+        filename: str,
+        file_size: int,
+        queue: str = "live",
+        owner: Optional[str] = None,
+        lease_ttl: float = 0
+    ) -> Optional[int]:
+        """
+        Записывает новую задачу
+
+        Args:
+            queue: Очередь задачи (live или backfill)
+            owner: Процесс, который сразу берет задачу в работу (None — в общую очередь)
+            lease_ttl: Срок аренды задачи процессом owner
+
+        Returns:
+            id задачи или None, если это сообщение уже есть в журнале
+        """
+        def insert():
+            now = time.time()
+            with self._conn:
+                cursor = self._conn.execute(
+                    """
+                    INSERT OR IGNORE INTO jobs (
+                        chat_id, message_id, status_message_id, file_unique_id,
+                        user_id, username, filename, file_size, stage, queue,
+                        owner, lease_until, created_at, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)
+                    """,
+                    (chat_id, message_id, status_message_id, file_unique_id,
+                     user_id, username, filename, file_size, queue,
+                     owner, now + lease_ttl if owner else None, now, now)
+                )
+                return cursor.lastrowid if cursor.rowcount else None
+
+        return await self._run(insert)
+
+    def update(self, job_id: int, **fields):
+        """Запоминает изменения задачи (попадут в базу при следующем сбросе)"""
+        fields["updated_at"] = time.time()
+        self._pending.setdefault(job_id, {}).update(fields)
+
+    async def find(self, chat_id: int, message_id: int) -> Optional[dict]:
+        """Ищет задачу по сообщению"""
+        def select():
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE chat_id = ? AND message_id = ?",
+                (chat_id, message_id)
+            ).fetchone()
+            return dict(row) if row else None
+
+        return await self._run(select)
+
+    async def unfinished(self) -> List[dict]:
+        """Задачи, прерванные перезапуском (в порядке поступления)"""
+        await self.flush()
+
+        def select():
+            placeholders = ", ".join("?" for _ in FINISHED_STAGES)
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE stage NOT IN ({placeholders}) ORDER BY id",
+                FINISHED_STAGES
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await self._run(select)
+
+    async def claim(
+        self,
+        owner: str,
+        queues: Sequence[str],
+        lease_ttl: float,
+        limit: Optional[int] = None,
+        reclaim: bool = False
+    ) -> List[dict]:
+        """
+        Берет в аренду незавершенные задачи из общей очереди
+
+        Подходят свободные задачи и задачи с истекшей арендой, а с reclaim
+        (при старте процесса) — и задачи, которые owner держал до
+        перезапуска. Видео одного статусного сообщения (альбом) берутся
+        вместе, даже сверх limit.
+
+        Returns:
+            Задачи в порядке поступления
+        """
+        await self.flush()
+
+        def take():
+            now = time.time()
+            finished = ", ".join("?" for _ in FINISHED_STAGES)
+            queue_list = ", ".join("?" for _ in queues)
+            claimable = (
+                f"stage NOT IN ({finished}) AND queue IN ({queue_list}) "
+                f"AND (owner IS NULL OR owner = ? OR lease_until < ?)"
+            )
+            args = (*FINISHED_STAGES, *queues, owner if reclaim else None, now)
+            # BEGIN IMMEDIATE: два процесса не возьмут одну задачу
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    f"SELECT chat_id, status_message_id FROM jobs WHERE {claimable} "
+                    f"ORDER BY owner = ? DESC, id LIMIT ?",
+                    (*args, owner, -1 if limit is None else limit)
+                ).fetchall()
+                groups = {(row["chat_id"], row["status_message_id"]) for row in rows}
+
+                ids = []
+                for chat_id, status_message_id in groups:
+                    ids.extend(
+                        row["id"] for row in self._conn.execute(
+                            f"SELECT id FROM jobs WHERE {claimable} "
+                            f"AND chat_id = ? AND status_message_id IS ?",
+                            (*args, chat_id, status_message_id)
+                        )
+                    )
+                if not ids:
+                    self._conn.commit()
+                    return []
+
+                id_list = ", ".join("?" for _ in ids)
+                self._conn.execute(
+                    f"UPDATE jobs SET owner = ?, lease_until = ? WHERE id IN ({id_list})",
+                    (owner, now + lease_ttl, *ids)
+                )
+                claimed = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE id IN ({id_list}) ORDER BY id", ids
+                ).fetchall()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            return [dict(row) for row in claimed]
+
+        return await self._run(take)
+
+    async def renew(self, owner: str, lease_ttl: float) -> int:
+        """Продлевает аренду всех незавершенных задач процесса (heartbeat)"""
+        def update():
+            placeholders = ", ".join("?" for _ in FINISHED_STAGES)
+            with self._conn:
+                cursor = self._conn.execute(
+                    f"UPDATE jobs SET lease_until = ? "
+                    f"WHERE owner = ? AND stage NOT IN ({placeholders})",
+                    (time.time() + lease_ttl, owner, *FINISHED_STAGES)
+                )
+            return cursor.rowcount
+
+        return await self._run(update)
+
+    async def release(self, owner: str, job_ids: Optional[Sequence[int]] = None):
+        """
+        Возвращает незавершенные задачи процесса в общую очередь
+
+        Args:
+            job_ids: Какие задачи отпустить (None — все задачи owner)
+        """
+        def update():
+            query = "UPDATE jobs SET owner = NULL, lease_until = NULL WHERE owner = ?"
+            args = [owner]
+            if job_ids is not None:
+                query += f" AND id IN ({', '.join('?' for _ in job_ids)})"
+                args.extend(job_ids)
+            with self._conn:
+                self._conn.execute(query, args)
+
+        await self.flush()
+        await self._run(update)
+
+    async def pending_bytes(self) -> int:
+        """Объем незавершенных задач всех процессов"""
+        def select():
+            placeholders = ", ".join("?" for _ in FINISHED_STAGES)
+            row = self._conn.execute(
+                f"SELECT COALESCE(SUM(file_size), 0) FROM jobs WHERE stage NOT IN ({placeholders})",
+                FINISHED_STAGES
+            ).fetchone()
+            return row[0]
+
+        return await self._run(select)
+
+    async def save_backfill(self, chat_id: int, **fields):
+        """Сохраняет контрольную точку бэкфилла чата (сразу, без буферизации)"""
+        fields["updated_at"] = time.time()
+
+        def upsert():
+            columns = ", ".join(fields)
+            placeholders = ", ".join("?" for _ in fields)
+            updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+            with self._conn:
+                self._conn.execute(
+                    f"INSERT INTO backfill (chat_id, {columns}) VALUES (?, {placeholders}) "
+                    f"ON CONFLICT (chat_id) DO UPDATE SET {updates}",
+                    (chat_id, *fields.values())
+                )
+
+        await self._run(upsert)
+
+    async def get_backfill(self, chat_id: int) -> Optional[dict]:
+        """Контрольная точка бэкфилла чата"""
+        def select():
+            row = self._conn.execute(
+                "SELECT * FROM backfill WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            return dict(row) if row else None
+
+        return await self._run(select)
+
+    async def running_backfills(self) -> List[dict]:
+        """Бэкфиллы, прерванные перезапуском"""
+        def select():
+            rows = self._conn.execute(
+                "SELECT * FROM backfill WHERE status = 'running'"
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await self._run(select)
+
+    async def batch_jobs(self, chat_id: int, status_message_id: int) -> List[dict]:
+        """Задачи, отчитывающиеся в одно статусное сообщение (например, бэкфилла)"""
+        await self.flush()
+
+        def select():
+            rows = self._conn.execute(
+                "SELECT id, filename, stage, error FROM jobs "
+                "WHERE chat_id = ? AND status_message_id = ? ORDER BY id",
+                (chat_id, status_message_id)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await self._run(select)
+
+    async def record_upload(self, day: str, user_id: int, username: str, size: int, seconds: float):
+        """Добавляет загруженное видео в статистику дня (старые дни удаляются)"""
+        cutoff = (date.fromisoformat(day) - timedelta(days=self.usage_days)).isoformat()
+
+        def upsert():
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO usage (day, user_id, username, files, bytes, seconds)
+                    VALUES (?, ?, ?, 1, ?, ?)
+                    ON CONFLICT (day, user_id) DO UPDATE SET
+                        username = excluded.username,
+                        files = files + 1,
+                        bytes = bytes + excluded.bytes,
+                        seconds = seconds + excluded.seconds
+                    """,
+                    (day, user_id, username, size, seconds)
+                )
+                self._conn.execute("DELETE FROM usage WHERE day <= ?", (cutoff,))
+
+        await self._run(upsert)
+
+    async def usage(self, since_day: str) -> List[dict]:
+        """Статистика загрузок начиная с дня since_day (YYYY-MM-DD)"""
+        def select():
+            rows = self._conn.execute(
+                "SELECT * FROM usage WHERE day >= ? ORDER BY day, user_id", (since_day,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await self._run(select)
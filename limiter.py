@@ -0,0 +1,176 @@
+"""
+Адаптивные лимиты параллельных запросов (AIMD) к Яндекс Диску и Telegram
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    Лимит параллельных запросов к одному эндпоинту.
+
+    Лимит меняется по схеме AIMD: ответ 429/5xx или FloodWait уменьшает
+    его вдвое (не чаще раза в cooldown секунд — ответы на запросы, ушедшие
+    до уменьшения, не уменьшают его повторно). Пока задержка запросов не
+    выросла больше чем в tolerance раз от лучшей наблюдавшейся, а лимит
+    упирается в запросы, он растет на 1 за каждые limit успешных запросов.
+    Retry-After (или время FloodWait) приостанавливает новые запросы
+    к эндпоинту целиком.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maximum: int,
+        minimum: int = 1,
+        tolerance: float = 2.0,
+        cooldown: float = 1.0
+    ):
+        self.name = name
+        self.maximum = max(maximum, minimum)
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+
+        # Начинаем с потолка: уменьшаться при перегрузке лимит умеет быстро
+        self.limit = float(self.maximum)
+        self.active = 0
+        self.throttled = 0  # Сколько раз эндпоинт ответил перегрузкой
+
+        self._latency: Optional[float] = None  # Скользящее среднее (секунды на единицу работы)
+        self._baseline: Optional[float] = None  # Лучшая задержка (медленно «забывается»)
+        self._saturated = False  # Запросы ждали свободного места с прошлого увеличения
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    @property
+    def paused_for(self) -> float:
+        """Сколько секунд еще действует Retry-After"""
+        return max(self._paused_until - time.monotonic(), 0.0)
+
+    @property
+    def healthy(self) -> bool:
+        """Задержка не выросла (очереди на стороне сервера нет)"""
+        if self._latency is None or self._baseline is None:
+            return True
+        return self._latency <= self._baseline * self.tolerance
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                pause = self.paused_for
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.active < self.current:
+                    break
+                self._saturated = True
+                await self._cond.wait()
+            self.active += 1
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Место для одного запроса на время блока"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def success(self, seconds: float, amount: float = 1.0):
+        """
+        Запрос завершился успешно (вызывается внутри slot())
+
+        Args:
+            seconds: Длительность запроса
+            amount: Объем работы (например, мегабайты) — задержка сравнивается
+                в секундах на единицу, чтобы большие файлы не выглядели медленными
+        """
+        sample = seconds / max(amount, 1e-6)
+        self._latency = sample if self._latency is None else 0.8 * self._latency + 0.2 * sample
+        # Лучшая задержка медленно растет, если сеть стала стабильно медленнее
+        self._baseline = sample if self._baseline is None else min(self._baseline * 1.01, sample)
+
+        if not self._saturated or not self.healthy or self.limit >= self.maximum:
+            return
+        previous = self.current
+        self.limit = min(self.limit + 1 / self.limit, float(self.maximum))
+        if self.current > previous:
+            # Ожидающие проснутся при release() этого же запроса
+            self._saturated = False
+            logger.info(f"Concurrency limit {self.name} raised to {self.current}")
+
+    def throttle(self, retry_after: Optional[float] = None, reason: str = "throttled"):
+        """Эндпоинт перегружен (429, 5xx, FloodWait): лимит уменьшается, Retry-After соблюдается"""
+        self.throttled += 1
+        now = time.monotonic()
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+        if now - self._decreased_at < self.cooldown or self.limit <= self.minimum:
+            return
+        previous = self.current
+        self.limit = max(self.limit / 2, float(self.minimum))
+        self._decreased_at = now
+        self._saturated = False
+        pause = f", paused for {retry_after:g}s" if retry_after else ""
+        logger.warning(
+            f"Concurrency limit {self.name} reduced {previous} -> {self.current} ({reason}{pause})"
+        )
+
+    def describe(self) -> str:
+        text = f"{self.name}: {self.current}/{self.maximum}, в работе {self.active}"
+        if self._latency is not None:
+            text += f", задержка {self._latency:.2f}"
+        if self.paused_for > 0:
+            text += f", пауза {self.paused_for:.0f}s"
+        return text
+
+    def __repr__(self):
+        return f"AdaptiveLimiter({self.name}, {self.current}/{self.maximum})"
+
+
+class AdaptiveLimits:
+    """Лимиты всех эндпоинтов процесса (создаются при первом обращении)"""
+
+    def __init__(self, minimum: int = 1, tolerance: float = 2.0, cooldown: float = 1.0):
+        self.minimum = minimum
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, name: str, maximum: int) -> AdaptiveLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                name, maximum, minimum=self.minimum,
+                tolerance=self.tolerance, cooldown=self.cooldown,
+            )
+            self._limiters[name] = limiter
+            metrics.CONCURRENCY_LIMIT.labels(endpoint=name).set_function(lambda: limiter.current)
+        return limiter
+
+    @property
+    def limiters(self) -> List[AdaptiveLimiter]:
+        return [self._limiters[name] for name in sorted(self._limiters)]
@@ -0,0 +1,47 @@
+"""
+Видео в сообщениях Telegram: обычные видео, видеосообщения (кружки),
+GIF-анимации и видео, отправленные файлом
+"""
+
+import mimetypes
+from typing import Optional
+
+from pyrogram import filters
+
+# Атрибуты сообщения, в которых может быть видео (у сообщения заполнен один)
+VIDEO_KINDS = ("video", "video_note", "animation", "document")
+
+
+def video_kind(message) -> Optional[str]:
+    """Вид видео в сообщении (None — видео нет, например документ не видео)"""
+    for kind in VIDEO_KINDS:
+        media = getattr(message, kind, None)
+        if media is None:
+            continue
+        if kind == "document" and not (media.mime_type or "").startswith("video/"):
+            return None
+        return kind
+    return None
+
+
+def video_media(message):
+    """Видео сообщения: Video, VideoNote, Animation или Document (None — видео нет)"""
+    kind = video_kind(message)
+    return getattr(message, kind) if kind is not None else None
+
+
+def video_filename(message) -> str:
+    """Имя файла видео (у кружков и части документов имени нет — генерируется)"""
+    kind = video_kind(message)
+    media = getattr(message, kind)
+    if getattr(media, "file_name", None):
+        return media.file_name
+    extension = mimetypes.guess_extension(getattr(media, "mime_type", None) or "") or ".mp4"
+    prefix = kind if kind in ("video_note", "animation") else "video"
+    return f"{prefix}_{media.file_unique_id}{extension}"
+
+
+# Фильтр обработчика: любое сообщение с видео
+video_filter = filters.create(
+    lambda _, __, message: video_kind(message) is not None, "VideoFilter"
+)
@@ -0,0 +1,335 @@
+"""
+Метрики бота в текстовом формате Prometheus и HTTP эндпоинт /metrics
+"""
+
+import asyncio
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        """Дочерняя метрика для набора значений меток"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        # Метрика без меток работает как своя единственная дочерняя
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self, key: Tuple[str, ...], child) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for key, child in sorted(self._children.items()):
+            for suffix, extra, value in self._samples(key, child):
+                labels = _format_labels(self.labelnames, key, extra)
+                lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def _samples(self, key, child):
+        yield "_total" if not self.name.endswith("_total") else "", "", child.value
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение вычисляется в момент чтения метрик"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception as e:
+                logger.error(f"Gauge callback failed: {e}")
+                return math.nan
+        return self.value
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+    def _samples(self, key, child):
+        yield "", "", child.get()
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = (0.1, 0.5, 1, 5, 10, 30, 60, 300)
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _samples(self, key, child):
+        cumulative = 0
+        for bound, count in zip(child.buckets, child.counts):
+            cumulative += count
+            yield "_bucket", f'le="{_format_value(bound)}"', cumulative
+        yield "_bucket", 'le="+Inf"', child.count
+        yield "_sum", "", child.sum
+        yield "_count", "", child.count
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Стадии задач: queued, downloading, waiting_upload, uploading, transferring
+# (переходы в планировщике), а также create_folder и publish (вызовы API)
+STAGE_DURATION = Histogram(
+    "backup_stage_duration_seconds",
+    "Duration of a backup stage",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+STAGE_THROUGHPUT = Histogram(
+    "backup_stage_throughput_bytes_per_second",
+    "Average transfer rate of a backup stage",
+    ["stage"],
+    buckets=tuple(2 ** power for power in range(16, 28)),  # 64 KiB/s .. 128 MiB/s
+)
+JOBS = Counter("backup_jobs_total", "Finished backup jobs by result", ["result"])
+
+API_REQUESTS = Counter(
+    "yandex_api_requests_total",
+    "Yandex Disk requests by endpoint, method and HTTP status",
+    ["endpoint", "method", "status"],
+)
+API_ERRORS = Counter(
+    "yandex_api_errors_total",
+    "Failed Yandex Disk requests by endpoint and HTTP status or error type",
+    ["endpoint", "status"],
+)
+
+UPLOAD_VERIFICATIONS = Counter(
+    "backup_upload_verifications_total",
+    "Hash checks of uploaded files by result (ok, mismatch, unverified)",
+    ["result"],
+)
+
+STORAGE_UPLOADS = Counter(
+    "backup_storage_uploads_total",
+    "Stored videos by storage backend, role (primary, mirror) and result (ok, failed)",
+    ["backend", "role", "result"],
+)
+
+TRANSCODE = Counter(
+    "backup_transcode_total",
+    "Processed videos by mode and result (kept, skipped, failed)",
+    ["mode", "result"],
+)
+TRANSCODE_SAVED_BYTES = Counter(
+    "backup_transcode_saved_bytes_total",
+    "Upload bytes saved by video processing",
+)
+
+QUEUE_DEPTH = Gauge("backup_queue_depth", "Jobs waiting to be started")
+ACTIVE_JOBS = Gauge("backup_active_jobs", "Jobs being downloaded or uploaded")
+INFLIGHT_BYTES = Gauge("backup_inflight_bytes", "Bytes of active jobs not yet uploaded")
+TEMP_DIR_BYTES = Gauge("backup_temp_dir_bytes", "Bytes used by temporary files")
+TEMP_RESERVED_BYTES = Gauge("backup_temp_reserved_bytes", "Bytes reserved for temporary files")
+DISK_TOTAL_BYTES = Gauge("yandex_disk_total_bytes", "Yandex Disk quota by account", ["account"])
+DISK_USED_BYTES = Gauge("yandex_disk_used_bytes", "Used Yandex Disk space by account", ["account"])
+DISK_INFLIGHT_BYTES = Gauge(
+    "yandex_disk_inflight_bytes", "Bytes being uploaded to a Yandex Disk account", ["account"]
+)
+CONCURRENCY_LIMIT = Gauge(
+    "backup_concurrency_limit", "Adaptive concurrency limit of an endpoint", ["endpoint"]
+)
+
+LOOP_LAG = Histogram(
+    "backup_event_loop_lag_seconds",
+    "How late the event loop runs a scheduled callback",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+LOOP_STALLS = Counter(
+    "backup_event_loop_stalls_total",
+    "Times the event loop was blocked longer than the stall threshold",
+)
+
+
+def observe_stage(stage: str, duration: float, size: Optional[int] = None):
+    """Записывает длительность стадии и, если передан объем, ее скорость"""
+    STAGE_DURATION.labels(stage=stage).observe(duration)
+    if size and duration > 0:
+        STAGE_THROUGHPUT.labels(stage=stage).observe(size / duration)
+
+
+@contextmanager
+def measure_stage(stage: str, size: Optional[int] = None):
+    """Замеряет длительность блока кода как стадию stage"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.monotonic() - started, size)
+
+
+class MetricsServer:
+    """
+    HTTP сервер с одним эндпоинтом /metrics.
+
+    Перед каждой выдачей вызываются collectors — асинхронные функции,
+    обновляющие метрики, которые дорого считать постоянно (размер
+    временной папки, квота диска).
+    """
+
+    def __init__(
+        self,
+        port: int,
+        host: str = "0.0.0.0",
+        collectors: Sequence[Callable[[], Awaitable[None]]] = ()
+    ):
+        self.port = port
+        self.host = host
+        self.collectors = list(collectors)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        results = await asyncio.gather(
+            *(collector() for collector in self.collectors), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Metrics collector failed: {result}")
+
+        return web.Response(
+            body=render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
@@ -0,0 +1,225 @@
+"""
+Диагностика производительности: задержка event loop, блокировки loop
+со стеком и сэмплирующий профиль живого процесса (команда /perf)
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Файлы, в которых поток ждет работы, а не работает (select event loop,
+# ожидание задачи пулом потоков: thread.py — concurrent.futures)
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+
+# Кадры самого asyncio в сумме по функциям не считаются, а стек callback'а
+# заканчивается на Handle._run — ниже только запуск loop, он есть в каждом сэмпле
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+def _frame_name(filename: str, lineno: int, function: str) -> str:
+    """Короткое имя кадра: две последние части пути, строка и функция"""
+    path = os.path.join(*filename.replace("\\", "/").split("/")[-2:])
+    return f"{path}:{lineno} {function}"
+
+
+def _stack(frame, limit: int) -> List[str]:
+    """Стек потока от внешнего вызова к текущему (последние limit кадров)"""
+    return [
+        _frame_name(entry.filename, entry.lineno, entry.name)
+        for entry in traceback.extract_stack(frame, limit=limit)
+    ]
+
+
+@dataclass
+class Stall:
+    """Блокировка event loop: когда, на сколько и что выполнялось в loop"""
+
+    started: float  # time.time() начала
+    seconds: float
+    stack: List[str]
+
+
+@dataclass
+class Profile:
+    """Результат сэмплирования: самые частые кадры loop и остальных потоков"""
+
+    seconds: float
+    samples: int = 0
+    loop_busy: int = 0  # Сэмплы, в которых loop выполнял код, а не ждал в select
+    loop_frames: Counter = field(default_factory=Counter)  # Текущий кадр loop
+    loop_functions: Counter = field(default_factory=Counter)  # Функции со всего стека loop
+    thread_busy: int = 0
+    thread_frames: Counter = field(default_factory=Counter)
+
+    def top(self, counter: Counter, total: int, count: int) -> List[Tuple[str, float]]:
+        """count самых частых кадров с долей от total сэмплов"""
+        return [(name, hits / total) for name, hits in counter.most_common(count)] if total else []
+
+
+class LoopMonitor:
+    """
+    Следит за задержкой event loop.
+
+    Задача в loop просыпается раз в interval секунд и измеряет, насколько
+    позже запланированного это случилось — это задержка loop. Сторожевой
+    поток проверяет, когда задача просыпалась последний раз: если loop не
+    отвечает дольше stall_threshold, значит какой-то callback выполняется
+    синхронно (файловый I/O, логирование, шифрование) — поток снимает стек
+    loop в этот момент. Когда loop освобождается, длительность блокировки
+    и стек пишутся в лог и в историю для /perf.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        stall_threshold: float = 0.25,
+        history: int = 20,
+        stack_depth: int = 12
+    ):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.stack_depth = stack_depth
+
+        self.lag = 0.0  # Последняя задержка
+        self.average_lag = 0.0  # Скользящее среднее
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self.stalls: Deque[Stall] = deque(maxlen=history)
+
+        self._loop_thread: Optional[int] = None
+        self._beat = 0.0  # Когда задача в loop просыпалась последний раз
+        self._pending_stack: Optional[List[str]] = None  # Стек текущей блокировки
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+        self._profiling = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def profiling(self) -> bool:
+        return self._profiling.locked()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(
+            f"Event loop monitor started (interval {self.interval}s, "
+            f"stall threshold {self.stall_threshold}s)"
+        )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._stopped.set()
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+
+            with self._lock:
+                self._beat = now
+                stack, self._pending_stack = self._pending_stack, None
+
+            self.lag = lag
+            self.average_lag = 0.9 * self.average_lag + 0.1 * lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.LOOP_LAG.observe(lag)
+            if stack is not None:
+                self._record_stall(lag, stack)
+
+    def _record_stall(self, seconds: float, stack: List[str]):
+        self.stall_count += 1
+        self.stalls.append(Stall(time.time() - seconds, seconds, stack))
+        metrics.LOOP_STALLS.inc()
+        logger.warning(
+            f"Event loop was blocked for {seconds:.2f}s, stack when detected:\n  "
+            + "\n  ".join(stack)
+        )
+
+    def _watch(self):
+        """Сторожевой поток: снимает стек loop, если loop долго не отвечает"""
+        limit = self.interval + self.stall_threshold
+        while not self._stopped.wait(self.stall_threshold / 2):
+            with self._lock:
+                if self._pending_stack is not None or time.monotonic() - self._beat < limit:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._pending_stack = _stack(frame, self.stack_depth)
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> Profile:
+        """
+        Сэмплирующий профиль всего процесса за seconds секунд
+
+        Стеки потоков снимаются в отдельном потоке каждые interval секунд,
+        поэтому профиль видит и код, который блокирует loop. Одновременно
+        идет только один профиль.
+        """
+        async with self._profiling:
+            self._loop_thread = threading.get_ident()
+            return await asyncio.to_thread(self._sample, seconds, interval)
+
+    def _sample(self, seconds: float, interval: float) -> Profile:
+        profile = Profile(seconds)
+        skip = {threading.get_ident()}
+        if self._watchdog is not None:
+            skip.add(self._watchdog.ident)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            profile.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in skip:
+                    continue
+                code = frame.f_code
+                if os.path.basename(code.co_filename) in IDLE_FILES:
+                    continue
+                name = _frame_name(code.co_filename, frame.f_lineno, code.co_name)
+                if thread_id == self._loop_thread:
+                    profile.loop_busy += 1
+                    profile.loop_frames[name] += 1
+                    # Функция считается один раз на сэмпл, даже при рекурсии
+                    functions = set()
+                    while frame is not None:
+                        code = frame.f_code
+                        if code.co_filename.startswith(ASYNCIO_DIR) and code.co_name == "_run":
+                            break
+                        if not code.co_filename.startswith(ASYNCIO_DIR):
+                            functions.add(
+                                _frame_name(code.co_filename, code.co_firstlineno, code.co_name)
+                            )
+                        frame = frame.f_back
+                    profile.loop_functions.update(functions)
+                else:
+                    profile.thread_busy += 1
+                    profile.thread_frames[name] += 1
+            time.sleep(interval)
+        return profile
@@ -0,0 +1,132 @@
+"""
+Квота Яндекс Диска: кэшированный снимок и проверка места до загрузки
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import metrics
+from yandex_disk import YandexDiskClient
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaError(Exception):
+    """Видео не поместится на Яндекс Диск"""
+
+
+class QuotaCache:
+    """
+    Снимок квоты Яндекс Диска.
+
+    Квота запрашивается у API не чаще раза в ttl секунд (фоновым
+    обновлением), а между запросами поправляется локально: каждая
+    завершенная загрузка прибавляется к занятому месту. Поэтому /stats,
+    метрики и проверка места перед загрузкой не вызывают API.
+    """
+
+    def __init__(self, client: YandexDiskClient, ttl: float = 300.0, account: str = "1"):
+        self.client = client
+        self.ttl = ttl
+        self.account = account  # Метка account в метриках и логах
+
+        self.total: Optional[int] = None  # None — квота еще не известна
+        self.used = 0
+        self.fetched_at = 0.0  # time.monotonic() последнего запроса к API
+
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def known(self) -> bool:
+        return self.total is not None
+
+    @property
+    def free(self) -> int:
+        return max((self.total or 0) - self.used, 0)
+
+    @property
+    def stale(self) -> bool:
+        return not self.known or time.monotonic() - self.fetched_at >= self.ttl
+
+    def _update_metrics(self):
+        metrics.DISK_TOTAL_BYTES.labels(account=self.account).set(self.total or 0)
+        metrics.DISK_USED_BYTES.labels(account=self.account).set(self.used)
+
+    async def refresh(self):
+        """Запрашивает квоту у API (параллельные вызовы делают один запрос)"""
+        async with self._lock:
+            if not self.stale:
+                return
+            stats = await self.client.get_stats()
+            self.total, self.used = stats["total_space"], stats["used_space"]
+            self.fetched_at = time.monotonic()
+            self._update_metrics()
+            logger.info(
+                f"Yandex Disk quota ({self.account}): {self.used / (1024 ** 3):.2f} of "
+                f"{self.total / (1024 ** 3):.2f} GB used"
+            )
+
+    async def get(self) -> dict:
+        """Снимок квоты (обновляется, если устарел; при ошибке API — последний известный)"""
+        try:
+            await self.refresh()
+        except Exception as e:
+            if not self.known:
+                raise
+            logger.warning(f"Cannot refresh Yandex Disk quota ({self.account}), using cached value: {e}")
+
+        return {
+            "total_space": self.total,
+            "used_space": self.used,
+            "free_space": self.free,
+            "age": time.monotonic() - self.fetched_at,
+        }
+
+    def add_used(self, size: int):
+        """Учитывает загруженный файл до следующего запроса к API"""
+        if self.known:
+            self.used += size
+            self._update_metrics()
+
+    def check(self, size: int, pending: int = 0):
+        """
+        Проверяет, что видео поместится на диск
+
+        Args:
+            size: Размер видео в байтах
+            pending: Байты задач, которые уже в очереди или в работе
+
+        Raises:
+            QuotaError: места не хватит
+        """
+        if not self.known:
+            return  # Квоту еще не получили — не мешаем загрузке
+
+        available = self.free - pending
+        if size > available:
+            raise QuotaError(
+                f"Not enough space on Yandex Disk: need {size / (1024*1024):.0f} MB, "
+                f"{max(available, 0) / (1024*1024):.0f} MB free"
+            )
+
+    def start(self):
+        """Запускает фоновое обновление квоты"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh Yandex Disk quota ({self.account}): {e}")
+            await asyncio.sleep(min(self.ttl, 60) if not self.known else self.ttl)
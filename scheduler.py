@@ -0,0 +1,340 @@
+"""
+Планировщик задач бэкапа: ограниченная очередь и пулы скачивания/выгрузки
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import metrics
+from dedup import ContentHasher
+from media import video_media
+from temp_storage import temp_file_name
+from yandex_disk import YandexDiskClient
+
+logger = logging.getLogger(__name__)
+
+# Стадии, которые передают весь файл (по ним считается скорость)
+TRANSFER_STAGES = ("downloading", "uploading", "transferring")
+
+FINAL_STATES = ("done", "failed", "cancelled")
+
+
+class BackupJob:
+    """Одна задача бэкапа видео"""
+
+    def __init__(
+        self,
+        user_id: int,
+        username: str,
+        message,
+        status_msg,
+        filename: str,
+        file_size: int,
+        stream: bool = False,
+        job_id: Optional[int] = None,
+        in_memory: bool = False
+    ):
+        self.job_id = job_id  # id в журнале задач
+        self.user_id = user_id
+        self.username = username
+        self.message = message
+        self.status_msg = status_msg
+        self.filename = filename
+        self.file_size = file_size
+        self.stream = stream
+        self.in_memory = in_memory  # Небольшое видео: скачивается в память, а не во временный файл
+
+        self.folder_name: Optional[str] = None
+        self.temp_path: Optional[Path] = None
+        self.data: Optional[bytes] = None  # Содержимое видео, скачанного в память
+        self.thumbnail_path: Optional[Path] = None  # Превью, если видео обрабатывалось
+        self.reservation = None  # Место под временный файл (TempStorage)
+        self.public_url: Optional[str] = None
+        self.account = None  # YandexAccount, на который выгружается видео
+        self.state = "queued"
+        self.state_since = time.monotonic()
+        self.timings = []  # (стадия, секунды) по мере прохождения стадий
+
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+        self.batch = None  # AlbumBatch, если видео пришло в составе альбома
+
+        self.hasher: Optional[ContentHasher] = None  # Хеши, посчитанные при скачивании
+        self.duplicate: Optional[dict] = None  # Запись индекса, если видео уже на диске
+
+    @property
+    def chat_id(self) -> int:
+        return self.message.chat.id
+
+    @property
+    def message_id(self) -> int:
+        return self.message.id
+
+    @property
+    def file_unique_id(self) -> str:
+        return video_media(self.message).file_unique_id
+
+    @property
+    def remote_path(self) -> str:
+        return f"{YandexDiskClient.ROOT_FOLDER}/{self.folder_name}/{self.filename}"
+
+    @property
+    def source(self):
+        """Что выгружать: видео в памяти или временный файл"""
+        return self.data if self.data is not None else self.temp_path
+
+    @property
+    def temp_name(self) -> str:
+        return temp_file_name(self.chat_id, self.message_id, self.filename)
+
+    @property
+    def transfer_seconds(self) -> float:
+        """Время скачивания и выгрузки (без ожидания в очередях)"""
+        seconds = sum(duration for stage, duration in self.timings if stage in TRANSFER_STAGES)
+        if self.state in TRANSFER_STAGES:
+            seconds += time.monotonic() - self.state_since
+        return seconds
+
+    @property
+    def file_size_mb(self) -> float:
+        return self.file_size / (1024 * 1024)
+
+    @property
+    def timeline(self) -> str:
+        """Стадии задачи с длительностями: queued 0.1s → downloading 2.3s → ..."""
+        stages = [f"{stage} {seconds:.1f}s" for stage, seconds in self.timings]
+        if self.state in FINAL_STATES:
+            stages.append(self.state)
+        else:
+            stages.append(f"{self.state} {time.monotonic() - self.state_since:.1f}s…")
+        return " → ".join(stages)
+
+    def __repr__(self):
+        return f"BackupJob({self.filename}, user={self.user_id}, state={self.state})"
+
+
+JobStage = Callable[[BackupJob], Awaitable[None]]
+JobErrorHandler = Callable[[BackupJob, Exception], Awaitable[None]]
+JobStateHandler = Callable[[BackupJob], None]
+
+
+class JobScheduler:
+    """
+    Выполняет задачи бэкапа с ограниченной параллельностью.
+
+    Очередь общая и ограничена max_queued задачами: submit() ждет свободного
+    места (backpressure). Задачи выбираются по кругу между пользователями,
+    чтобы один человек с пачкой видео не занимал все слоты.
+
+    Скачанная (и обработанная, если задан process) задача держит слот
+    скачивания, пока не получит слот выгрузки —
+    так на временном диске никогда не лежит больше
+    download_workers + upload_workers файлов. Потоковая задача (job.stream)
+    скачивает и выгружает одновременно и занимает оба слота сразу.
+    """
+
+    def __init__(
+        self,
+        download: JobStage,
+        upload: JobStage,
+        transfer: JobStage,
+        on_error: JobErrorHandler,
+        on_state: Optional[JobStateHandler] = None,
+        process: Optional[JobStage] = None,
+        download_workers: int = 2,
+        upload_workers: int = 2,
+        max_queued: int = 50,
+        recent: int = 10
+    ):
+        self._download = download
+        self._upload = upload
+        self._transfer = transfer
+        self._on_error = on_error
+        self._on_state = on_state
+        self._process = process
+
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.max_queued = max_queued
+
+        self._download_slots = asyncio.Semaphore(download_workers)
+        self._upload_slots = asyncio.Semaphore(upload_workers)
+
+        # user_id -> очередь задач пользователя; порядок ключей = порядок обхода
+        self._queues: "OrderedDict[int, deque]" = OrderedDict()
+        self._queued = 0
+        self._cond = asyncio.Condition()
+
+        self._active = {}  # task -> BackupJob
+        self.recent = deque(maxlen=recent)  # Последние завершенные задачи (для /perf)
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def queued(self) -> int:
+        """Количество задач, ожидающих начала обработки"""
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        """Количество задач в работе"""
+        return len(self._active)
+
+    @property
+    def active_jobs(self):
+        """Задачи в работе"""
+        return list(self._active.values())
+
+    @property
+    def inflight_bytes(self) -> int:
+        """Сколько байт задач в работе еще не выгружено"""
+        return sum(
+            max(job.file_size - job.bytes_uploaded, 0)
+            for job in self._active.values()
+        )
+
+    @property
+    def pending_bytes(self) -> int:
+        """Сколько байт задач в очереди и в работе еще не выгружено"""
+        queued = sum(job.file_size for jobs in self._queues.values() for job in jobs)
+        return queued + self.inflight_bytes
+
+    def start(self):
+        """Запускает диспетчер"""
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            logger.info(
+                f"Job scheduler started: {self.download_workers} download, "
+                f"{self.upload_workers} upload workers, queue {self.max_queued}"
+            )
+
+    async def stop(self):
+        """Останавливает диспетчер и прерывает задачи в работе"""
+        tasks = list(self._active)
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+            self._dispatcher = None
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("Job scheduler stopped")
+
+    async def submit(self, job: BackupJob) -> int:
+        """
+        Ставит задачу в очередь (ждет, если очередь заполнена)
+
+        Returns:
+            Позиция задачи в очереди (1 — следующая на обработку)
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._queued < self.max_queued)
+
+            self._queues.setdefault(job.user_id, deque()).append(job)
+            self._queued += 1
+            self._cond.notify_all()
+
+            return self.position(job)
+
+    def position(self, job: BackupJob) -> int:
+        """Позиция задачи в порядке кругового обхода пользователей (0 — не в очереди)"""
+        user_queue = self._queues.get(job.user_id)
+        if not user_queue or job not in user_queue:
+            return 0
+
+        index = user_queue.index(job)
+        position = 0
+        before = True  # Пользователь раньше владельца задачи в порядке обхода
+        for user_id, jobs in self._queues.items():
+            # Полные круги до задачи + пользователи раньше в текущем круге
+            position += min(len(jobs), index)
+            if user_id == job.user_id:
+                before = False
+            elif before and len(jobs) > index:
+                position += 1
+
+        return position + 1
+
+    def _pop_next(self) -> BackupJob:
+        user_id, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+
+        # Пользователь уходит в конец круга
+        del self._queues[user_id]
+        if jobs:
+            self._queues[user_id] = jobs
+
+        self._queued -= 1
+        return job
+
+    async def _dispatch(self):
+        while True:
+            await self._download_slots.acquire()
+
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._queued > 0)
+                job = self._pop_next()
+                self._cond.notify_all()
+
+            task = asyncio.create_task(self._run(job))
+            self._active[task] = job
+            task.add_done_callback(lambda done: self._active.pop(done, None))
+
+    def _set_state(self, job: BackupJob, state: str):
+        now = time.monotonic()
+        duration = now - job.state_since
+        job.timings.append((job.state, duration))
+
+        # Скорость имеет смысл только для стадий, которые передают весь файл
+        moved = job.file_size if job.state in TRANSFER_STAGES else None
+        metrics.observe_stage(job.state, duration, moved)
+        if state in FINAL_STATES:
+            result = "duplicate" if state == "done" and job.duplicate else state
+            metrics.JOBS.labels(result=result).inc()
+
+        job.state = state
+        job.state_since = now
+        if state in FINAL_STATES:
+            self.recent.append(job)
+        if self._on_state is not None:
+            self._on_state(job)
+
+    async def _run(self, job: BackupJob):
+        download_slot = True
+        try:
+            if job.stream:
+                async with self._upload_slots:
+                    self._set_state(job, "transferring")
+                    await self._transfer(job)
+            else:
+                self._set_state(job, "downloading")
+                await self._download(job)
+
+                # Обработка держит слот скачивания: файлов на диске не прибавляется
+                if self._process is not None:
+                    self._set_state(job, "processing")
+                    await self._process(job)
+
+                self._set_state(job, "waiting_upload")
+                async with self._upload_slots:
+                    self._download_slots.release()
+                    download_slot = False
+
+                    self._set_state(job, "uploading")
+                    await self._upload(job)
+
+            self._set_state(job, "done")
+
+        except asyncio.CancelledError:
+            self._set_state(job, "cancelled")
+            raise
+        except Exception as e:
+            self._set_state(job, "failed")
+            await self._on_error(job, e)
+        finally:
+            if download_slot:
+                self._download_slots.release()
@@ -0,0 +1,93 @@
+"""
+JSON-файлы состояния, общие для нескольких процессов бота (общий DATA_DIR)
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+
+def read_json(path: Path) -> Optional[dict]:
+    """
+    Читает JSON-файл (None, если файла нет)
+
+    Raises:
+        OSError, ValueError: файл не читается или испорчен
+    """
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_json(path: Path, data: str):
+    """Атомарно записывает файл: через временный файл и os.replace"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(data, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _lock(lock_path: Path) -> int:
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _unlock(fd: int):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _unlock_when_acquired(acquiring: asyncio.Future):
+    if not acquiring.cancelled() and acquiring.exception() is None:
+        _unlock(acquiring.result())
+
+
+@asynccontextmanager
+async def file_lock(path: Path):
+    """
+    Межпроцессная блокировка файла (flock на path.lock)
+
+    Блокировку ждет поток из пула. Если ожидающего отменили, поток все
+    равно дождется блокировки — тогда она сразу отпускается, а не остается
+    занятой до конца жизни процесса.
+    """
+    acquiring = asyncio.ensure_future(
+        asyncio.to_thread(_lock, path.with_name(path.name + ".lock"))
+    )
+    try:
+        fd = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(_unlock_when_acquired)
+        raise
+    try:
+        yield
+    finally:
+        _unlock(fd)
+
+
+@asynccontextmanager
+async def shared_state(path: Path, merge: Callable[[dict], None]):
+    """
+    file_lock, после получения которой в память подхватывается файл
+
+    merge получает содержимое файла, сохраненное другими процессами
+    (нечитаемый файл пропускается — его перезапишет следующее сохранение).
+    """
+    async with file_lock(path):
+        try:
+            data = await asyncio.to_thread(read_json, path)
+        except (OSError, ValueError):
+            data = None
+        if data is not None:
+            merge(data)
+        yield
@@ -0,0 +1,163 @@
+"""
+Единая очередь редактирования статусных сообщений с ограничением частоты
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from pyrogram.errors import FloodWait, MessageNotModified
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingEdit:
+    def __init__(self, message: Message, text: str):
+        self.message = message
+        self.text = text
+        self.final = False  # После доставки сообщение больше не отслеживается
+        self.waiters = []  # Futures тех, кто ждет доставки
+
+
+class StatusUpdater:
+    """
+    Сервис обновления статусных сообщений.
+
+    Все правки проходят через одну очередь: не чаще одной правки в чат
+    за chat_interval секунд и не больше global_rate правок в секунду на бота.
+    Промежуточные состояния схлопываются — если за время ожидания текст
+    сменился несколько раз, отправляется только последний. FloodWait от
+    Telegram приостанавливает правки в этом чате на указанное время,
+    вместо того чтобы блокировать весь клиент.
+    """
+
+    def __init__(self, chat_interval: float = 3.0, global_rate: float = 20.0):
+        self.chat_interval = chat_interval
+        self.global_interval = 1.0 / global_rate
+
+        self._pending: Dict[Tuple[int, int], _PendingEdit] = {}
+        self._last_text: Dict[Tuple[int, int], str] = {}
+        self._chat_ready_at: Dict[int, float] = {}
+        self._global_ready_at = 0.0
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает сервис (неотправленные промежуточные статусы теряются)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        for edit in self._pending.values():
+            for waiter in edit.waiters:
+                if not waiter.done():
+                    waiter.cancel()
+        self._pending.clear()
+
+    @staticmethod
+    def _key(message: Message) -> Tuple[int, int]:
+        return message.chat.id, message.id
+
+    def set(self, message: Message, text: str, final: bool = False) -> Optional[_PendingEdit]:
+        """
+        Запоминает новый текст статуса (отправится, когда позволит лимит)
+
+        Итоговый статус (final=True) не теряется, но и не блокирует вызывающего.
+        """
+        key = self._key(message)
+        if key not in self._pending and self._last_text.get(key) == text:
+            return None
+
+        edit = self._pending.get(key)
+        if edit is None:
+            edit = self._pending[key] = _PendingEdit(message, text)
+        elif edit.final and not final:
+            # Запоздавший прогресс не должен затереть итоговый статус
+            return edit
+        else:
+            edit.text = text
+        edit.final = edit.final or final
+
+        self._wakeup.set()
+        return edit
+
+    async def send(self, message: Message, text: str):
+        """Ставит статус в очередь и ждет, пока он (или более новый) будет отправлен"""
+        edit = self.set(message, text)
+        if edit is None:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        edit.waiters.append(waiter)
+        await waiter
+
+    def _next_ready(self) -> Tuple[Optional[Tuple[int, int]], float]:
+        """Ближайшая правка, которую можно отправить, и сколько до нее ждать"""
+        now = time.monotonic()
+        best_key, best_wait = None, None
+
+        for key in self._pending:
+            wait = max(self._chat_ready_at.get(key[0], 0.0), self._global_ready_at) - now
+            if best_wait is None or wait < best_wait:
+                best_key, best_wait = key, wait
+                if wait <= 0:
+                    break
+
+        return best_key, max(best_wait or 0.0, 0.0)
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            key, wait = self._next_ready()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            edit = self._pending.pop(key)
+            await self._deliver(key, edit)
+
+    async def _deliver(self, key: Tuple[int, int], edit: _PendingEdit):
+        chat_id = key[0]
+        now = time.monotonic()
+        self._global_ready_at = now + self.global_interval
+        self._chat_ready_at[chat_id] = now + self.chat_interval
+
+        try:
+            await edit.message.edit_text(edit.text)
+            self._last_text[key] = edit.text
+        except MessageNotModified:
+            self._last_text[key] = edit.text
+        except FloodWait as e:
+            logger.warning(f"FloodWait {e.value}s on status edits in chat {chat_id}")
+            self._chat_ready_at[chat_id] = time.monotonic() + e.value
+
+            # Возвращаем правку в очередь, если ее еще не заменили новой
+            pending = self._pending.setdefault(key, edit)
+            if pending is not edit:
+                pending.waiters.extend(edit.waiters)
+                pending.final = pending.final or edit.final
+            return
+        except Exception as e:
+            logger.error(f"Failed to update status message: {e}")
+
+        if edit.final:
+            self._last_text.pop(key, None)
+
+        for waiter in edit.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
@@ -0,0 +1,156 @@
+"""
+Хранилища для видео: общий интерфейс и локальная папка
+
+Реализации интерфейса: YandexDiskClient (REST API Яндекс Диска),
+YandexWebDAVClient (WebDAV Яндекс Диска) и LocalStorage (локальная
+папка — например, смонтированный NAS или S3 через rclone/s3fs).
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import AsyncIterable, Awaitable, Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+# Что выгружается: временный файл, небольшое видео в памяти или поток чанков
+Source = Union[Path, bytes, AsyncIterable[bytes]]
+
+
+class StorageBackend:
+    """Хранилище, в которое выгружаются видео по папкам дат"""
+
+    name = ""
+
+    THUMBNAILS_FOLDER = "thumbnails"
+
+    async def start(self):
+        """Открывает соединения (если нужны)"""
+
+    async def close(self):
+        """Закрывает соединения"""
+
+    async def upload_video(
+        self,
+        source: Source,
+        folder_name: str,
+        filename: str,
+        size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        hasher=None
+    ) -> str:
+        """
+        Сохраняет видео в папку даты
+
+        Args:
+            source: Локальный файл, данные в памяти или поток чанков
+            folder_name: Папка даты (YYYY-MM-DD)
+            filename: Имя файла
+            size: Размер в байтах (для потока)
+            progress: Callback (отправлено байт, всего байт)
+            hasher: ContentHasher отправленного содержимого (для сверки, если хранилище умеет)
+
+        Returns:
+            Ссылка на папку даты
+        """
+        raise NotImplementedError
+
+    async def upload_thumbnail(self, local_path: Path, folder_name: str, filename: str) -> str:
+        """Сохраняет превью в подпапку thumbnails папки даты"""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """
+    Локальная папка: root/<папка даты>/<файл>.
+
+    Файл пишется под временным именем и переименовывается после записи,
+    поэтому недописанное видео не выглядит сохраненным. Вместо публичной
+    ссылки возвращается public_url/<папка даты> или путь к папке.
+    """
+
+    name = "local"
+
+    def __init__(self, root: Path, public_url: str = ""):
+        self.root = root
+        self.public_url = public_url.rstrip("/")
+
+    def folder_link(self, folder_name: str) -> str:
+        """Ссылка на папку даты (или путь к ней)"""
+        if self.public_url:
+            return f"{self.public_url}/{folder_name}"
+        return str(self.root / folder_name)
+
+    @staticmethod
+    def _part_path(target: Path) -> Path:
+        return target.with_name(f".{target.name}.part")
+
+    async def _write_stream(
+        self,
+        stream: AsyncIterable[bytes],
+        part: Path,
+        size: Optional[int],
+        progress: Optional[ProgressCallback]
+    ) -> int:
+        f = await asyncio.to_thread(open, part, "wb")
+        written = 0
+        try:
+            async for chunk in stream:
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+                if progress is not None:
+                    await progress(written, size or written)
+        finally:
+            await asyncio.to_thread(f.close)
+        return written
+
+    async def _store(
+        self,
+        source: Source,
+        target: Path,
+        size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None
+    ):
+        await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+        part = self._part_path(target)
+        try:
+            if isinstance(source, Path):
+                size = (await asyncio.to_thread(source.stat)).st_size
+                await asyncio.to_thread(shutil.copyfile, source, part)
+                if progress is not None:
+                    await progress(size, size)
+            elif isinstance(source, bytes):
+                await asyncio.to_thread(part.write_bytes, source)
+                if progress is not None:
+                    await progress(len(source), len(source))
+            else:
+                written = await self._write_stream(source, part, size, progress)
+                if size is not None and written != size:
+                    raise Exception(f"Stream ended after {written} of {size} bytes")
+            await asyncio.to_thread(os.replace, part, target)
+        except BaseException:
+            await asyncio.to_thread(part.unlink, missing_ok=True)
+            raise
+
+    async def upload_video(
+        self,
+        source: Source,
+        folder_name: str,
+        filename: str,
+        size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        hasher=None
+    ) -> str:
+        target = self.root / folder_name / filename
+        await self._store(source, target, size, progress)
+        logger.info(f"Video stored locally: {target}")
+        return self.folder_link(folder_name)
+
+    async def upload_thumbnail(self, local_path: Path, folder_name: str, filename: str) -> str:
+        target = self.root / folder_name / self.THUMBNAILS_FOLDER / filename
+        await self._store(local_path, target)
+        return str(target)
@@ -0,0 +1,203 @@
+"""
+Потоковая передача видео из Telegram на Яндекс Диск без временного файла
+"""
+
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from temp_storage import Reservation, TempStorage, TempStorageError
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBuffer:
+    """
+    Ограниченный буфер между скачиванием из Telegram и PUT на Яндекс Диск.
+
+    Пока выгрузка успевает за скачиванием, чанки проходят только через память
+    (не больше memory_limit байт). Если выгрузка не забирает данные дольше
+    stall_timeout секунд, остаток потока пишется в spill-файл на диске
+    и дочитывается оттуда — скачивание при этом не останавливается.
+    Запись и чтение spill-файла идут в пуле потоков, а не в event loop,
+    и без блокировки буфера: медленный диск не задерживает другую сторону.
+    Писатель и читатель у буфера по одному.
+
+    С temp_storage место под остаток потока (size - уже записанное)
+    резервируется до создания spill-файла. Если места сейчас нет, буфер
+    продолжает ждать выгрузку в памяти и пробует снова через stall_timeout.
+    Если остаток не поместится никогда (TempStorageError), поток прерывается.
+    """
+
+    def __init__(
+        self,
+        memory_limit: int,
+        spill_path: Path,
+        stall_timeout: float,
+        read_size: int = 1024 * 1024,
+        temp_storage: Optional[TempStorage] = None,
+        size: Optional[int] = None
+    ):
+        self.memory_limit = memory_limit
+        self.spill_path = spill_path
+        self.stall_timeout = stall_timeout
+        self.read_size = read_size
+        self.temp_storage = temp_storage
+        self.size = size
+
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+        self._chunks = deque()
+        self._buffered = 0
+        self._cond = asyncio.Condition()
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+        self._spill_writer = None
+        self._spill_reader = None
+        self._spill_reservation: Optional[Reservation] = None
+        self._spill_written = 0
+        self._spill_read = 0
+
+    @property
+    def spilled(self) -> bool:
+        """Перешел ли буфер в режим записи на диск"""
+        return self._spill_writer is not None
+
+    def _has_room(self, size: int) -> bool:
+        # Один чанк пропускаем всегда, иначе чанк больше лимита не пройдет никогда
+        return self._buffered == 0 or self._buffered + size <= self.memory_limit
+
+    async def write(self, chunk: bytes):
+        """Добавляет чанк в буфер (вызывается со стороны скачивания)"""
+        if self._closed:
+            raise Exception("Stream buffer is already closed")
+
+        while not self.spilled:
+            async with self._cond:
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._has_room(len(chunk))),
+                        self.stall_timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    self._chunks.append(chunk)
+                    self._buffered += len(chunk)
+                    self.bytes_written += len(chunk)
+                    self._cond.notify_all()
+                    return
+
+            # Выгрузка стоит: spill-файл создается уже без блокировки буфера
+            try:
+                await self._start_spill()
+            except TempStorageError as e:
+                await self.abort(e)
+                raise
+
+        await asyncio.to_thread(self._spill, chunk)
+        async with self._cond:
+            self._spill_written += len(chunk)
+            self.bytes_written += len(chunk)
+            self._cond.notify_all()
+
+    async def _start_spill(self):
+        """
+        Переводит буфер на диск (если место под остаток нашлось)
+
+        Raises:
+            TempStorageError: остаток потока не поместится никогда
+        """
+        if self.temp_storage is not None:
+            remaining = max((self.size or 0) - self.bytes_written, 0)
+            reservation = await self.temp_storage.try_reserve(self.spill_path.name, remaining)
+            if reservation is None:
+                logger.warning(
+                    f"Upload stalled for {self.stall_timeout}s, "
+                    f"no temp space to spill {remaining / (1024*1024):.1f} MB yet"
+                )
+                return
+            self._spill_reservation = reservation
+            self.spill_path = reservation.path
+
+        logger.warning(
+            f"Upload stalled for {self.stall_timeout}s, "
+            f"spilling stream to {self.spill_path}"
+        )
+        self._spill_writer = await asyncio.to_thread(open, self.spill_path, "wb")
+        self._spill_reader = await asyncio.to_thread(open, self.spill_path, "rb")
+
+    def _spill(self, chunk: bytes):
+        self._spill_writer.write(chunk)
+        self._spill_writer.flush()
+
+    async def read(self) -> bytes:
+        """Возвращает следующий чанк (b"" — конец потока)"""
+        async with self._cond:
+            while True:
+                if self._error is not None:
+                    raise self._error
+
+                if self._chunks:
+                    chunk = self._chunks.popleft()
+                    self._buffered -= len(chunk)
+                    self.bytes_read += len(chunk)
+                    self._cond.notify_all()
+                    return chunk
+                if self._spill_read < self._spill_written:
+                    size = min(self.read_size, self._spill_written - self._spill_read)
+                    break
+                if self._closed:
+                    return b""
+                await self._cond.wait()
+
+        # Записанное в spill-файл читается без блокировки: запись идет дальше
+        chunk = await asyncio.to_thread(self._spill_reader.read, size)
+        async with self._cond:
+            self._spill_read += len(chunk)
+            self.bytes_read += len(chunk)
+        return chunk
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self.read()
+            if not chunk:
+                return
+            yield chunk
+
+    async def close(self):
+        """Помечает конец потока (все данные записаны)"""
+        async with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    async def abort(self, error: BaseException):
+        """Прерывает поток: читатель получит исключение"""
+        async with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+    def _remove_spill(self) -> bool:
+        for f in (self._spill_writer, self._spill_reader):
+            if f is not None:
+                f.close()
+        if not self.spill_path.exists():
+            return False
+        self.spill_path.unlink()
+        return True
+
+    async def cleanup(self):
+        """Закрывает и удаляет spill-файл"""
+        spilled = self.spilled
+        self._chunks.clear()
+        self._buffered = 0
+        if spilled and await asyncio.to_thread(self._remove_spill):
+            logger.info(f"Spill file deleted: {self.spill_path}")
+        self._spill_writer = self._spill_reader = None
+        if self.temp_storage is not None:
+            await self.temp_storage.release(self._spill_reservation)
+        self._spill_reservation = None
@@ -0,0 +1,257 @@
+"""
+Временное хранилище видео с учетом места на диске
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TempStorageError(Exception):
+    """Видео не помещается во временное хранилище"""
+
+
+def temp_file_name(chat_id: int, message_id: int, filename: str) -> str:
+    """
+    Имя временного файла задачи
+
+    Исходное имя видео не уникально (часто это просто video.mp4), поэтому
+    к нему добавляется сообщение — имя не меняется между перезапусками.
+    """
+    return f"{chat_id}_{message_id}_{filename}"
+
+
+class Reservation:
+    """Место, зарезервированное под один временный файл"""
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+        self.allocated = False  # Место уже занято на диске через fallocate
+        self.released = False
+
+
+class TempStorage:
+    """
+    Менеджер временной папки.
+
+    Перед скачиванием задача резервирует место под весь файл. Резерв не
+    выдается, если сумма резервов превысит budget байт или на диске
+    останется меньше min_free байт — тогда задача ждет, пока другие
+    задачи освободят место. Если файл не поместится даже в пустое
+    хранилище (с учетом места, которое держит сама задача), резерв сразу
+    отклоняется с TempStorageError.
+
+    Свободное место на диске узнается в пуле потоков и кэшируется на
+    free_ttl секунд: statvfs на SD карте может надолго остановить event loop.
+
+    Файл по возможности предвыделяется целиком (posix_fallocate), так что
+    место на SD карте занимается в момент резерва, а не по мере скачивания.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        budget: int = 0,
+        min_free: int = 0,
+        orphan_age: float = 3600,
+        poll_interval: float = 5.0,
+        free_ttl: float = 1.0
+    ):
+        self.directory = directory
+        self.budget = budget  # 0 — без ограничения
+        self.min_free = min_free
+        self.orphan_age = orphan_age
+        self.poll_interval = poll_interval
+        self.free_ttl = free_ttl
+
+        self._free: Optional[int] = None
+        self._free_at = 0.0
+        self._reservations: Set[Reservation] = set()
+        self._cond = asyncio.Condition()
+
+    @property
+    def reserved(self) -> int:
+        """Сколько байт сейчас зарезервировано"""
+        return sum(r.size for r in self._reservations)
+
+    def _disk_free(self) -> int:
+        return shutil.disk_usage(self.directory).free
+
+    def _free_space(self) -> int:
+        # До первого refresh (например, в тестах) узнаем место синхронно
+        if self._free is None:
+            self._free = self._disk_free()
+            self._free_at = time.monotonic()
+        return self._free
+
+    async def refresh(self, force: bool = False):
+        """Обновляет закэшированное свободное место (в пуле потоков)"""
+        if not force and self._free is not None and time.monotonic() - self._free_at < self.free_ttl:
+            return
+        self._free = await asyncio.to_thread(self._disk_free)
+        self._free_at = time.monotonic()
+
+    def _unallocated(self) -> int:
+        # Зарезервировано, но еще не занято на диске
+        return sum(r.size for r in self._reservations if not r.allocated)
+
+    def check(self, size: int, held: int = 0):
+        """
+        Проверяет, что файл в принципе поместится (даже когда все задачи закончатся)
+
+        Args:
+            size: Размер файла в байтах
+            held: Сколько байт уже зарезервировала сама задача — это место
+                не освободится, пока она ждет
+
+        Raises:
+            TempStorageError: файл больше бюджета или свободного места
+        """
+        if self.budget and size + held > self.budget:
+            raise TempStorageError(
+                f"Video ({size / (1024*1024):.0f} MB"
+                + (f" + {held / (1024*1024):.0f} MB held" if held else "")
+                + f") exceeds the temp storage budget ({self.budget / (1024*1024):.0f} MB)"
+            )
+
+        # Место, занятое нашими же файлами, освободится, когда задачи закончатся
+        available = self._free_space() + self.reserved - held - self.min_free
+        if size > available:
+            raise TempStorageError(
+                f"Not enough disk space for a temp file: need {size / (1024*1024):.0f} MB, "
+                f"at most {max(available, 0) / (1024*1024):.0f} MB available"
+            )
+
+    def _fits(self, size: int) -> bool:
+        if self.budget and self.reserved + size > self.budget:
+            return False
+        return self._free_space() - self._unallocated() - size >= self.min_free
+
+    def unique_path(self, name: str) -> Path:
+        """Путь для временного файла, не занятый другим резервом"""
+        taken = {r.path for r in self._reservations}
+        path = self.directory / name
+        stem, suffix = path.stem, path.suffix
+        index = 1
+        while path in taken:
+            path = self.directory / f"{stem} ({index}){suffix}"
+            index += 1
+        return path
+
+    async def reserve(
+        self, name: str, size: int, on_disk: bool = False, held: int = 0
+    ) -> Reservation:
+        """
+        Резервирует место под файл (ждет, пока место освободится)
+
+        Args:
+            name: Желаемое имя файла (при занятом имени добавляется номер)
+            size: Размер файла в байтах
+            on_disk: Файл уже целиком лежит на диске (например, после перезапуска)
+            held: Сколько байт задача уже зарезервировала и держит, пока ждет
+
+        Raises:
+            TempStorageError: файл не поместится никогда
+        """
+        async with self._cond:
+            if on_disk:
+                reservation = Reservation(self.directory / name, size)
+                reservation.allocated = True
+                self._reservations.add(reservation)
+                return reservation
+
+            await self.refresh()
+            self.check(size, held)
+            if not self._fits(size):
+                logger.info(
+                    f"Waiting for temp space: need {size / (1024*1024):.1f} MB, "
+                    f"reserved {self.reserved / (1024*1024):.1f} MB"
+                )
+            while not self._fits(size):
+                # Свободное место меняется и без нас — перепроверяем периодически
+                released = True
+                try:
+                    await asyncio.wait_for(self._cond.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    released = False
+                # Другая задача освободила резерв — ее файл уже удален
+                await self.refresh(force=released)
+                self.check(size, held)
+
+            reservation = Reservation(self.unique_path(name), size)
+            self._reservations.add(reservation)
+            return reservation
+
+    async def try_reserve(self, name: str, size: int, held: int = 0) -> Optional[Reservation]:
+        """
+        Резервирует место, только если оно есть прямо сейчас (None — места нет)
+
+        Raises:
+            TempStorageError: файл не поместится никогда
+        """
+        async with self._cond:
+            await self.refresh()
+            self.check(size, held)
+            if not self._fits(size):
+                return None
+            reservation = Reservation(self.unique_path(name), size)
+            self._reservations.add(reservation)
+            return reservation
+
+    @staticmethod
+    def _fallocate(path: Path, size: int) -> bool:
+        with open(path, "wb") as f:
+            if size <= 0 or not hasattr(os, "posix_fallocate"):
+                return False
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return True
+            except OSError as e:
+                # Файловая система может не поддерживать fallocate (например, tmpfs в старых ядрах)
+                logger.debug(f"posix_fallocate is not available for {path}: {e}")
+                return False
+
+    async def allocate(self, reservation: Reservation, path: Optional[Path] = None):
+        """Создает файл (по умолчанию — путь резерва) и предвыделяет под него место"""
+        path = path or reservation.path
+        reservation.allocated = await asyncio.to_thread(self._fallocate, path, reservation.size)
+
+    async def release(self, reservation: Optional[Reservation]):
+        """Освобождает резерв (файл удаляет вызывающий код)"""
+        if reservation is None or reservation.released:
+            return
+        reservation.released = True
+        async with self._cond:
+            self._reservations.discard(reservation)
+            self._cond.notify_all()
+
+    def _sweep(self, keep: Set[str]) -> int:
+        removed = 0
+        deadline = time.time() - self.orphan_age
+        for entry in self.directory.iterdir():
+            try:
+                if not entry.is_file() or entry.name in keep:
+                    continue
+                if entry.stat().st_mtime < deadline:
+                    entry.unlink()
+                    removed += 1
+                    logger.info(f"Removed orphaned temp file {entry.name}")
+            except OSError as e:
+                logger.warning(f"Cannot remove orphaned temp file {entry}: {e}")
+        return removed
+
+    async def sweep_orphans(self, keep: Iterable[str] = ()) -> int:
+        """Удаляет файлы старше orphan_age секунд, кроме перечисленных в keep"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        removed = await asyncio.to_thread(self._sweep, set(keep))
+        await self.refresh(force=True)
+        if removed:
+            logger.info(f"Temp storage sweep removed {removed} orphaned files")
+        return removed
@@ -0,0 +1,34 @@
+"""
+Тесты индекса дубликатов: заполнение по листингу Яндекс Диска
+"""
+
+import asyncio
+import time
+
+from dedup import DedupIndex
+
+
+def _file(path: str) -> dict:
+    return {"path": path, "size": 1024, "md5": "md5", "sha256": "sha256"}
+
+
+def test_seed_keeps_files_added_during_listing(tmp_path):
+    async def main():
+        index = DedupIndex(tmp_path / "dedup.db")
+        await index.start()
+        try:
+            await index.seed([_file("backup/a.mp4"), _file("backup/b.mp4")], "main", root="/backup")
+
+            listed_at = time.time()
+            # Выгружено, пока шел листинг: в files его нет, но файл на диске
+            await index.add("backup/c.mp4", 1024, file_unique_id="c", account="main")
+            await index.seed([_file("backup/a.mp4")], "main", root="/backup", listed_at=listed_at)
+
+            assert await index.find_by_file_id("c") is not None
+            assert await index.find_by_hash("sha256", "md5", 1024) is not None
+            rows = index._conn.execute("SELECT remote_path FROM videos ORDER BY remote_path").fetchall()
+            assert [row["remote_path"] for row in rows] == ["backup/a.mp4", "backup/c.mp4"]
+        finally:
+            await index.close()
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""
+Тесты скачивания одним запросом: докачка после обрыва и FloodWait
+"""
+
+import asyncio
+
+import pytest
+from pyrogram.errors import FloodWait
+
+import downloader
+from downloader import ParallelDownloader
+from limiter import AdaptiveLimiter
+
+CHUNK = ParallelDownloader.CHUNK_SIZE
+
+
+class FakeClient:
+    """stream_media, который отдает чанки с номером и падает в заданных местах"""
+
+    def __init__(self, total_chunks: int, failures: dict, broken: bool = False):
+        self.total_chunks = total_chunks
+        self.failures = failures  # номер чанка -> исключение (срабатывает один раз)
+        self.broken = broken
+        self.offsets = []
+
+    async def stream_media(self, message, limit: int = 0, offset: int = 0):
+        self.offsets.append(offset)
+        if self.broken:
+            raise ConnectionError("down")
+        for index in range(offset, self.total_chunks):
+            error = self.failures.pop(index, None)
+            if error is not None:
+                raise error
+            yield bytes([index]) * CHUNK
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Паузы записываются, но не ждутся"""
+    recorded = []
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args, **kwargs):
+        recorded.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(downloader.asyncio, "sleep", fake_sleep)
+    return recorded
+
+
+def _download(client, total_chunks: int, **kwargs) -> list:
+    async def main():
+        loader = ParallelDownloader(client, connections=1, **kwargs)
+        return [chunk async for chunk in loader.stream(None, total_chunks * CHUNK)]
+
+    return asyncio.run(main())
+
+
+def test_resumes_after_error_without_repeating_chunks(sleeps):
+    client = FakeClient(4, {2: ConnectionError("reset")})
+
+    chunks = _download(client, 4)
+
+    assert [chunk[0] for chunk in chunks] == [0, 1, 2, 3]
+    assert client.offsets == [0, 2]
+    assert sleeps == [2]
+
+
+def test_waits_out_flood_wait_and_resumes(sleeps):
+    client = FakeClient(3, {1: FloodWait(value=7)})
+
+    chunks = _download(client, 3)
+
+    assert [chunk[0] for chunk in chunks] == [0, 1, 2]
+    assert client.offsets == [0, 1]
+    assert sleeps == [7]
+
+
+def test_gives_up_without_progress(sleeps):
+    client = FakeClient(2, {}, broken=True)
+
+    with pytest.raises(Exception, match="after 3 attempts"):
+        _download(client, 2, max_part_retries=3)
+    assert client.offsets == [0, 0, 0]
+
+
+def test_flood_wait_throttles_the_limiter(sleeps):
+    client = FakeClient(3, {1: FloodWait(value=0)})
+    limiter = AdaptiveLimiter("telegram", maximum=4, cooldown=0)
+
+    chunks = _download(client, 3, limiter=limiter)
+
+    assert len(chunks) == 3
+    assert limiter.current == 2
+    assert limiter.throttled == 1
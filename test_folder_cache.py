@@ -0,0 +1,41 @@
+"""
+Тесты кэша папок, общего для нескольких процессов
+"""
+
+import asyncio
+
+from folder_cache import FolderCache
+
+
+def test_invalidated_folder_is_not_merged_back(tmp_path):
+    """Папку удалили с диска — старый файл кэша не возвращает ее как существующую"""
+    path = tmp_path / "folders.json"
+
+    async def main():
+        other = FolderCache(path)
+        async with other.shared_lock():
+            other.mark_exists("/backup")
+            other.mark_exists("/backup/2024-01-01", "https://yadi.sk/d/1")
+            await other.save()
+
+        cache = FolderCache(path)
+        cache.load()
+        assert cache.exists("/backup/2024-01-01")
+
+        await cache.invalidate("/backup")
+        async with cache.shared_lock():
+            assert not cache.exists("/backup")
+            assert cache.public_url("/backup/2024-01-01") is None
+        assert len(cache) == 0
+
+        # Другой процесс со старыми записями тоже видит, что папок нет
+        async with other.shared_lock():
+            assert not other.exists("/backup/2024-01-01")
+
+        async with cache.shared_lock():
+            cache.mark_exists("/backup")
+            await cache.save()
+        assert cache.exists("/backup")
+        assert len(cache) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+Тесты аренды задач в журнале: два процесса с общей базой
+"""
+
+import asyncio
+import time
+
+from journal import JobJournal
+
+
+async def _add_job(journal: JobJournal, message_id: int, **kwargs) -> int:
+    return await journal.add(
+        chat_id=-100, message_id=message_id, status_message_id=message_id + 1000,
+        file_unique_id=f"file{message_id}", user_id=1, username="user",
+        filename=f"video{message_id}.mp4", file_size=1024, **kwargs
+    )
+
+
+def _run_pair(tmp_path, scenario):
+    """Запускает сценарий с двумя журналами (двумя соединениями) к одной базе"""
+    async def main():
+        first = JobJournal(tmp_path / "jobs.db")
+        second = JobJournal(tmp_path / "jobs.db")
+        await first.start()
+        await second.start()
+        try:
+            await scenario(first, second)
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(main())
+
+
+def test_claim_is_exclusive_between_connections(tmp_path):
+    async def scenario(first, second):
+        job_id = await _add_job(first, 1)
+
+        claimed = await first.claim("worker-a", ["live"], lease_ttl=60)
+        assert [job["id"] for job in claimed] == [job_id]
+        assert claimed[0]["owner"] == "worker-a"
+
+        # Пока аренда действует, второй процесс задачу не получит
+        assert await second.claim("worker-b", ["live"], lease_ttl=60) == []
+
+    _run_pair(tmp_path, scenario)
+
+
+def test_claim_respects_queue_and_limit(tmp_path):
+    async def scenario(first, second):
+        await _add_job(first, 1)
+        await _add_job(first, 2)
+        backfill_id = await _add_job(first, 3, queue="backfill")
+
+        claimed = await first.claim("worker-a", ["live"], lease_ttl=60, limit=1)
+        assert [job["message_id"] for job in claimed] == [1]
+
+        claimed = await second.claim("worker-b", ["backfill"], lease_ttl=60)
+        assert [job["id"] for job in claimed] == [backfill_id]
+
+    _run_pair(tmp_path, scenario)
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    async def scenario(first, second):
+        job_id = await _add_job(first, 1)
+        await first.claim("worker-a", ["live"], lease_ttl=0.05)
+
+        await asyncio.sleep(0.1)
+        claimed = await second.claim("worker-b", ["live"], lease_ttl=60)
+        assert [job["id"] for job in claimed] == [job_id]
+        assert claimed[0]["owner"] == "worker-b"
+
+        # Прежний владелец аренду уже не продлит
+        assert await first.renew("worker-a", 60) == 0
+
+    _run_pair(tmp_path, scenario)
+
+
+def test_renew_keeps_the_lease(tmp_path):
+    async def scenario(first, second):
+        await _add_job(first, 1)
+        await first.claim("worker-a", ["live"], lease_ttl=0.05)
+
+        assert await first.renew("worker-a", 60) == 1
+        await asyncio.sleep(0.1)
+        assert await second.claim("worker-b", ["live"], lease_ttl=60) == []
+
+        job = await second.find(-100, 1)
+        assert job["lease_until"] > time.time() + 30
+
+    _run_pair(tmp_path, scenario)
+
+
+def test_renew_skips_finished_jobs(tmp_path):
+    async def scenario(first, second):
+        job_id = await _add_job(first, 1)
+        await first.claim("worker-a", ["live"], lease_ttl=60)
+
+        first.update(job_id, stage="done")
+        await first.flush()
+        assert await first.renew("worker-a", 60) == 0
+
+    _run_pair(tmp_path, scenario)
+
+
+def test_release_returns_jobs_to_the_shared_queue(tmp_path):
+    async def scenario(first, second):
+        kept_id = await _add_job(first, 1)
+        released_id = await _add_job(first, 2, owner="worker-a", lease_ttl=60)
+        await first.claim("worker-a", ["live"], lease_ttl=60)
+
+        await first.release("worker-a", [released_id])
+        claimed = await second.claim("worker-b", ["live"], lease_ttl=60)
+        assert [job["id"] for job in claimed] == [released_id]
+
+        await first.release("worker-a")
+        claimed = await second.claim("worker-b", ["live"], lease_ttl=60)
+        assert [job["id"] for job in claimed] == [kept_id]
+
+    _run_pair(tmp_path, scenario)
+
+
+def test_reclaim_takes_back_own_jobs_after_restart(tmp_path):
+    async def scenario(first, second):
+        job_id = await _add_job(first, 1, owner="worker-a", lease_ttl=60)
+
+        # Без reclaim свои же задачи с живой арендой не выдаются
+        assert await second.claim("worker-a", ["live"], lease_ttl=60) == []
+        claimed = await second.claim("worker-a", ["live"], lease_ttl=60, reclaim=True)
+        assert [job["id"] for job in claimed] == [job_id]
+
+    _run_pair(tmp_path, scenario)
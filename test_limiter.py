@@ -0,0 +1,102 @@
+"""
+Тесты адаптивного лимита параллельных запросов (AIMD)
+"""
+
+import asyncio
+
+import pytest
+
+from limiter import AdaptiveLimiter
+
+
+async def _saturate(limiter: AdaptiveLimiter):
+    """Все места заняты и запрос ждет — только тогда лимит растет"""
+    for _ in range(limiter.current):
+        await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    for _ in range(limiter.current):
+        await limiter.release()
+
+
+def test_starts_at_maximum():
+    limiter = AdaptiveLimiter("test", maximum=8)
+    assert limiter.current == 8
+
+
+def test_throttle_halves_down_to_minimum():
+    limiter = AdaptiveLimiter("test", maximum=8, minimum=2, cooldown=0)
+
+    limiter.throttle(reason="429")
+    assert limiter.current == 4
+    limiter.throttle(reason="503")
+    assert limiter.current == 2
+    limiter.throttle(reason="503")
+    assert limiter.current == 2
+    assert limiter.throttled == 3
+
+
+def test_throttle_once_per_cooldown():
+    limiter = AdaptiveLimiter("test", maximum=8, cooldown=60)
+
+    # Ответы на запросы, ушедшие до уменьшения, лимит повторно не режут
+    limiter.throttle(reason="429")
+    limiter.throttle(reason="429")
+    assert limiter.current == 4
+
+
+def test_flood_wait_pauses_requests():
+    limiter = AdaptiveLimiter("telegram", maximum=4, cooldown=0)
+
+    limiter.throttle(30, reason="FloodWait")
+    assert limiter.current == 2
+    assert 29 < limiter.paused_for <= 30
+
+    async def main():
+        await asyncio.wait_for(limiter.acquire(), 0.05)
+
+    # Новые запросы ждут конца FloodWait
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+
+
+def test_grows_back_to_maximum_when_saturated():
+    async def main():
+        limiter = AdaptiveLimiter("test", maximum=4, cooldown=0)
+        limiter.throttle(reason="429")
+        limiter.throttle(reason="429")
+        assert limiter.current == 1
+
+        for _ in range(50):
+            await _saturate(limiter)
+            limiter.success(0.1)
+            assert limiter.current <= limiter.maximum
+        assert limiter.current == 4
+
+    asyncio.run(main())
+
+
+def test_does_not_grow_without_waiting_requests():
+    limiter = AdaptiveLimiter("test", maximum=4, cooldown=0)
+    limiter.throttle(reason="429")
+
+    for _ in range(50):
+        limiter.success(0.1)
+    assert limiter.current == 2
+
+
+def test_does_not_grow_while_latency_is_high():
+    async def main():
+        limiter = AdaptiveLimiter("test", maximum=4, tolerance=2.0, cooldown=0)
+        limiter.success(0.1)
+        limiter.throttle(reason="429")
+
+        for _ in range(20):
+            await _saturate(limiter)
+            limiter.success(1.0)
+        assert not limiter.healthy
+        assert limiter.current == 2
+
+    asyncio.run(main())
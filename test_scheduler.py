@@ -0,0 +1,176 @@
+"""
+Тесты планировщика задач: стадии, ошибки и продолжение после перезапуска
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from journal import JobJournal
+from scheduler import BackupJob, JobScheduler
+
+
+def _job(message_id: int, user_id: int = 1, job_id=None, stream: bool = False) -> BackupJob:
+    message = SimpleNamespace(id=message_id, chat=SimpleNamespace(id=-100))
+    return BackupJob(
+        user_id, "user", message, None, f"video{message_id}.mp4", 1024,
+        stream=stream, job_id=job_id,
+    )
+
+
+class Stages:
+    """Стадии задачи, которые записывают, что с задачей происходило"""
+
+    def __init__(self, block_download: bool = False):
+        self.block_download = block_download
+        self.calls = []
+        self.errors = []
+        self.finished = asyncio.Event()
+
+    async def download(self, job):
+        self.calls.append(("download", job.message_id))
+        if self.block_download:
+            await asyncio.Event().wait()
+
+    async def upload(self, job):
+        self.calls.append(("upload", job.message_id))
+        self.finished.set()
+
+    async def transfer(self, job):
+        self.calls.append(("transfer", job.message_id))
+        self.finished.set()
+
+    async def on_error(self, job, error):
+        self.errors.append((job.message_id, error))
+        self.finished.set()
+
+    def scheduler(self, on_state=None, **kwargs) -> JobScheduler:
+        return JobScheduler(
+            download=self.download, upload=self.upload, transfer=self.transfer,
+            on_error=self.on_error, on_state=on_state, **kwargs
+        )
+
+
+def test_job_goes_through_download_and_upload():
+    async def main():
+        stages = Stages()
+        scheduler = stages.scheduler()
+        scheduler.start()
+        job = _job(1)
+        await scheduler.submit(job)
+        await asyncio.wait_for(stages.finished.wait(), 1)
+        await asyncio.sleep(0)
+        await scheduler.stop()
+
+        assert stages.calls == [("download", 1), ("upload", 1)]
+        assert job.state == "done"
+        assert [stage for stage, _ in job.timings] == [
+            "queued", "downloading", "waiting_upload", "uploading"
+        ]
+
+    asyncio.run(main())
+
+
+def test_stream_job_uses_transfer():
+    async def main():
+        stages = Stages()
+        scheduler = stages.scheduler()
+        scheduler.start()
+        await scheduler.submit(_job(1, stream=True))
+        await asyncio.wait_for(stages.finished.wait(), 1)
+        await scheduler.stop()
+
+        assert stages.calls == [("transfer", 1)]
+
+    asyncio.run(main())
+
+
+def test_failed_stage_reports_error():
+    async def main():
+        stages = Stages()
+
+        async def broken_upload(job):
+            raise RuntimeError("upload failed")
+
+        stages.upload = broken_upload
+        scheduler = stages.scheduler()
+        scheduler.start()
+        job = _job(1)
+        await scheduler.submit(job)
+        await asyncio.wait_for(stages.finished.wait(), 1)
+        await scheduler.stop()
+
+        assert job.state == "failed"
+        assert [str(error) for _, error in stages.errors] == ["upload failed"]
+
+    asyncio.run(main())
+
+
+def test_users_are_served_round_robin():
+    async def main():
+        stages = Stages()
+        scheduler = stages.scheduler(download_workers=1, upload_workers=1)
+        jobs = [_job(1, user_id=1), _job(2, user_id=1), _job(3, user_id=2)]
+        for job in jobs:
+            await scheduler.submit(job)
+
+        assert [scheduler.position(job) for job in jobs] == [1, 3, 2]
+
+    asyncio.run(main())
+
+
+def test_cancelled_job_resumes_after_restart(tmp_path):
+    """Задача, прерванная остановкой, остается в журнале и выполняется после перезапуска"""
+    path = tmp_path / "jobs.db"
+
+    async def before_restart():
+        journal = JobJournal(path)
+        await journal.start()
+        job_id = await journal.add(
+            chat_id=-100, message_id=1, status_message_id=2, file_unique_id="file1",
+            user_id=1, username="user", filename="video1.mp4", file_size=1024,
+            owner="worker-a", lease_ttl=60,
+        )
+
+        stages = Stages(block_download=True)
+        # Как в боте: смена стадии попадает в журнал
+        scheduler = stages.scheduler(
+            on_state=lambda job: journal.update(job.job_id, stage=job.state)
+        )
+        scheduler.start()
+        job = _job(1, job_id=job_id)
+        await scheduler.submit(job)
+        while job.state != "downloading":
+            await asyncio.sleep(0.01)
+
+        await scheduler.stop()
+        await journal.close()
+        assert job.state == "cancelled"
+        return job_id
+
+    async def after_restart(job_id):
+        journal = JobJournal(path)
+        await journal.start()
+        try:
+            unfinished = await journal.unfinished()
+            assert [(row["id"], row["stage"]) for row in unfinished] == [(job_id, "cancelled")]
+
+            claimed = await journal.claim("worker-a", ["live"], lease_ttl=60, reclaim=True)
+            assert [row["id"] for row in claimed] == [job_id]
+
+            stages = Stages()
+            scheduler = stages.scheduler(
+                on_state=lambda job: journal.update(job.job_id, stage=job.state)
+            )
+            scheduler.start()
+            await scheduler.submit(_job(claimed[0]["message_id"], job_id=job_id))
+            await asyncio.wait_for(stages.finished.wait(), 1)
+            await asyncio.sleep(0)
+            await scheduler.stop()
+
+            assert stages.calls == [("download", 1), ("upload", 1)]
+            assert await journal.unfinished() == []
+        finally:
+            await journal.close()
+
+    job_id = asyncio.run(before_restart())
+    asyncio.run(after_restart(job_id))
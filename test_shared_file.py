@@ -0,0 +1,76 @@
+"""
+Тесты межпроцессной блокировки общих JSON-файлов
+"""
+
+import asyncio
+import fcntl
+import os
+
+import pytest
+
+from shared_file import file_lock, shared_state, write_json
+
+
+def _locked_elsewhere(path) -> bool:
+    """Занята ли блокировка (проверка через отдельный дескриптор)"""
+    fd = os.open(path.with_name(path.name + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def test_shared_state_merges_file_contents(tmp_path):
+    path = tmp_path / "state.json"
+    write_json(path, '{"a": 1}')
+    merged = []
+
+    async def main():
+        async with shared_state(path, merged.append):
+            assert _locked_elsewhere(path)
+        assert not _locked_elsewhere(path)
+
+    asyncio.run(main())
+    assert merged == [{"a": 1}]
+
+
+def test_cancelled_waiter_releases_the_lock(tmp_path):
+    """Ожидающего отменили — блокировка, полученная потоком позже, отпускается"""
+    path = tmp_path / "state.json"
+
+    async def main():
+        holder = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with file_lock(path):
+                holder.set()
+                await release.wait()
+
+        async def wait():
+            async with file_lock(path):
+                pass
+
+        holding = asyncio.ensure_future(hold())
+        await holder.wait()
+        waiting = asyncio.ensure_future(wait())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        release.set()
+        await holding
+        # Поток отмененного ожидающего получает блокировку и сразу ее отдает
+        for _ in range(100):
+            if not _locked_elsewhere(path):
+                break
+            await asyncio.sleep(0.01)
+        assert not _locked_elsewhere(path)
+
+        await asyncio.wait_for(wait(), 1)
+
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""
+Тесты буфера потоковой передачи: переход на диск и отказ без места
+"""
+
+import asyncio
+
+import pytest
+
+from streaming import StreamBuffer
+from temp_storage import TempStorage, TempStorageError
+
+
+def test_stalled_stream_spills_and_keeps_order(tmp_path):
+    async def main():
+        buffer = StreamBuffer(
+            memory_limit=4, spill_path=tmp_path / "a.spill", stall_timeout=0.05, read_size=3
+        )
+        chunks = [bytes([i]) * 4 for i in range(5)]
+        # Читатель не забирает данные — после stall_timeout буфер уходит на диск
+        for chunk in chunks:
+            await asyncio.wait_for(buffer.write(chunk), 1)
+        await buffer.close()
+        assert buffer.spilled
+
+        data = b"".join([chunk async for chunk in buffer])
+        assert data == b"".join(chunks)
+        assert buffer.bytes_read == buffer.bytes_written == 20
+
+        await buffer.cleanup()
+        assert not (tmp_path / "a.spill").exists()
+
+    asyncio.run(main())
+
+
+def test_stream_fails_when_spill_never_fits(tmp_path):
+    storage = TempStorage(tmp_path, budget=10, poll_interval=0.05)
+
+    async def main():
+        buffer = StreamBuffer(
+            memory_limit=4, spill_path=tmp_path / "a.spill", stall_timeout=0.05,
+            temp_storage=storage, size=100,
+        )
+        await buffer.write(b"x" * 4)
+        with pytest.raises(TempStorageError):
+            await asyncio.wait_for(buffer.write(b"y" * 4), 1)
+
+        # Читатель получает ту же ошибку, а не ждет вечно
+        with pytest.raises(TempStorageError):
+            await asyncio.wait_for(buffer.read(), 1)
+        assert storage.reserved == 0
+        await buffer.cleanup()
+
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+Тесты резервирования места во временной папке
+"""
+
+import asyncio
+
+import pytest
+
+from temp_storage import TempStorage, TempStorageError
+
+
+def _storage(tmp_path, **kwargs) -> TempStorage:
+    return TempStorage(tmp_path, poll_interval=0.05, **kwargs)
+
+
+def test_reserve_and_release_accounting(tmp_path):
+    storage = _storage(tmp_path, budget=1000)
+
+    async def main():
+        first = await storage.reserve("a.mp4", 300)
+        second = await storage.reserve("b.mp4", 200)
+        assert storage.reserved == 500
+
+        await storage.release(first)
+        assert storage.reserved == 200
+        # Повторное освобождение ничего не меняет
+        await storage.release(first)
+        await storage.release(None)
+        assert storage.reserved == 200
+
+        await storage.release(second)
+        assert storage.reserved == 0
+
+    asyncio.run(main())
+
+
+def test_same_name_gets_a_unique_path(tmp_path):
+    storage = _storage(tmp_path)
+
+    async def main():
+        first = await storage.reserve("video.mp4", 10)
+        second = await storage.reserve("video.mp4", 10)
+        assert first.path == tmp_path / "video.mp4"
+        assert second.path == tmp_path / "video (1).mp4"
+
+    asyncio.run(main())
+
+
+def test_reserve_waits_for_release(tmp_path):
+    storage = _storage(tmp_path, budget=1000)
+
+    async def main():
+        first = await storage.reserve("a.mp4", 600)
+        waiting = asyncio.ensure_future(storage.reserve("b.mp4", 600))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+
+        await storage.release(first)
+        second = await asyncio.wait_for(waiting, 1)
+        assert storage.reserved == second.size == 600
+
+    asyncio.run(main())
+
+
+def test_file_larger_than_budget_is_rejected(tmp_path):
+    storage = _storage(tmp_path, budget=1000)
+
+    async def main():
+        with pytest.raises(TempStorageError):
+            await storage.reserve("huge.mp4", 1001)
+        assert storage.reserved == 0
+
+    asyncio.run(main())
+
+
+def test_second_reservation_of_the_same_job_fails_fast(tmp_path):
+    """Обработка держит резерв исходника — вдвое больший файл не дождется места"""
+    storage = _storage(tmp_path, budget=1000)
+
+    async def main():
+        original = await storage.reserve("a.mp4", 600)
+        with pytest.raises(TempStorageError):
+            await asyncio.wait_for(
+                storage.reserve("a.mp4.processed.mp4", 600, held=original.size), 1
+            )
+        assert storage.reserved == 600
+
+        # Поместится рядом с исходником — резерв выдается сразу
+        processed = await asyncio.wait_for(
+            storage.reserve("a.mp4.processed.mp4", 400, held=original.size), 1
+        )
+        assert storage.reserved == 1000
+        await storage.release(processed)
+        await storage.release(original)
+
+    asyncio.run(main())
+
+
+def test_min_free_counts_against_the_disk(tmp_path):
+    storage = _storage(tmp_path)
+
+    async def main():
+        await storage.refresh(force=True)
+        storage.min_free = storage._free_space()
+        with pytest.raises(TempStorageError):
+            await storage.reserve("a.mp4", 1)
+
+    asyncio.run(main())
+
+
+def test_try_reserve_does_not_wait(tmp_path):
+    storage = _storage(tmp_path, budget=1000)
+
+    async def main():
+        first = await storage.reserve("a.mp4", 600)
+        assert await storage.try_reserve("a.spill", 600) is None
+        await storage.release(first)
+        spill = await storage.try_reserve("a.spill", 600)
+        assert spill is not None and storage.reserved == 600
+
+    asyncio.run(main())
+
+
+def test_on_disk_reservation_is_always_granted(tmp_path):
+    storage = _storage(tmp_path, budget=1000)
+
+    async def main():
+        await storage.reserve("a.mp4", 900)
+        reused = await asyncio.wait_for(storage.reserve("b.mp4", 900, on_disk=True), 1)
+        assert reused.allocated
+        assert storage.reserved == 1800
+
+    asyncio.run(main())
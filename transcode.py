@@ -0,0 +1,233 @@
+"""
+Обработка видео перед выгрузкой: faststart-ремукс, пережатие и превью
+
+ffmpeg запускается из пула процессов: весь блокирующий сценарий
+(проверка файла, кодирование, сравнение размеров, превью) выполняется
+в рабочем процессе, а event loop бота только ждет результат.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def cpu_limit() -> int:
+    """Сколько ядер доступно процессу (с учетом лимита CPU контейнера)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2: "<квота> <период>" или "max <период>"
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return max(1, cpus)
+
+
+def is_faststart(path: Path) -> bool:
+    """
+    Лежит ли индекс MP4/MOV (атом moov) перед данными (mdat)
+
+    Такой файл начинает воспроизводиться до полной загрузки — ремукс
+    ему не нужен. Читаются только заголовки атомов верхнего уровня.
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, kind = struct.unpack(">I4s", header)
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                f.seek(size - 16, os.SEEK_CUR)
+            elif size == 0:
+                return False  # Атом до конца файла
+            else:
+                f.seek(size - 8, os.SEEK_CUR)
+
+
+def _ffmpeg(args: list, timeout: float):
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    if result.returncode != 0:
+        error = result.stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {error[-1] if error else ''}")
+
+
+def process_file(
+    source: str,
+    target: str,
+    mode: str,
+    min_saving: float = 0.1,
+    crf: int = 26,
+    max_height: int = 0,
+    threads: int = 1,
+    thumbnail: Optional[str] = None,
+    timeout: float = 3600
+) -> dict:
+    """
+    Обрабатывает видео в рабочем процессе пула
+
+    Режимы: remux — перенос индекса (moov) в начало файла без
+    перекодирования, compress — пережатие в H.264.
+
+    Returns:
+        kept — записан ли обработанный файл в target, size — его размер,
+        reason — почему оставлен исходный файл, thumbnail — путь к превью
+    """
+    source_size = os.path.getsize(source)
+    result = {"kept": False, "size": source_size, "reason": None, "thumbnail": None}
+
+    if thumbnail:
+        try:
+            # Кадр с первой секунды, уменьшенный до 320 px по ширине
+            _ffmpeg(
+                ["-ss", "1", "-i", source, "-frames:v", "1", "-vf", "scale=320:-2", thumbnail],
+                timeout=min(timeout, 120),
+            )
+            result["thumbnail"] = thumbnail
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            result["thumbnail_error"] = str(e)
+
+    if mode == "remux":
+        try:
+            if is_faststart(Path(source)):
+                result["reason"] = "already faststart"
+                return result
+        except (OSError, struct.error):
+            pass  # Не MP4 — ремукс все равно даст MP4
+        args = ["-i", source, "-map", "0", "-c", "copy"]
+    else:
+        video_filter = f"scale=-2:'min(ih,{max_height})'" if max_height else "null"
+        args = [
+            "-i", source, "-map", "0:v:0", "-map", "0:a?",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf),
+            "-vf", video_filter, "-c:a", "aac", "-b:a", "128k",
+        ]
+    args += ["-threads", str(threads), "-movflags", "+faststart", "-f", "mp4", target]
+
+    try:
+        _ffmpeg(args, timeout)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        Path(target).unlink(missing_ok=True)
+        result["reason"] = f"ffmpeg failed: {e}"
+        return result
+
+    size = os.path.getsize(target)
+    # Ремукс нужен ради faststart, пережатие — ради экономии трафика
+    needed = source_size if mode == "remux" else source_size * (1 - min_saving)
+    if size > needed:
+        Path(target).unlink(missing_ok=True)
+        result["reason"] = f"saving too small ({size} of {source_size} bytes)"
+        return result
+
+    result.update(kept=True, size=size)
+    return result
+
+
+class Transcoder:
+    """
+    Пул процессов для обработки видео.
+
+    Одновременно обрабатывается не больше workers видео; потоки ffmpeg
+    делят между собой лимит CPU контейнера. Без ffmpeg в системе
+    обработка выключается целиком.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        min_saving: float = 0.1,
+        crf: int = 26,
+        max_height: int = 0,
+        thumbnails: bool = True,
+        timeout: float = 3600
+    ):
+        self.cpus = cpu_limit()
+        self.workers = max(1, min(workers or self.cpus, self.cpus))
+        self.min_saving = min_saving
+        self.crf = crf
+        self.max_height = max_height
+        self.thumbnails = thumbnails
+        self.timeout = timeout
+
+        self.available = shutil.which("ffmpeg") is not None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        if not self.available:
+            logger.warning("ffmpeg not found, video processing is disabled")
+            return
+        # Процессы создаются при первой задаче, а не при старте бота; spawn —
+        # чтобы не копировать fork'ом процесс с потоками SQLite и event loop
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Video processing pool: {self.workers} workers, {self.cpus} CPUs")
+
+    async def close(self):
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, True, cancel_futures=True)
+            self._executor = None
+
+    async def process(self, source: Path, target: Path, mode: str, thumbnail: Optional[Path] = None) -> dict:
+        """Обрабатывает файл (см. process_file) в пуле процессов"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._executor,
+            process_file,
+            str(source),
+            str(target),
+            mode,
+            self.min_saving,
+            self.crf,
+            self.max_height,
+            max(1, self.cpus // self.workers),
+            str(thumbnail) if thumbnail and self.thumbnails else None,
+            self.timeout,
+        )
+
+        source_size = (await asyncio.to_thread(source.stat)).st_size
+        if result["kept"]:
+            metrics.TRANSCODE.labels(mode=mode, result="kept").inc()
+            metrics.TRANSCODE_SAVED_BYTES.inc(max(source_size - result["size"], 0))
+            logger.info(
+                f"Processed {source.name} ({mode}): "
+                f"{source_size / (1024*1024):.1f} -> {result['size'] / (1024*1024):.1f} MB"
+            )
+        else:
+            failed = result["reason"].startswith("ffmpeg failed")
+            metrics.TRANSCODE.labels(mode=mode, result="failed" if failed else "skipped").inc()
+            logger.info(f"Keeping original {source.name} ({mode}): {result['reason']}")
+        if result.get("thumbnail_error"):
+            logger.warning(f"Thumbnail for {source.name} failed: {result['thumbnail_error']}")
+
+        return result
@@ -3,46 +3,341 @@
 """
 
 import logging
+import random
 import aiohttp
 import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterable, Awaitable, Callable, List, Optional
+from urllib.parse import quote
+
+import metrics
+from dedup import ContentHasher
+from folder_cache import FolderCache
+from limiter import AdaptiveLimiter, AdaptiveLimits
+from storage import ProgressCallback, Source, StorageBackend
 
 logger = logging.getLogger(__name__)
 
 
-class YandexDiskClient:
-    """Асинхронный клиент для Яндекс Диска"""
+class YandexDiskError(Exception):
+    """Ошибка ответа Яндекс Диска (HTTP статус >= 400)"""
+
+    def __init__(
+        self,
+        message: str,
+        status: int,
+        retry_after: Optional[float] = None,
+        upload: bool = False,
+        retryable: bool = False
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.upload = upload  # Ошибка PUT по URL загрузки, а не вызова API
+        self.retryable = retryable  # Повтор поможет независимо от статуса
+
+
+class IntegrityError(Exception):
+    """Файл на Яндекс Диске не совпадает с отправленным (размер или хеш)"""
+
+
+def _parse_retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def _with_progress(
+    chunks: AsyncIterable[bytes],
+    total: Optional[int],
+    progress: Optional[ProgressCallback]
+) -> AsyncIterable[bytes]:
+    """Пропускает чанки дальше, сообщая, сколько байт уже отправлено"""
+    sent = 0
+    async for chunk in chunks:
+        yield chunk
+        sent += len(chunk)
+        if progress is not None:
+            await progress(sent, total or sent)
+
+
+async def _read_file(local_path: Path, chunk_size: int = 4 * 1024 * 1024) -> AsyncIterable[bytes]:
+    """
+    Читает файл крупными чанками в пуле потоков с упреждением на один чанк
+
+    Медленное чтение с SD карты не останавливает event loop, а следующий
+    чанк читается, пока предыдущий уходит в сеть.
+    """
+    f = await asyncio.to_thread(open, local_path, "rb")
+    pending = asyncio.ensure_future(asyncio.to_thread(f.read, chunk_size))
+    try:
+        while True:
+            chunk = await pending
+            if not chunk:
+                return
+            pending = asyncio.ensure_future(asyncio.to_thread(f.read, chunk_size))
+            yield chunk
+    finally:
+        # Чтение в потоке не отменить — дожидаемся его перед закрытием файла
+        await asyncio.gather(pending, return_exceptions=True)
+        await asyncio.to_thread(f.close)
+
+
+async def _read_bytes(data: bytes, chunk_size: int = 4 * 1024 * 1024) -> AsyncIterable[bytes]:
+    # Срезы memoryview не копируют данные
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Можно ли повторить операцию после такой ошибки
+
+    Повторяем сетевые сбои, таймауты, 429 и 5xx (кроме 507 — на диске
+    нет места). Для PUT также 404/410: URL загрузки истек, при повторе
+    будет получен новый. Несовпадение хеша после загрузки тоже
+    временное: испорченный файл удален, его можно загрузить заново.
+    Ошибки, помеченные retryable, повторяются при любом статусе.
+    """
+    if isinstance(error, IntegrityError):
+        return True
+    if isinstance(error, YandexDiskError):
+        if error.retryable:
+            return True
+        if error.status == 507:
+            return False
+        if error.status == 429 or error.status >= 500:
+            return True
+        return error.upload and error.status in (404, 410)
+
+    return isinstance(error, (
+        aiohttp.ClientConnectionError,
+        aiohttp.ClientPayloadError,
+        asyncio.TimeoutError,
+    ))
+
+
+class YandexDiskClient(StorageBackend):
+    """Асинхронный клиент для Яндекс Диска (загрузка через REST API)"""
+
+    name = "rest"
     
     BASE_URL = "https://cloud-api.yandex.net/v1/disk"
     
     ROOT_FOLDER = "Alisa"
 
-    def __init__(self, oauth_token: str):
+    # Имя адаптивного лимита для PUT файлов
+    UPLOAD_LIMIT = "upload"
+
+    def __init__(
+        self,
+        oauth_token: str,
+        pool_limit: int = 20,
+        pool_limit_per_host: int = 8,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 60,
+        max_retries: int = 5,
+        retry_base_delay: float = 2.0,
+        retry_max_delay: float = 120.0,
+        verify_timeout: float = 30.0,
+        verify_retries: int = 2,
+        folder_cache: Optional[FolderCache] = None,
+        upload_chunk_size: int = 4 * 1024 * 1024,
+        limits: Optional[AdaptiveLimits] = None,
+        limits_prefix: str = "yandex"
+    ):
         self.oauth_token = oauth_token
         self.headers = {
             "Authorization": f"OAuth {oauth_token}",
             "Content-Type": "application/json"
         }
-        self._folder_cache = {}  # Кэш созданных папок
-    
+        # Кэш созданных и опубликованных папок
+        self._folder_cache = folder_cache if folder_cache is not None else FolderCache()
+        self._folder_locks = defaultdict(asyncio.Lock)
+
+        # Параметры пула соединений (общие для API и загрузки файлов)
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+
+        # Повторы загрузки: экспоненциальная задержка со случайным разбросом
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        # Сверка хешей после загрузки: сколько ждать, пока Яндекс посчитает
+        # хеши, и сколько раз перезагружать файл при несовпадении
+        self.verify_timeout = verify_timeout
+        self.verify_retries = verify_retries
+
+        # Размер чанка тела PUT: файл читается такими кусками в пуле потоков
+        self.upload_chunk_size = upload_chunk_size
+
+        # Адаптивные лимиты параллельных запросов (None — только пул соединений).
+        # Потолок лимита — pool_limit_per_host, имена — "<limits_prefix>:<эндпоинт>"
+        self.limits = limits
+        self.limits_prefix = limits_prefix
+
+        self._api_session: Optional[aiohttp.ClientSession] = None
+        self._upload_session: Optional[aiohttp.ClientSession] = None
+
+    def _make_connector(self) -> aiohttp.TCPConnector:
+        return aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+
+    async def start(self):
+        """
+        Открывает долгоживущие сессии с пулом keep-alive соединений
+
+        API и загрузка файлов идут на разные хосты, поэтому у каждого
+        свой пул: долгий PUT не занимает соединения для вызовов API.
+        """
+        if self._api_session is None or self._api_session.closed:
+            self._api_session = aiohttp.ClientSession(
+                connector=self._make_connector(),
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=60, sock_connect=30),
+            )
+        if self._upload_session is None or self._upload_session.closed:
+            self._upload_session = aiohttp.ClientSession(
+                connector=self._make_connector(),
+                timeout=aiohttp.ClientTimeout(total=1800, sock_connect=30, sock_read=300),
+            )
+        logger.info(
+            f"Yandex Disk sessions started (pool {self.pool_limit}, "
+            f"{self.pool_limit_per_host} per host)"
+        )
+
+    async def close(self):
+        """Закрывает сессии и все соединения пула"""
+        for session in (self._api_session, self._upload_session):
+            if session is not None and not session.closed:
+                await session.close()
+        self._api_session = self._upload_session = None
+        logger.info("Yandex Disk sessions closed")
+
+    async def _get_api_session(self) -> aiohttp.ClientSession:
+        if self._api_session is None or self._api_session.closed:
+            await self.start()
+        return self._api_session
+
+    async def _get_upload_session(self) -> aiohttp.ClientSession:
+        if self._upload_session is None or self._upload_session.closed:
+            await self.start()
+        return self._upload_session
+
+    @staticmethod
+    def _count_request(endpoint: str, method: str, status):
+        metrics.API_REQUESTS.labels(endpoint=endpoint, method=method, status=status).inc()
+        if not isinstance(status, int) or status >= 400:
+            metrics.API_ERRORS.labels(endpoint=endpoint, status=status).inc()
+
+    def _limiter(self, endpoint: str) -> Optional[AdaptiveLimiter]:
+        if self.limits is None:
+            return None
+        return self.limits.get(f"{self.limits_prefix}:{endpoint}", self.pool_limit_per_host)
+
+    @asynccontextmanager
+    async def _limited(self, endpoint: str, amount: float = 1.0):
+        """
+        Место в адаптивном лимите эндпоинта на время запроса
+
+        429 и 5xx уменьшают лимит (с учетом Retry-After), успешный запрос
+        сообщает лимиту свою длительность на amount единиц работы.
+        """
+        limiter = self._limiter(endpoint)
+        if limiter is None:
+            yield
+            return
+        async with limiter.slot():
+            started = time.monotonic()
+            try:
+                yield
+            except YandexDiskError as e:
+                if e.status == 429 or e.status >= 500:
+                    limiter.throttle(e.retry_after, reason=f"HTTP {e.status}")
+                raise
+            limiter.success(time.monotonic() - started, amount)
+
     async def _make_request(self, method: str, url: str, **kwargs) -> dict:
         """Выполняет HTTP запрос к API"""
-        async with aiohttp.ClientSession() as session:
-            async with session.request(
-                method, url, headers=self.headers, **kwargs
-            ) as response:
+        async with self._limited("api"):
+            return await self._request(method, url, **kwargs)
+
+    async def _request(self, method: str, url: str, **kwargs) -> dict:
+        session = await self._get_api_session()
+        endpoint = url[len(self.BASE_URL):] or "/"
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                self._count_request(endpoint, method, response.status)
                 if response.status >= 400:
                     error_text = await response.text()
-                    raise Exception(
-                        f"Yandex Disk API error [{response.status}]: {error_text}"
+                    raise YandexDiskError(
+                        f"Yandex Disk API error [{response.status}]: {error_text}",
+                        status=response.status,
+                        retry_after=_parse_retry_after(response),
                     )
+                if response.status == 204:
+                    return {}
                 return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._count_request(endpoint, method, type(e).__name__)
+            raise
+
+    def _retry_delay(self, attempt: int, error: BaseException) -> float:
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.retry_max_delay)
+        # Full jitter: случайная задержка от 0 до экспоненциального потолка
+        ceiling = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    async def _with_retries(
+        self,
+        operation: Callable[[int], Awaitable],
+        description: str
+    ):
+        """Выполняет operation(номер попытки), повторяя ее при временных ошибках"""
+        attempt = 1
+        while True:
+            try:
+                return await operation(attempt)
+            except Exception as e:
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._retry_delay(attempt, e)
+                logger.warning(
+                    f"{description} failed (attempt {attempt}/{self.max_retries + 1}): "
+                    f"{e!r}; retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
     
     async def create_folder(self, folder_path: str) -> bool:
         """Создает папку на Яндекс Диске (если не существует)"""
+        # Параллельные задачи (например, видео одного альбома) создают папку один раз
+        async with self._folder_locks[("create", folder_path)]:
+            if self._folder_cache.exists(folder_path):
+                logger.info(f"Folder {folder_path} already exists (cached)")
+                return False
+            # Другие процессы бота (воркеры) создают ту же папку по очереди
+            async with self._folder_cache.shared_lock():
+                return await self._create_folder(folder_path)
+
+    async def _create_folder(self, folder_path: str) -> bool:
         # Проверяем кэш
-        if folder_path in self._folder_cache:
+        if self._folder_cache.exists(folder_path):
             logger.info(f"Folder {folder_path} already exists (cached)")
             return False
         
@@ -50,9 +345,11 @@ class YandexDiskClient:
             url = f"{self.BASE_URL}/resources"
             params = {"path": folder_path}
             
-            await self._make_request("PUT", url, params=params)
+            with metrics.measure_stage("create_folder"):
+                await self._make_request("PUT", url, params=params)
             logger.info(f"Folder created: {folder_path}")
-            self._folder_cache[folder_path] = True
+            self._folder_cache.mark_exists(folder_path)
+            await self._folder_cache.save()
             return True
             
         except Exception as e:
@@ -60,48 +357,242 @@ class YandexDiskClient:
             # Если папка уже существует - это не ошибка
             if "DiskPathPointsToExistentDirectoryError" in error_msg:
                 logger.info(f"Folder already exists: {folder_path}")
-                self._folder_cache[folder_path] = True
+                self._folder_cache.mark_exists(folder_path)
+                await self._folder_cache.save()
                 return False
             raise
     
-    async def upload_file(self, local_path: Path, remote_path: str) -> str:
-        """
-        Загружает файл на Яндекс Диск
-        
-        Args:
-            local_path: Локальный путь к файлу
-            remote_path: Путь на Яндекс Диске (например, "2024-01-15/video.mp4")
-        
-        Returns:
-            URL для загрузки
-        """
-        # Получаем URL для загрузки
+    async def _get_upload_url(self, remote_path: str) -> str:
+        """Получает URL для загрузки файла"""
         url = f"{self.BASE_URL}/resources/upload"
         params = {
             "path": remote_path,
             "overwrite": "false"  # Не перезаписываем существующие файлы
         }
-        
+
         logger.info(f"Getting upload URL for {remote_path}")
         upload_info = await self._make_request("GET", url, params=params)
-        upload_url = upload_info["href"]
         logger.info(f"Got upload URL, starting upload...")
+        return upload_info["href"]
 
-        file_size = local_path.stat().st_size
-        timeout = aiohttp.ClientTimeout(total=1800, sock_connect=30, sock_read=300)
-        logger.info(f"Uploading {file_size / (1024*1024):.1f} MB to {upload_url[:80]}...")
-
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            with open(local_path, 'rb') as f:
-                async with session.put(upload_url, data=f) as response:
+    async def _put_data(self, upload_url: str, data, headers: Optional[dict] = None):
+        """Отправляет тело файла по URL загрузки"""
+        # Задержка считается на мегабайт (не меньше одного), иначе
+        # большие файлы выглядели бы для лимита медленными ответами
+        size = int((headers or {}).get("Content-Length", 0))
+        session = await self._get_upload_session()
+        async with self._limited(self.UPLOAD_LIMIT, max(size / (1024 * 1024), 1.0)):
+            try:
+                async with session.put(upload_url, data=data, headers=headers) as response:
+                    self._count_request("upload", "PUT", response.status)
                     if response.status >= 400:
                         error_text = await response.text()
-                        raise Exception(
-                            f"Upload failed [{response.status}]: {error_text}"
+                        raise YandexDiskError(
+                            f"Upload failed [{response.status}]: {error_text}",
+                            status=response.status,
+                            retry_after=_parse_retry_after(response),
+                            upload=True,
                         )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._count_request("upload", "PUT", type(e).__name__)
+                raise
+
+    async def get_resource(self, remote_path: str) -> Optional[dict]:
+        """Метаданные файла или папки (None, если ресурса нет)"""
+        url = f"{self.BASE_URL}/resources"
+        params = {"path": remote_path}
+
+        try:
+            return await self._make_request("GET", url, params=params)
+        except YandexDiskError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def delete_resource(self, remote_path: str):
+        """Удаляет файл с Яндекс Диска безвозвратно (минуя корзину)"""
+        url = f"{self.BASE_URL}/resources"
+        params = {"path": remote_path, "permanently": "true"}
+
+        try:
+            await self._make_request("DELETE", url, params=params)
+            logger.info(f"Deleted {remote_path}")
+        except YandexDiskError as e:
+            if e.status != 404:
+                raise
+
+    async def verify_upload(self, remote_path: str, size: int, md5: str, sha256: str) -> bool:
+        """
+        Сверяет загруженный файл с размером и хешами, посчитанными при отправке
+
+        Яндекс Диск считает md5 и sha256 сам, иногда не сразу после PUT —
+        тогда метаданные перечитываются до verify_timeout секунд.
+
+        Returns:
+            True — файл совпал, False — хеши так и не появились (файл не проверен)
+
+        Raises:
+            IntegrityError: размер или хеш не совпадает
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.verify_timeout
+        delay = 0.5
+
+        while True:
+            resource = await self._with_retries(
+                lambda attempt: self.get_resource(remote_path),
+                f"Verifying {remote_path}"
+            )
+            if resource is not None:
+                if resource.get("size") != size:
+                    raise IntegrityError(
+                        f"Size mismatch for {remote_path}: "
+                        f"sent {size} bytes, stored {resource.get('size')}"
+                    )
+                remote_md5, remote_sha256 = resource.get("md5"), resource.get("sha256")
+                if remote_md5 or remote_sha256:
+                    if (remote_sha256 and remote_sha256 != sha256) or (remote_md5 and remote_md5 != md5):
+                        raise IntegrityError(
+                            f"Hash mismatch for {remote_path}: sent sha256 {sha256}, "
+                            f"stored {remote_sha256 or 'md5 ' + str(remote_md5)}"
+                        )
+                    return True
+
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    async def _already_uploaded(self, remote_path: str, size: int) -> bool:
+        """Проверяет, не дошел ли файл после оборванного ответа на PUT"""
+        resource = await self.get_resource(remote_path)
+        return resource is not None and resource.get("size") == size
+
+    async def _upload_repeatable(
+        self,
+        body: Callable[[], AsyncIterable[bytes]],
+        size: int,
+        remote_path: str
+    ) -> str:
+        """
+        Загружает содержимое, которое можно отправить заново (файл или данные в памяти)
+
+        При временных ошибках загрузка повторяется с новым URL загрузки,
+        body() дает тело запроса с начала.
+        """
+        async def attempt(number: int) -> Optional[str]:
+            if number > 1 and await self._already_uploaded(remote_path, size):
+                logger.info(f"File already on disk after failed attempt: {remote_path}")
+                return None
+
+            upload_url = await self._get_upload_url(remote_path)
+            logger.info(f"Uploading {size / (1024*1024):.1f} MB to {upload_url[:80]}...")
+
+            await self._put_data(upload_url, body(), headers={"Content-Length": str(size)})
+            return upload_url
+
+        upload_url = await self._with_retries(attempt, f"Upload of {remote_path}")
 
         logger.info(f"File uploaded: {remote_path}")
         return upload_url
+
+    async def upload_file(
+        self,
+        local_path: Path,
+        remote_path: str,
+        progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """
+        Загружает файл на Яндекс Диск
+        
+        Args:
+            local_path: Локальный путь к файлу
+            remote_path: Путь на Яндекс Диске (например, "2024-01-15/video.mp4")
+            progress: Callback (отправлено байт, всего байт)
+        
+        Returns:
+            URL для загрузки
+
+        При временных ошибках загрузка повторяется с новым URL загрузки;
+        локальный файл при этом читается заново, а не скачивается.
+        """
+        file_size = (await asyncio.to_thread(local_path.stat)).st_size
+        return await self._upload_repeatable(
+            lambda: _with_progress(
+                _read_file(local_path, self.upload_chunk_size), file_size, progress
+            ),
+            file_size,
+            remote_path,
+        )
+
+    async def upload_bytes(
+        self,
+        data: bytes,
+        remote_path: str,
+        progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """
+        Загружает на Яндекс Диск видео из памяти (небольшие видео без временного файла)
+
+        Данные, как и файл, можно отправить заново, поэтому загрузка
+        повторяется при временных ошибках.
+        """
+        return await self._upload_repeatable(
+            lambda: _with_progress(_read_bytes(data, self.upload_chunk_size), len(data), progress),
+            len(data),
+            remote_path,
+        )
+
+    async def upload_thumbnail(self, local_path: Path, folder_name: str, filename: str) -> str:
+        """
+        Загружает превью видео в подпапку thumbnails папки даты
+
+        Returns:
+            Путь превью на Яндекс Диске
+        """
+        folder = f"{self.ROOT_FOLDER}/{folder_name}/{self.THUMBNAILS_FOLDER}"
+        await self.create_folder(folder)
+        remote_path = f"{folder}/{filename}"
+        await self.upload_file(local_path, remote_path)
+        return remote_path
+
+    async def upload_stream(
+        self,
+        stream: AsyncIterable[bytes],
+        remote_path: str,
+        size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> str:
+        """
+        Загружает на Яндекс Диск данные из асинхронного потока чанков
+
+        Args:
+            stream: Источник чанков (например, StreamBuffer)
+            remote_path: Путь на Яндекс Диске
+            size: Размер файла в байтах (если известен — без chunked-кодирования)
+            progress: Callback (отправлено байт, всего байт)
+
+        Returns:
+            URL для загрузки
+
+        Поток нельзя перечитать, поэтому повторяется только получение URL
+        загрузки; ошибку самого PUT обрабатывает вызывающий код.
+        """
+        upload_url = await self._with_retries(
+            lambda attempt: self._get_upload_url(remote_path),
+            f"Getting upload URL for {remote_path}"
+        )
+
+        headers = {"Content-Length": str(size)} if size is not None else None
+        size_text = f"{size / (1024*1024):.1f} MB" if size is not None else "stream"
+        logger.info(f"Streaming {size_text} to {upload_url[:80]}...")
+
+        await self._put_data(
+            upload_url, _with_progress(stream, size, progress), headers=headers
+        )
+
+        logger.info(f"Stream uploaded: {remote_path}")
+        return upload_url
     
     async def publish_folder(self, folder_path: str) -> str:
         """
@@ -113,19 +604,34 @@ class YandexDiskClient:
         Returns:
             Публичная ссылка на папку
         """
+        async with self._folder_locks[("publish", folder_path)]:
+            public_url = self._folder_cache.public_url(folder_path)
+            if public_url:
+                logger.info(f"Folder {folder_path} already published (cached)")
+                return public_url
+            async with self._folder_cache.shared_lock():
+                return await self._publish_folder(folder_path)
+
+    async def _publish_folder(self, folder_path: str) -> str:
+        public_url = self._folder_cache.public_url(folder_path)
+        if public_url:
+            logger.info(f"Folder {folder_path} already published (cached)")
+            return public_url
+
         url = f"{self.BASE_URL}/resources/publish"
         params = {"path": folder_path}
         
-        try:
-            await self._make_request("PUT", url, params=params)
-            logger.info(f"Folder published: {folder_path}")
-        except Exception as e:
-            if "DiskResourceAlreadyPublishedError" not in str(e):
-                raise
-            logger.info(f"Folder already published: {folder_path}")
+        with metrics.measure_stage("publish"):
+            try:
+                await self._make_request("PUT", url, params=params)
+                logger.info(f"Folder published: {folder_path}")
+            except Exception as e:
+                if "DiskResourceAlreadyPublishedError" not in str(e):
+                    raise
+                logger.info(f"Folder already published: {folder_path}")
 
-        # Получаем публичную ссылку
-        return await self.get_public_url(folder_path)
+            # Получаем публичную ссылку
+            return await self.get_public_url(folder_path)
     
     async def get_public_url(self, folder_path: str) -> str:
         """Получает публичную ссылку на ресурс"""
@@ -136,25 +642,199 @@ class YandexDiskClient:
         
         if "public_url" not in result:
             raise Exception(f"Folder {folder_path} is not published")
-        
+
+        self._folder_cache.mark_exists(folder_path, result["public_url"])
+        await self._folder_cache.save()
         return result["public_url"]
+
+    async def list_folders(self, folder_path: str, page_size: int = 1000) -> List[dict]:
+        """
+        Возвращает подпапки папки с их публичными ссылками (постранично)
+
+        Returns:
+            Записи с ключами path и public_url (None, если папка не опубликована)
+        """
+        url = f"{self.BASE_URL}/resources"
+        folders = []
+        offset = 0
+
+        while True:
+            params = {
+                "path": folder_path,
+                "limit": page_size,
+                "offset": offset,
+                "fields": "_embedded.items.name,_embedded.items.type,"
+                          "_embedded.items.public_url,_embedded.total",
+            }
+            result = await self._make_request("GET", url, params=params)
+            embedded = result.get("_embedded", {})
+            items = embedded.get("items", [])
+
+            for item in items:
+                if item.get("type") == "dir":
+                    folders.append({
+                        "path": f"{folder_path}/{item['name']}",
+                        "public_url": item.get("public_url"),
+                    })
+
+            offset += len(items)
+            if not items or offset >= embedded.get("total", 0):
+                break
+
+        return folders
+
+    async def warm_folder_cache(self) -> List[str]:
+        """
+        Заполняет кэш папок одним постраничным листингом корневой папки
+
+        Returns:
+            Имена папок дат, которые есть на диске
+        """
+        try:
+            folders = await self.list_folders(self.ROOT_FOLDER)
+        except YandexDiskError as e:
+            if e.status == 404:
+                logger.info(f"Root folder {self.ROOT_FOLDER} does not exist yet")
+                return []
+            raise
+
+        self._folder_cache.mark_exists(self.ROOT_FOLDER)
+        self._folder_cache.warm(folders)
+        await self._folder_cache.save()
+        return [folder["path"].rsplit("/", 1)[-1] for folder in folders]
     
+    async def list_files(self, folder_path: str, page_size: int = 1000) -> List[dict]:
+        """
+        Возвращает все файлы внутри папки (рекурсивно) с хешами содержимого
+
+        Использует плоский список /resources/files с пагинацией — это
+        несколько запросов на весь диск вместо обхода каждой подпапки.
+
+        Returns:
+            Записи с ключами path (без префикса "disk:/"), size, md5, sha256
+        """
+        url = f"{self.BASE_URL}/resources/files"
+        prefix = f"{folder_path.strip('/')}/"
+        files = []
+        offset = 0
+
+        while True:
+            params = {
+                "limit": page_size,
+                "offset": offset,
+                "fields": "items.path,items.size,items.md5,items.sha256",
+            }
+            result = await self._make_request("GET", url, params=params)
+            items = result.get("items", [])
+
+            for item in items:
+                path = item.get("path", "")
+                if path.startswith("disk:/"):
+                    path = path[len("disk:/"):]
+                if path.startswith(prefix):
+                    files.append({
+                        "path": path,
+                        "size": item.get("size", 0),
+                        "md5": item.get("md5"),
+                        "sha256": item.get("sha256"),
+                    })
+
+            if len(items) < page_size:
+                break
+            offset += page_size
+
+        logger.info(f"Listed {len(files)} files under {folder_path}")
+        return files
+
+    async def _upload_source(
+        self,
+        source: Source,
+        remote_path: str,
+        size: Optional[int],
+        progress: Optional[ProgressCallback]
+    ):
+        if isinstance(source, Path):
+            await self.upload_file(source, remote_path, progress)
+        elif isinstance(source, bytes):
+            await self.upload_bytes(source, remote_path, progress)
+        else:
+            await self.upload_stream(source, remote_path, size, progress)
+
+    @staticmethod
+    def _is_missing_folder(error: "YandexDiskError") -> bool:
+        """Загрузка не удалась, потому что папки назначения нет"""
+        return "DiskPathDoesntExistsError" in str(error)
+
+    async def _upload_to_folder(
+        self,
+        source: Source,
+        date_folder: str,
+        remote_path: str,
+        size: Optional[int],
+        progress: Optional[ProgressCallback]
+    ):
+        try:
+            await self._upload_source(source, remote_path, size, progress)
+        except YandexDiskError as e:
+            # Папку удалили вручную, а кэш об этом не знает
+            if not self._is_missing_folder(e):
+                raise
+            logger.warning(f"Cached folder {date_folder} no longer exists, recreating")
+            await self._folder_cache.invalidate(self.ROOT_FOLDER)
+            await self.create_folder(self.ROOT_FOLDER)
+            await self.create_folder(date_folder)
+            # Поток, часть которого уже ушла в PUT, не перечитать — повтор
+            # выгрузки (например, с диска) делает вызывающий код
+            if e.upload and not isinstance(source, (Path, bytes)):
+                raise YandexDiskError(
+                    f"Folder {date_folder} was recreated, the stream cannot be replayed",
+                    e.status, upload=True, retryable=True
+                ) from e
+            await self._upload_source(source, remote_path, size, progress)
+
+    async def _verify(self, remote_path: str, hasher: ContentHasher):
+        with metrics.measure_stage("verify"):
+            hasher.verified = await self.verify_upload(
+                remote_path, hasher.size, hasher.md5, hasher.sha256
+            )
+        if hasher.verified:
+            metrics.UPLOAD_VERIFICATIONS.labels(result="ok").inc()
+            logger.info(f"Upload verified: {remote_path} (sha256 {hasher.sha256})")
+        else:
+            metrics.UPLOAD_VERIFICATIONS.labels(result="unverified").inc()
+            logger.warning(
+                f"Yandex Disk did not report hashes for {remote_path} "
+                f"within {self.verify_timeout:.0f}s, upload is unverified"
+            )
+
     async def upload_video(
         self, 
-        local_path: Path, 
+        source: Source,
         folder_name: str, 
-        filename: str
+        filename: str,
+        size: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        hasher: Optional[ContentHasher] = None
     ) -> str:
         """
         Загружает видео в папку по дате и возвращает публичную ссылку на папку
         
         Args:
-            local_path: Локальный путь к видео файлу
+            source: Локальный путь к видео файлу, данные в памяти или поток чанков
             folder_name: Название папки (обычно дата YYYY-MM-DD)
             filename: Имя файла на диске
+            size: Размер видео в байтах (для потоковой загрузки)
+            progress: Callback прогресса выгрузки (отправлено байт, всего байт)
+            hasher: Хеши отправленного содержимого (к концу загрузки должны
+                быть посчитаны) — если заданы, файл сверяется с Яндекс Диском
         
         Returns:
             Публичная ссылка на папку
+
+        Raises:
+            IntegrityError: файл не совпал с отправленным (испорченная копия
+                уже удалена; поток перечитать нельзя, файл и данные — после
+                verify_retries перезагрузок)
         """
         # Создаем корневую папку и подпапку по дате
         await self.create_folder(self.ROOT_FOLDER)
@@ -163,7 +843,25 @@ class YandexDiskClient:
 
         # Загружаем файл
         remote_path = f"{date_folder}/{filename}"
-        await self.upload_file(local_path, remote_path)
+        attempt = 1
+        while True:
+            await self._upload_to_folder(source, date_folder, remote_path, size, progress)
+            if hasher is None:
+                break
+            try:
+                await self._verify(remote_path, hasher)
+                break
+            except IntegrityError as e:
+                metrics.UPLOAD_VERIFICATIONS.labels(result="mismatch").inc()
+                logger.error(str(e))
+                # Иначе повторная загрузка упрется в overwrite=false
+                await self.delete_resource(remote_path)
+                if not isinstance(source, (Path, bytes)) or attempt > self.verify_retries:
+                    raise
+                logger.warning(
+                    f"Re-uploading {remote_path} (attempt {attempt + 1}/{self.verify_retries + 1})"
+                )
+                attempt += 1
 
         # Публикуем папку и получаем ссылку
         public_url = await self.publish_folder(date_folder)
@@ -177,9 +875,79 @@ class YandexDiskClient:
         
         total_space = result.get("total_space", 0)
         used_space = result.get("used_space", 0)
-        
+
         return {
+            "total_space": total_space,
+            "used_space": used_space,
             "total_gb": total_space / (1024 ** 3),
             "used_gb": used_space / (1024 ** 3),
             "used_percent": (used_space / total_space * 100) if total_space > 0 else 0
         }
+
+
+class YandexWebDAVClient(YandexDiskClient):
+    """
+    Загрузка на Яндекс Диск через WebDAV.
+
+    Файл отправляется одним PUT прямо на webdav.yandex.ru по keep-alive
+    соединению пула загрузки, папки создаются через MKCOL — без запроса
+    URL загрузки через REST API на каждое видео. Публикация папок, сверка
+    хешей, квота и листинги по-прежнему идут через REST API.
+    """
+
+    name = "webdav"
+
+    WEBDAV_URL = "https://webdav.yandex.ru"
+
+    # MKCOL и PUT идут на один хост — у них общий лимит
+    UPLOAD_LIMIT = "webdav"
+
+    def _webdav_url(self, remote_path: str) -> str:
+        return f"{self.WEBDAV_URL}/{quote(remote_path.strip('/'))}"
+
+    async def _create_folder(self, folder_path: str) -> bool:
+        if self._folder_cache.exists(folder_path):
+            logger.info(f"Folder {folder_path} already exists (cached)")
+            return False
+
+        session = await self._get_upload_session()
+        with metrics.measure_stage("create_folder"):
+            async with self._limited(self.UPLOAD_LIMIT):
+                created = await self._mkcol(session, folder_path)
+
+        logger.info(f"Folder {'created' if created else 'already exists'}: {folder_path}")
+        self._folder_cache.mark_exists(folder_path)
+        await self._folder_cache.save()
+        return created
+
+    async def _mkcol(self, session: aiohttp.ClientSession, folder_path: str) -> bool:
+        """MKCOL папки (False — папка уже существует)"""
+        try:
+            async with session.request(
+                "MKCOL", self._webdav_url(folder_path), headers=self.headers
+            ) as response:
+                self._count_request("webdav", "MKCOL", response.status)
+                # 405 — папка уже существует
+                if response.status >= 400 and response.status != 405:
+                    error_text = await response.text()
+                    raise YandexDiskError(
+                        f"WebDAV MKCOL failed [{response.status}]: {error_text}",
+                        status=response.status,
+                        retry_after=_parse_retry_after(response),
+                    )
+                return response.status != 405
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._count_request("webdav", "MKCOL", type(e).__name__)
+            raise
+
+    async def _get_upload_url(self, remote_path: str) -> str:
+        return self._webdav_url(remote_path)
+
+    async def _put_data(self, upload_url: str, data, headers: Optional[dict] = None):
+        headers = {**(headers or {}), "Authorization": self.headers["Authorization"]}
+        await super()._put_data(upload_url, data, headers=headers)
+
+    @staticmethod
+    def _is_missing_folder(error: YandexDiskError) -> bool:
+        # WebDAV отвечает 409 Conflict на PUT в несуществующую папку
+        return error.upload and error.status == 409